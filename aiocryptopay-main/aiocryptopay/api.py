@@ -19,17 +19,29 @@ from .models.update import Update
 from .models.check import Check
 from .models.app_stats import AppStats
 
-from .utils.exchange import get_rate, get_rate_summ
-
-from datetime import datetime
-from hmac import HMAC
+from .utils.exchange import get_rate, get_rate_summ, index_rates, RatesIndex
+from .utils.pagination import MAX_PAGE_SIZE, paginate, stop_condition
+from .utils.bulk import BULK_CONCURRENCY, BULK_RATE_LIMIT, RateLimiter, run_bulk
+from .utils.pagination import parse_datetime
+from .utils.polling import CursorStore, PollCursor
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from hmac import HMAC, compare_digest
 from hashlib import sha256
-from typing import Optional, Union, List, Callable
+from typing import Optional, Union, List, Callable, AsyncIterator, Iterable
 
 from aiohttp.web import Response
 from aiohttp.web_request import Request
 
 
+logger = logging.getLogger(__name__)
+
+
 class AioCryptoPay(BaseClient):
     """
     CryptoPay API client.
@@ -40,18 +52,33 @@ class AioCryptoPay(BaseClient):
     API_DOCS = "https://help.crypt.bot/crypto-pay-api"
 
     def __init__(
-        self, token: str, network: Union[str, Networks] = Networks.MAIN_NET
+        self,
+        token: str,
+        network: Union[str, Networks] = Networks.MAIN_NET,
+        rates_ttl: float = 60,
+        rate_limit: float = BULK_RATE_LIMIT,
+        **client_options,
     ) -> None:
-        super().__init__()
+        super().__init__(**client_options)
         """
         Init CryptoPay API client
             :param token: Your API token from @CryptoBot
             :param network: Network address https://help.crypt.bot/crypto-pay-api#HYA3
+            :param rates_ttl: Seconds to reuse exchange rates in conversions, 0 disables the cache
+            :param rate_limit: Requests per second for bulk methods (create_invoices, create_checks, transfers)
+            :param client_options: Session, timeout, connection pool and fast mode options of BaseClient
         """
         self.__token = token
         self.network = network
         self.__headers = {"Crypto-Pay-API-Token": token}
+        # Webhook HMAC key is sha256(token); derive it once instead of per update
+        self.__signature_key = sha256(token.encode("UTF-8")).digest()
         self._handlers = []
+        self.rates_ttl = rates_ttl
+        self._rates_index: Optional[RatesIndex] = None
+        self._rates_expires_at = 0.0
+        self._rates_refresh: Optional[asyncio.Future] = None
+        self.rate_limiter = RateLimiter(rate_limit)
 
     async def get_me(self) -> Profile:
         """
@@ -134,7 +161,47 @@ class AioCryptoPay(BaseClient):
         response = await self._make_request(
             method=method, url=url, headers=self.__headers
         )
-        return [ExchangeRate(**rate) for rate in response["result"]]
+        rates = [ExchangeRate(**rate) for rate in response["result"]]
+        self._rates_index = index_rates(rates)
+        self._rates_expires_at = time.monotonic() + self.rates_ttl
+        return rates
+
+    async def get_rates_index(self) -> RatesIndex:
+        """
+        Exchange rates keyed by (source, target), cached for rates_ttl seconds.
+        Concurrent callers share a single getExchangeRates request.
+
+        Returns:
+            RatesIndex: rates keyed by (source, target)
+        """
+        if self._rates_index is not None and time.monotonic() < self._rates_expires_at:
+            return self._rates_index
+        refresh = self._rates_refresh
+        if refresh is None:
+            refresh = self._rates_refresh = asyncio.ensure_future(
+                self.get_exchange_rates()
+            )
+        try:
+            # shield: a cancelled caller must not cancel the request others are waiting for
+            await asyncio.shield(refresh)
+        finally:
+            if refresh.done() and self._rates_refresh is refresh:
+                self._rates_refresh = None
+        return self._rates_index
+
+    async def get_exchange_rate(
+        self, source: Union[Assets, str], target: str
+    ) -> Optional[ExchangeRate]:
+        """Get a single rate from the cached index
+
+        Args:
+            source (Union[Assets, str]): Currency code, e.g. "TON".
+            target (str): Currency code, e.g. "USD".
+
+        Returns:
+            Optional[ExchangeRate]: the rate or None if the pair is unknown
+        """
+        return get_rate(source=source, target=target, rates=await self.get_rates_index())
 
     async def get_currencies(self) -> List[Currency]:
         """
@@ -271,8 +338,8 @@ class AioCryptoPay(BaseClient):
         )
         if len(response["result"]["items"]) > 0:
             if invoice_ids and isinstance(invoice_ids, int):
-                return Invoice(**response["result"]["items"][0])
-            return [Invoice(**invoice) for invoice in response["result"]["items"]]
+                return self._build(Invoice, response["result"]["items"][0])
+            return [self._build(Invoice, invoice) for invoice in response["result"]["items"]]
 
     async def delete_invoice(self, invoice_id: int) -> bool:
         """
@@ -384,8 +451,8 @@ class AioCryptoPay(BaseClient):
         )
         if len(response["result"]["items"]) > 0:
             if transfer_ids and isinstance(transfer_ids, int):
-                return Transfer(**response["result"]["items"][0])
-            return [Transfer(**transfer) for transfer in response["result"]["items"]]
+                return self._build(Transfer, response["result"]["items"][0])
+            return [self._build(Transfer, transfer) for transfer in response["result"]["items"]]
 
     async def create_check(
         self,
@@ -471,8 +538,8 @@ class AioCryptoPay(BaseClient):
 
         if len(response["result"]["items"]) > 0:
             if check_ids and isinstance(check_ids, int):
-                return Check(**response["result"]["items"][0])
-            return [Check(**check) for check in response["result"]["items"]]
+                return self._build(Check, response["result"]["items"][0])
+            return [self._build(Check, check) for check in response["result"]["items"]]
 
     async def delete_check(self, check_id: int) -> bool:
         """
@@ -495,45 +562,312 @@ class AioCryptoPay(BaseClient):
         )
         return response["result"]
 
-    def check_signature(self, body_text: str, crypto_pay_signature: str) -> bool:
+    def iter_invoices(
+        self,
+        asset: Optional[Union[Assets, str]] = None,
+        invoice_ids: Optional[List[int]] = None,
+        status: Optional[Union[InvoiceStatus, str]] = None,
+        after_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> AsyncIterator[Invoice]:
+        """
+        Iterate over all invoices, newest first, fetching pages of page_size
+        and prefetching the next page while the current one is consumed.
+
+        Args:
+            asset (Optional[Union[Assets, str]], optional): Filter by currency code.
+            invoice_ids (Optional[List[int]], optional): Filter by invoice IDs.
+            status (Optional[Union[InvoiceStatus, str]], optional): Filter by status.
+            after_id (Optional[int], optional): Stop at the first invoice with invoice_id <= after_id.
+            since (Optional[datetime], optional): Stop at the first invoice created before since.
+            page_size (int, optional): Invoices per request, 1-1000. Defaults to 1000.
+
+        Returns:
+            AsyncIterator[Invoice]: async iterator of invoices
+        """
+        return paginate(
+            lambda offset, count: self.get_invoices(
+                asset=asset, invoice_ids=invoice_ids, status=status, offset=offset, count=count
+            ),
+            page_size=page_size,
+            stop=stop_condition("invoice_id", "created_at", after_id, since),
+        )
+
+    def iter_transfers(
+        self,
+        asset: Optional[Union[Assets, str]] = None,
+        transfer_ids: Optional[List[int]] = None,
+        after_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> AsyncIterator[Transfer]:
+        """
+        Iterate over all transfers, newest first, see iter_invoices.
+
+        Args:
+            asset (Optional[Union[Assets, str]], optional): Filter by currency code.
+            transfer_ids (Optional[List[int]], optional): Filter by transfer IDs.
+            after_id (Optional[int], optional): Stop at the first transfer with transfer_id <= after_id.
+            since (Optional[datetime], optional): Stop at the first transfer completed before since.
+            page_size (int, optional): Transfers per request, 1-1000. Defaults to 1000.
+
+        Returns:
+            AsyncIterator[Transfer]: async iterator of transfers
+        """
+        return paginate(
+            lambda offset, count: self.get_transfers(
+                asset=asset, transfer_ids=transfer_ids, offset=offset, count=count
+            ),
+            page_size=page_size,
+            stop=stop_condition("transfer_id", "completed_at", after_id, since),
+        )
+
+    def iter_checks(
+        self,
+        asset: Optional[Union[Assets, str]] = None,
+        check_ids: Optional[List[int]] = None,
+        status: Optional[Union[CheckStatus, str]] = None,
+        after_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> AsyncIterator[Check]:
+        """
+        Iterate over all checks, newest first, see iter_invoices.
+
+        Args:
+            asset (Optional[Union[Assets, str]], optional): Filter by currency code.
+            check_ids (Optional[List[int]], optional): Filter by check IDs.
+            status (Optional[Union[CheckStatus, str]], optional): Filter by status.
+            after_id (Optional[int], optional): Stop at the first check with check_id <= after_id.
+            since (Optional[datetime], optional): Stop at the first check created before since.
+            page_size (int, optional): Checks per request, 1-1000. Defaults to 1000.
+
+        Returns:
+            AsyncIterator[Check]: async iterator of checks
+        """
+        return paginate(
+            lambda offset, count: self.get_checks(
+                asset=asset, check_ids=check_ids, status=status, offset=offset, count=count
+            ),
+            page_size=page_size,
+            stop=stop_condition("check_id", "created_at", after_id, since),
+        )
+
+    async def create_invoices(
+        self, specs: Iterable[dict], concurrency: int = BULK_CONCURRENCY
+    ) -> List[Union[Invoice, Exception]]:
+        """
+        Create many invoices with bounded concurrency and the client rate limit.
+
+        Args:
+            specs (Iterable[dict]): create_invoice keyword arguments for each invoice
+            concurrency (int, optional): Max requests in flight. Defaults to 5.
+
+        Returns:
+            List[Union[Invoice, Exception]]: Invoices in input order, an exception in place of a failed one
+        """
+        return await run_bulk(self.create_invoice, specs, concurrency, self.rate_limiter)
+
+    async def create_checks(
+        self, specs: Iterable[dict], concurrency: int = BULK_CONCURRENCY
+    ) -> List[Union[Check, Exception]]:
+        """
+        Create many checks with bounded concurrency and the client rate limit.
+
+        Args:
+            specs (Iterable[dict]): create_check keyword arguments for each check
+            concurrency (int, optional): Max requests in flight. Defaults to 5.
+
+        Returns:
+            List[Union[Check, Exception]]: Checks in input order, an exception in place of a failed one
+        """
+        return await run_bulk(self.create_check, specs, concurrency, self.rate_limiter)
+
+    async def transfers(
+        self, specs: Iterable[dict], concurrency: int = BULK_CONCURRENCY
+    ) -> List[Union[Transfer, Exception]]:
+        """
+        Send many transfers with bounded concurrency and the client rate limit.
+
+        Specs without spend_id get a random one, so a repeated request for the
+        same item is never paid twice. Pass your own spend_id to retry failed
+        items safely in a later call.
+
+        Args:
+            specs (Iterable[dict]): transfer keyword arguments for each transfer
+            concurrency (int, optional): Max requests in flight. Defaults to 5.
+
+        Returns:
+            List[Union[Transfer, Exception]]: Transfers in input order, an exception in place of a failed one
+        """
+        specs = [
+            spec if spec.get("spend_id") else {**spec, "spend_id": uuid.uuid4().hex}
+            for spec in specs
+        ]
+        return await run_bulk(self.transfer, specs, concurrency, self.rate_limiter)
+
+    def check_signature(
+        self, body_text: Union[str, bytes], crypto_pay_signature: Optional[str]
+    ) -> bool:
         """
         https://help.crypt.bot/crypto-pay-api#verifying-webhook-updates
 
         Args:
-            body_text (str): webhook update body
-            crypto_pay_signature (str): Crypto-Pay-Api-Signature header
+            body_text (Union[str, bytes]): webhook update body, raw bytes are accepted as is
+            crypto_pay_signature (Optional[str]): Crypto-Pay-Api-Signature header
 
         Returns:
             bool: is cryptopay api signature
         """
-        token = sha256(string=self.__token.encode("UTF-8")).digest()
+        if not crypto_pay_signature:
+            return False
+        if isinstance(body_text, str):
+            body_text = body_text.encode("UTF-8")
         signature = HMAC(
-            key=token, msg=body_text.encode("UTF-8"), digestmod=sha256
+            key=self.__signature_key, msg=body_text, digestmod=sha256
         ).hexdigest()
-        return signature == crypto_pay_signature
+        return compare_digest(
+            signature.encode("ascii"), crypto_pay_signature.encode("UTF-8")
+        )
 
     async def get_updates(self, request: Request) -> Response:
         """
         WebHook updates route
 
+        The body is read once and verified before it is parsed,
+        so forged requests never reach the JSON decoder or the models.
+
         Args:
             request (Request): WebHook request
 
         Returns:
-            Response: 200 status code for cryptopay api
-        """
-        body = await request.json()
-        body_text = await request.text()
-        crypto_pay_signature = request.headers.get(
-            "Crypto-Pay-Api-Signature", "No value"
-        )
-        signature = self.check_signature(
-            body_text=body_text, crypto_pay_signature=crypto_pay_signature
-        )
-        if signature:
+            Response: 200 status code for cryptopay api, 401 for a bad signature
+        """
+        body = await request.read()
+        crypto_pay_signature = request.headers.get("Crypto-Pay-Api-Signature")
+        if not self.check_signature(
+            body_text=body, crypto_pay_signature=crypto_pay_signature
+        ):
+            return Response(status=401, text="Invalid signature")
+        if self._handlers:
+            update = Update(**json.loads(body))
             for handler in self._handlers:
-                await handler(Update(**body), request.app)
-            return Response(text="Status OK!")
+                await handler(update, request.app)
+        return Response(text="Status OK!")
+
+    async def poll_paid_invoices(
+        self,
+        cursor_store: Optional[CursorStore] = None,
+        lookback: timedelta = timedelta(days=1),
+        min_interval: float = 1.0,
+        max_interval: float = 30.0,
+        concurrency: int = 10,
+    ) -> AsyncIterator[Invoice]:
+        """
+        Stream newly paid invoices by polling, an alternative to the webhook.
+
+        Every poll reads paid invoices created within lookback of the cursor,
+        delivers the ones paid after it in payment order, runs the registered
+        pay handlers with at most `concurrency` at a time and then yields them.
+        The cursor is saved after a batch is consumed, so delivery is at least once.
+        Polls repeat every min_interval after activity and slow down twice per idle
+        poll up to max_interval. On the first run only payments from now on are
+        delivered.
+
+        Args:
+            cursor_store (Optional[CursorStore], optional): Where to keep the cursor, e.g.
+                FileCursorStore("cursor.json"). Defaults to memory.
+            lookback (timedelta, optional): Oldest invoice creation time to check relative to
+                the cursor; keep it above your invoices' expires_in. Defaults to 1 day.
+            min_interval (float, optional): Seconds between polls after activity. Defaults to 1.
+            max_interval (float, optional): Seconds between polls when idle. Defaults to 30.
+            concurrency (int, optional): Max pay handlers running at once. Defaults to 10.
+
+        Returns:
+            AsyncIterator[Invoice]: async iterator of paid invoices
+        """
+        cursor_store = cursor_store or CursorStore()
+        cursor = await cursor_store.load()
+        interval = min_interval
+        while True:
+            try:
+                if cursor is None:
+                    cursor = await self._initial_poll_cursor(lookback)
+                    await cursor_store.save(cursor)
+                fresh = await self._poll_paid_after(cursor, lookback)
+            except Exception as error:
+                logger.warning("Polling paid invoices failed: %r", error)
+                fresh = None
+            if fresh:
+                await self._dispatch_paid([invoice for _, invoice in fresh], concurrency)
+                for _, invoice in fresh:
+                    yield invoice
+                cursor = self._advance_cursor(cursor, fresh)
+                await cursor_store.save(cursor)
+                interval = min_interval
+            else:
+                interval = min(max_interval, interval * 2)
+            await asyncio.sleep(interval)
+
+    async def _initial_poll_cursor(self, lookback: timedelta) -> PollCursor:
+        # Start at the latest payment the API already has, so history is not redelivered
+        since = datetime.now(timezone.utc) - lookback
+        latest = PollCursor(paid_at=since)
+        async for invoice in self.iter_invoices(status=InvoiceStatus.PAID, since=since):
+            paid_at = parse_datetime(invoice.paid_at)
+            if paid_at is None or paid_at < latest.paid_at:
+                continue
+            if paid_at > latest.paid_at:
+                latest = PollCursor(paid_at=paid_at)
+            latest = PollCursor(latest.paid_at, latest.invoice_ids + (invoice.invoice_id,))
+        return latest
+
+    async def _poll_paid_after(self, cursor: PollCursor, lookback: timedelta) -> list:
+        fresh = []
+        delivered = set(cursor.invoice_ids)
+        async for invoice in self.iter_invoices(
+            status=InvoiceStatus.PAID, since=cursor.paid_at - lookback
+        ):
+            paid_at = parse_datetime(invoice.paid_at)
+            if paid_at is None or paid_at < cursor.paid_at:
+                continue
+            if paid_at == cursor.paid_at and invoice.invoice_id in delivered:
+                continue
+            fresh.append((paid_at, invoice))
+        fresh.sort(key=lambda item: (item[0], item[1].invoice_id))
+        return fresh
+
+    @staticmethod
+    def _advance_cursor(cursor: PollCursor, fresh: list) -> PollCursor:
+        latest = fresh[-1][0]
+        ids = {invoice.invoice_id for paid_at, invoice in fresh if paid_at == latest}
+        if latest == cursor.paid_at:
+            ids.update(cursor.invoice_ids)
+        return PollCursor(paid_at=latest, invoice_ids=tuple(sorted(ids)))
+
+    async def _dispatch_paid(self, invoices: list, concurrency: int) -> None:
+        if not self._handlers:
+            return
+        limit = asyncio.Semaphore(concurrency)
+        request_date = datetime.now(timezone.utc)
+
+        async def run(handler: Callable, invoice) -> None:
+            update = Update(
+                update_id=invoice.invoice_id,
+                update_type="invoice_paid",
+                request_date=request_date,
+                payload=invoice if isinstance(invoice, Invoice) else invoice.to_model(),
+            )
+            async with limit:
+                try:
+                    await handler(update, None)
+                except Exception:
+                    logger.exception("Pay handler %r failed on invoice %s", handler, invoice.invoice_id)
+
+        await asyncio.gather(
+            *(run(handler, invoice) for invoice in invoices for handler in self._handlers)
+        )
 
     async def get_amount_by_fiat(
         self, summ: Union[int, float], asset: Union[Assets, str], target: str
@@ -548,8 +882,7 @@ class AioCryptoPay(BaseClient):
         Returns:
             Union[int, float]: Amount in crypto
         """
-        rates = await self.get_exchange_rates()
-        rate = get_rate(source=asset, target=target, rates=rates)
+        rate = await self.get_exchange_rate(source=asset, target=target)
         fiat_summ = get_rate_summ(summ=summ, rate=rate)
         return fiat_summ
 
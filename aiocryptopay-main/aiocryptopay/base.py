@@ -1,34 +1,106 @@
 import asyncio
+import json
 import ssl
-from typing import Optional
+import time
+from typing import Callable, Optional, Type, TypeVar
 
 import certifi
-from aiohttp import ClientSession, TCPConnector
+from aiohttp import ClientSession, ClientTimeout, ContentTypeError, TCPConnector
 from aiohttp.typedefs import StrOrURL
+from pydantic import BaseModel
 
 from .exceptions import CryptoPayAPIError
+from .models.lazy import lazy_record
+from .utils.retry import (
+    IDEMPOTENT_METHODS,
+    RequestAttempt,
+    RetryPolicy,
+    is_rate_limited,
+    is_retryable,
+    parse_retry_after,
+)
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:  # optional speedup
+    json_loads = json.loads
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    """Process-wide SSL context. Loading the certifi bundle is slow, so it is done once."""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
 
 
 class BaseClient:
     """Base aiohttp client"""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        session: Optional[ClientSession] = None,
+        timeout: Optional[float] = 30.0,
+        connect_timeout: Optional[float] = 10.0,
+        read_timeout: Optional[float] = None,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: Optional[int] = 300,
+        fast: bool = False,
+        retry: Optional[RetryPolicy] = RetryPolicy(),
+        on_attempt: Optional[Callable[[RequestAttempt], None]] = None,
+    ) -> None:
         """
         Set defaults on object init.
             By default `self._session` is None.
             It will be created on a first API request.
             The second request will use the same `self._session`.
+
+            :param session: External aiohttp session to share one connection pool;
+                it is not closed by `close()`
+            :param timeout: Total time for a request in seconds, None to disable
+            :param connect_timeout: Time to get a connection (including pool wait) in seconds
+            :param read_timeout: Max time between reads of the response in seconds
+            :param limit: Max simultaneous connections of the own session, 0 for no limit
+            :param limit_per_host: Max simultaneous connections per host, 0 for no limit
+            :param keepalive_timeout: Seconds to keep idle connections open
+            :param dns_cache_ttl: Seconds to cache DNS lookups, None to cache forever
+            :param fast: Decode responses with orjson when installed and return list
+                items as unvalidated LazyRecord views (datetimes and amounts stay as API strings)
+            :param retry: Retry policy for transient errors, None for a single attempt
+            :param on_attempt: Called with a RequestAttempt after every try, e.g. for metrics
         """
-        self._loop = asyncio.get_event_loop()
-        self._session: Optional[ClientSession] = None
+        self._session: Optional[ClientSession] = session
+        self._owns_session = session is None
+        self.timeout = ClientTimeout(
+            total=timeout, connect=connect_timeout, sock_read=read_timeout
+        )
+        self.fast = fast
+        self.retry = retry
+        self.on_attempt = on_attempt
+        self._connector_options = dict(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_ttl,
+        )
 
     def get_session(self, **kwargs):
         """Get cached session. One session per instance."""
         if isinstance(self._session, ClientSession) and not self._session.closed:
             return self._session
+        if not self._owns_session:
+            raise RuntimeError("The external session passed to the client is closed")
 
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        connector = TCPConnector(ssl=ssl_context)
+        connector = TCPConnector(ssl=get_ssl_context(), **self._connector_options)
 
         self._session = ClientSession(connector=connector, **kwargs)
         return self._session
@@ -36,17 +108,81 @@ class BaseClient:
     async def _make_request(self, method: str, url: StrOrURL, **kwargs) -> dict:
         """
         Make a request.
+            Transient errors are retried according to `self.retry`: any method on
+            rate limits and failed connections, idempotent API methods also on
+            timeouts, dropped connections and 5xx responses.
             :param method: HTTP Method
             :param url: endpoint link
             :param kwargs: data, params, json and other...
             :return: status and result or exception
         """
+        api_method = str(url).rsplit("/", 1)[-1]
+        idempotent = api_method in IDEMPOTENT_METHODS
+        retries = self.retry.retries if self.retry is not None else 0
+        attempt = 0
+        while True:
+            meta = {}
+            started = time.perf_counter()
+            try:
+                response = await self._request_once(method, url, meta, **kwargs)
+            except Exception as error:
+                retryable = is_retryable(error, idempotent)
+                will_retry = retryable and attempt < retries
+                self._report(
+                    RequestAttempt(
+                        api_method, attempt, time.perf_counter() - started,
+                        meta.get("status"), error, retryable, will_retry,
+                    )
+                )
+                if not will_retry:
+                    raise
+                retry_after = meta.get("retry_after") if is_rate_limited(error) else None
+                await asyncio.sleep(self.retry.delay(attempt, retry_after))
+                attempt += 1
+                continue
+            self._report(
+                RequestAttempt(api_method, attempt, time.perf_counter() - started, meta.get("status"))
+            )
+            return response
+
+    async def _request_once(self, method: str, url: StrOrURL, meta: dict, **kwargs) -> dict:
         session = self.get_session()
 
-        async with session.request(method, url, **kwargs) as response:
-            response = await response.json(content_type="application/json")
+        async with session.request(
+            method, url, timeout=self.timeout, **kwargs
+        ) as response:
+            meta["status"] = response.status
+            meta["retry_after"] = parse_retry_after(response.headers.get("Retry-After"))
+            if response.content_type != "application/json" and (
+                response.status == 429 or response.status >= 500
+            ):
+                # Proxies answer overload and outages with HTML; keep them classifiable
+                raise CryptoPayAPIError(response.status, response.reason or "HTTP_ERROR")
+            if self.fast:
+                body = await response.read()
+                if response.content_type != "application/json":
+                    raise ContentTypeError(
+                        response.request_info,
+                        response.history,
+                        status=response.status,
+                        message=f"Attempt to decode JSON with unexpected mimetype: {response.content_type}",
+                        headers=response.headers,
+                    )
+                response = json_loads(body)
+            else:
+                response = await response.json(content_type="application/json")
         return self._validate_response(response)
 
+    def _report(self, attempt: RequestAttempt) -> None:
+        if self.on_attempt is not None:
+            self.on_attempt(attempt)
+
+    def _build(self, model: Type[Model], data: dict) -> Model:
+        """Build a model from trusted API data, skipping validation in fast mode."""
+        if self.fast:
+            return lazy_record(model)(data)
+        return model(**data)
+
     @staticmethod
     def _validate_response(response: dict) -> dict:
         """Validate response"""
@@ -61,7 +197,7 @@ class BaseClient:
         if not isinstance(self._session, ClientSession):
             return
 
-        if self._session.closed:
+        if self._session.closed or not self._owns_session:
             return
 
         await self._session.close()
@@ -1,10 +1,12 @@
-import gc
-from typing import Optional, Type, Union
+from typing import Dict, Optional, Tuple, Type, Union
 
 
 class CodeErrorFactory(Exception):
     """CryptoPay API Exception"""
 
+    # Process-wide registry: exactly one subclass per (factory class, error code).
+    _exception_classes: Dict[Tuple[type, int], Type["CodeErrorFactory"]] = {}
+
     def __init__(self, code: int = None, name: str = None) -> None:
         self.code = int(code) if code else None
         self.name = name
@@ -24,20 +26,29 @@ class CodeErrorFactory(Exception):
     ) -> Type["CodeErrorFactory"]:
         if code is None:
             return cls
-
-        catch_exc_classname = cls.generate_exc_classname(code)
-
-        for obj in gc.get_objects():
-            if obj.__class__.__name__ == catch_exc_classname:
-                return obj.__class__
-
-        return type(catch_exc_classname, (cls,), {})
+        return cls.exception_class(code)
 
     @classmethod
     def exception_to_raise(cls, code: int, name: str) -> "CodeErrorFactory":
         """Returns an error with error code and error_name"""
-        exception_type = type(cls.generate_exc_classname(code), (cls,), {})
-        return exception_type(code, name)
+        return cls.exception_class(code)(code, name)
+
+    @classmethod
+    def exception_class(cls, code: int) -> Type["CodeErrorFactory"]:
+        """
+        Returns the exception class registered for the error code.
+
+        The class is created on first use and reused afterwards, so
+        ``except CryptoPayAPIError(code)`` matches every error raised with that code.
+        """
+        key = (cls, int(code))
+        exception_type = cls._exception_classes.get(key)
+        if exception_type is None:
+            # setdefault keeps the first class if two threads race on a new code
+            exception_type = cls._exception_classes.setdefault(
+                key, type(cls.generate_exc_classname(code), (cls,), {})
+            )
+        return exception_type
 
     @classmethod
     def generate_exc_classname(cls, code: Optional[int]) -> str:
@@ -46,4 +57,3 @@ class CodeErrorFactory(Exception):
 
     def __str__(self):
         return f"[{self.code}] {self.name}\n"
-
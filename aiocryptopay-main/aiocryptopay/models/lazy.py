@@ -0,0 +1,67 @@
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+
+
+class LazyRecord:
+    """
+    Read-only view of a trusted API object used by fast mode.
+
+    Attributes are served straight from the decoded JSON (datetimes and amounts
+    stay as API strings), missing optional fields fall back to the model defaults.
+    ``to_model()`` validates into the full pydantic model when needed.
+    """
+
+    __slots__ = ("_data",)
+
+    model: Type[BaseModel]
+    _defaults: Dict[str, Any] = {}
+
+    def __init__(self, data: dict) -> None:
+        self._data = data
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._data[name]
+        except KeyError:
+            try:
+                return self._defaults[name]
+            except KeyError:
+                raise AttributeError(
+                    f"{type(self).__name__!r} object has no attribute {name!r}"
+                ) from None
+
+    def to_model(self) -> BaseModel:
+        return self.model(**self._data)
+
+    def to_dict(self) -> dict:
+        return {**self._defaults, **self._data}
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and other._data == self._data
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._data!r})"
+
+
+_record_types: Dict[Type[BaseModel], Type[LazyRecord]] = {}
+
+
+def lazy_record(model: Type[BaseModel]) -> Type[LazyRecord]:
+    """Returns the LazyRecord subclass for a model, created once per model."""
+    record_type = _record_types.get(model)
+    if record_type is None:
+        defaults = {
+            name: field.default
+            for name, field in model.model_fields.items()
+            if not field.is_required()
+        }
+        record_type = _record_types.setdefault(
+            model,
+            type(
+                f"{model.__name__}Record",
+                (LazyRecord,),
+                {"__slots__": (), "model": model, "_defaults": defaults},
+            ),
+        )
+    return record_type
@@ -1 +1,4 @@
-from .exchange import get_rate, get_rate_summ
+from .exchange import get_rate, get_rate_summ, index_rates
+from .pagination import MAX_PAGE_SIZE, paginate
+from .bulk import RateLimiter, run_bulk
+from .polling import CursorStore, FileCursorStore, PollCursor
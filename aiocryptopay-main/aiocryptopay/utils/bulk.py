@@ -0,0 +1,79 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, TypeVar, Union
+
+T = TypeVar("T")
+
+# Conservative defaults for bulk calls; Crypto Pay answers 429 when an app sends too much
+BULK_CONCURRENCY = 5
+BULK_RATE_LIMIT = 10.0
+
+
+class RateLimiter:
+    """Token bucket shared by all bulk calls of a client"""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        """
+        :param rate: Requests per second
+        :param burst: Requests allowed back to back after an idle period
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent."""
+        if self._lock is None:
+            # Created here, not in __init__: the limiter may be built outside a running loop
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+async def run_bulk(
+    call: Callable[..., Awaitable[T]],
+    specs: Iterable[dict],
+    concurrency: int = BULK_CONCURRENCY,
+    limiter: Optional[RateLimiter] = None,
+) -> List[Union[T, Exception]]:
+    """Run call(**spec) for every spec with bounded concurrency
+
+    Args:
+        call (Callable[..., Awaitable[T]]): client method, e.g. create_invoice
+        specs (Iterable[dict]): keyword arguments for each call
+        concurrency (int): max calls in flight
+        limiter (Optional[RateLimiter]): rate limiter acquired before each call
+
+    Returns:
+        List[Union[T, Exception]]: results in input order, an exception in place of a failed item
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    specs = list(specs)
+    results: List[Any] = [None] * len(specs)
+    queue = iter(enumerate(specs))
+
+    # A fixed pool of workers instead of one task per spec keeps memory flat for large batches
+    async def worker() -> None:
+        for index, spec in queue:
+            try:
+                if limiter is not None:
+                    await limiter.acquire()
+                results[index] = await call(**spec)
+            except Exception as error:
+                results[index] = error
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(specs)))))
+    return results
@@ -1,19 +1,38 @@
-from typing import List, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from ..models.rates import ExchangeRate
 
+RatesIndex = Dict[Tuple[str, str], ExchangeRate]
 
-def get_rate(source: str, target: str, rates: List[ExchangeRate]) -> ExchangeRate:
+
+def index_rates(rates: List[ExchangeRate]) -> RatesIndex:
+    """Index rates by (source, target) for O(1) lookups
+
+    Args:
+        rates (List[ExchangeRate]): rates from get_exchange_rates
+
+    Returns:
+        RatesIndex: rates keyed by (source, target)
+    """
+    return {(rate.source, rate.target): rate for rate in rates}
+
+
+def get_rate(
+    source: str, target: str, rates: Union[List[ExchangeRate], RatesIndex]
+) -> Optional[ExchangeRate]:
     """Get rate by source and target
 
     Args:
-        source (str): _description_
-        target (str): _description_
-        rates (List[ExchangeRate]): _description_
+        source (str): currency code, e.g. "TON"
+        target (str): currency code, e.g. "USD"
+        rates (Union[List[ExchangeRate], RatesIndex]): rates list or an index from index_rates
 
     Returns:
-        ExchangeRate: _description_
+        Optional[ExchangeRate]: the rate or None if the pair is unknown
     """
+    if isinstance(rates, dict):
+        # str() turns Assets members into their codes
+        return rates.get((str(source), str(target)))
     for rate in rates:
         if rate.source == source and rate.target == target:
             return rate
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    List,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+T = TypeVar("T")
+
+# Largest count accepted by getInvoices, getTransfers and getChecks
+MAX_PAGE_SIZE = 1000
+
+
+def as_list(result: Optional[Union[T, List[T]]]) -> List[T]:
+    """Normalize a get_* result: None on an empty page, a bare object for a single id."""
+    if result is None:
+        return []
+    if isinstance(result, list):
+        return result
+    return [result]
+
+
+def parse_datetime(value: Union[datetime, str, None]) -> Optional[datetime]:
+    """Aware datetime from a model field; fast mode keeps API strings, naive values are UTC."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def stop_condition(
+    id_field: str,
+    date_field: str,
+    after_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+) -> Optional[Callable[[Any], bool]]:
+    """Build a predicate that is true for the first item past the requested range
+
+    Args:
+        id_field (str): model id attribute, e.g. "invoice_id"
+        date_field (str): model date attribute, e.g. "created_at"
+        after_id (Optional[int]): stop at items with id <= after_id
+        since (Optional[datetime]): stop at items older than since, naive values are UTC
+
+    Returns:
+        Optional[Callable[[Any], bool]]: predicate or None when no bound is set
+    """
+    if after_id is None and since is None:
+        return None
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    def stop(item: Any) -> bool:
+        if after_id is not None and getattr(item, id_field) <= after_id:
+            return True
+        if since is not None:
+            value = parse_datetime(getattr(item, date_field))
+            if value is not None:
+                return value < since
+        return False
+
+    return stop
+
+
+def _discard(task: Optional["asyncio.Future"]) -> None:
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()  # mark as retrieved, the caller has stopped iterating
+
+
+async def paginate(
+    fetch: Callable[[int, int], Awaitable[Any]],
+    page_size: int = MAX_PAGE_SIZE,
+    stop: Optional[Callable[[Any], bool]] = None,
+) -> AsyncIterator[Any]:
+    """Stream items across offset/count pages
+
+    The next page is requested as soon as the current one arrives, so the
+    network round trip overlaps with the caller's processing. At most two
+    pages are held in memory at a time.
+
+    Args:
+        fetch (Callable[[int, int], Awaitable[Any]]): fetch(offset, count) returning a get_* result
+        page_size (int): items per request, 1-1000
+        stop (Optional[Callable[[Any], bool]]): iteration ends at the first item it accepts;
+            the API returns the newest items first, so id and date bounds are monotonic
+
+    Yields:
+        Any: items in API order
+    """
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    offset = 0
+    next_page = asyncio.ensure_future(fetch(offset, page_size))
+    try:
+        while next_page is not None:
+            items = as_list(await next_page)
+            next_page = None
+            if len(items) == page_size and not (stop is not None and stop(items[-1])):
+                next_page = asyncio.ensure_future(fetch(offset + page_size, page_size))
+            for item in items:
+                if stop is not None and stop(item):
+                    return
+                yield item
+            offset += page_size
+    finally:
+        _discard(next_page)
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+
+@dataclass(frozen=True)
+class PollCursor:
+    """
+    Position of poll_paid_invoices.
+
+    paid_at is the latest payment time already delivered; invoice_ids are the
+    delivered invoices paid exactly at that time, so ties are not sent twice.
+    """
+
+    paid_at: datetime
+    invoice_ids: Tuple[int, ...] = ()
+
+    def to_dict(self) -> dict:
+        return {"paid_at": self.paid_at.isoformat(), "invoice_ids": list(self.invoice_ids)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PollCursor":
+        return cls(
+            paid_at=datetime.fromisoformat(data["paid_at"]),
+            invoice_ids=tuple(data.get("invoice_ids", ())),
+        )
+
+
+class CursorStore:
+    """Keeps the cursor between poll_paid_invoices runs. The base class keeps it in memory."""
+
+    def __init__(self) -> None:
+        self._cursor: Optional[PollCursor] = None
+
+    async def load(self) -> Optional[PollCursor]:
+        return self._cursor
+
+    async def save(self, cursor: PollCursor) -> None:
+        self._cursor = cursor
+
+
+class FileCursorStore(CursorStore):
+    """Cursor in a small JSON file, replaced atomically on every save"""
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        super().__init__()
+        self.path = Path(path)
+
+    async def load(self) -> Optional[PollCursor]:
+        if not self.path.exists():
+            return None
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(None, self.path.read_text, "utf-8")
+        return PollCursor.from_dict(json.loads(text))
+
+    async def save(self, cursor: PollCursor) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, json.dumps(cursor.to_dict()))
+
+    def _write(self, text: str) -> None:
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.path)
@@ -0,0 +1,103 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import (
+    ClientConnectorError,
+    ClientOSError,
+    ClientPayloadError,
+    ServerDisconnectedError,
+)
+
+from ..exceptions import CryptoPayAPIError
+
+# Methods that are safe to send twice. transfer is idempotent through its required spend_id,
+# createInvoice and createCheck are not and are retried only when the request was surely not processed.
+IDEMPOTENT_METHODS = frozenset(
+    {
+        "getMe",
+        "getStats",
+        "getBalance",
+        "getExchangeRates",
+        "getCurrencies",
+        "getInvoices",
+        "getTransfers",
+        "getChecks",
+        "deleteInvoice",
+        "deleteCheck",
+        "transfer",
+    }
+)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Retry settings of BaseClient.
+
+    Delays use full jitter: a random value up to backoff * 2 ** attempt, capped by
+    max_backoff. A Retry-After from a rate-limited response is waited at least.
+    """
+
+    retries: int = 2
+    backoff: float = 0.5
+    max_backoff: float = 10.0
+    max_retry_after: float = 60.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+@dataclass
+class RequestAttempt:
+    """Passed to the on_attempt hook after every try of a request."""
+
+    method: str
+    attempt: int
+    seconds: float
+    status: Optional[int] = None
+    error: Optional[BaseException] = None
+    retryable: bool = False
+    will_retry: bool = False
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return isinstance(error, CryptoPayAPIError()) and error.code == 429
+
+
+def is_retryable(error: BaseException, idempotent: bool) -> bool:
+    """Classify an error of a single attempt
+
+    Args:
+        error (BaseException): error raised by the attempt
+        idempotent (bool): the API method is safe to repeat
+
+    Returns:
+        bool: True for transient errors worth another attempt, False for fatal ones
+    """
+    if is_rate_limited(error):
+        return True  # rejected before processing, safe for every method
+    if isinstance(error, ClientConnectorError):
+        return True  # the connection was never made, nothing was sent
+    if not idempotent:
+        return False
+    if isinstance(error, CryptoPayAPIError()):
+        return error.code is not None and error.code >= 500
+    if isinstance(error, (asyncio.TimeoutError, ServerDisconnectedError, ClientOSError, ClientPayloadError)):
+        return True
+    return False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After in seconds; HTTP dates are not used by Crypto Pay and are ignored."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
@@ -0,0 +1,126 @@
+"""
+Throughput of get_invoices on large pages, default vs fast mode.
+
+Serves a synthetic getInvoices page from a local aiohttp server and measures
+decoding plus model building alone and end to end::
+
+    python benchmarks/decode.py --count 1000 --rounds 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiocryptopay import AioCryptoPay  # noqa: E402
+from aiocryptopay.base import json_loads  # noqa: E402
+from aiocryptopay.models.invoice import Invoice  # noqa: E402
+from aiocryptopay.models.lazy import lazy_record  # noqa: E402
+
+
+def invoice(invoice_id: int) -> dict:
+    return {
+        "invoice_id": invoice_id,
+        "hash": f"IV{invoice_id:012d}",
+        "currency_type": "crypto",
+        "asset": "USDT",
+        "amount": "1.5",
+        "paid_asset": "USDT",
+        "paid_amount": "1.5",
+        "fee_asset": "USDT",
+        "fee_amount": "0.045",
+        "fee_in_usd": "0.045",
+        "pay_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+        "bot_invoice_url": f"https://t.me/CryptoBot?start=IV{invoice_id}",
+        "mini_app_invoice_url": f"https://t.me/CryptoBot/app?startapp=invoice-IV{invoice_id}",
+        "web_app_invoice_url": f"https://app.send.tg/invoices/IV{invoice_id}",
+        "description": "Subscription",
+        "status": "paid",
+        "created_at": "2024-05-01T10:00:00.000Z",
+        "paid_usd_rate": "1.00010000",
+        "allow_comments": True,
+        "allow_anonymous": True,
+        "paid_anonymously": False,
+        "paid_at": "2024-05-01T10:01:00.000Z",
+        "payload": str(100000 + invoice_id),
+        "hidden_message": "Thank you!",
+    }
+
+
+def page(count: int) -> bytes:
+    items = [invoice(i) for i in range(count, 0, -1)]
+    return json.dumps({"ok": True, "result": {"items": items}}).encode()
+
+
+def best_of(func, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def end_to_end(body: bytes, fast: bool, rounds: int) -> float:
+    async def handler(request):
+        return web.Response(body=body, content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/api/getInvoices", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    crypto = AioCryptoPay("1:bench", network=f"http://127.0.0.1:{port}", fast=fast)
+    try:
+        await crypto.get_invoices(count=1000)  # warm up the connection
+        best = float("inf")
+        for _ in range(rounds):
+            started = time.perf_counter()
+            await crypto.get_invoices(count=1000)
+            best = min(best, time.perf_counter() - started)
+        return best
+    finally:
+        await crypto.close()
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000, help="invoices per page")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    body = page(args.count)
+    print(f"page: {args.count} invoices, {len(body) / 1024:.0f} KiB, decoder: {json_loads.__module__}")
+
+    default = best_of(
+        lambda: [Invoice(**i) for i in json.loads(body.decode())["result"]["items"]], args.rounds
+    )
+    record = lazy_record(Invoice)
+    construct = best_of(
+        lambda: [Invoice.model_construct(**i) for i in json_loads(body)["result"]["items"]], args.rounds
+    )
+    fast = best_of(lambda: [record(i) for i in json_loads(body)["result"]["items"]], args.rounds)
+    default_e2e = asyncio.run(end_to_end(body, False, args.rounds))
+    fast_e2e = asyncio.run(end_to_end(body, True, args.rounds))
+
+    print(f"{'':<20} {'default, ms':>12} {'fast, ms':>10} {'speedup':>8}")
+    rows = (
+        ("model_construct", default, construct),
+        ("decode + records", default, fast),
+        ("get_invoices", default_e2e, fast_e2e),
+    )
+    for name, slow, quick in rows:
+        print(f"{name:<20} {slow * 1000:>12.2f} {quick * 1000:>10.2f} {slow / quick:>7.1f}x")
+    print(f"get_invoices throughput: {args.count / default_e2e:,.0f} -> {args.count / fast_e2e:,.0f} invoices/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Cost of resolving ``CryptoPayAPIError(code)`` as the heap grows.
+
+Compares the registry lookup with the previous ``gc.get_objects()`` scan::
+
+    python benchmarks/errors.py --objects 0 100000 1000000
+"""
+import argparse
+import gc
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiocryptopay.exceptions import CryptoPayAPIError  # noqa: E402
+from aiocryptopay.exceptions.factory import CodeErrorFactory  # noqa: E402
+
+
+def gc_scan_lookup(code: int) -> type:
+    """The previous implementation of ``exception_to_handle``."""
+    classname = CodeErrorFactory.generate_exc_classname(code)
+    for obj in gc.get_objects():
+        if obj.__class__.__name__ == classname:
+            return obj.__class__
+    return type(classname, (CodeErrorFactory,), {})
+
+
+def timeit(func, number: int) -> float:
+    """Best of three, microseconds per call."""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--objects", type=int, nargs="+", default=[0, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    # An instance must be alive for the scan to find its class at all
+    raised = CryptoPayAPIError(400, "BAD_REQUEST")
+    print(f"{'heap objects':>14} {'gc scan, us':>14} {'registry, us':>14}")
+    ballast = []
+    for extra in sorted(args.objects):
+        ballast.extend([i] for i in range(extra - len(ballast)))  # lists are gc-tracked
+        heap = len(gc.get_objects())
+        scan = timeit(lambda: gc_scan_lookup(400), number=3)
+        registry = timeit(lambda: CryptoPayAPIError(400), number=100_000)
+        print(f"{heap:>14,} {scan:>14,.1f} {registry:>14,.3f}")
+    assert CryptoPayAPIError(400) is type(raised)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# backup.py
+# === Резервные копии: SQLite online backup API + gzip + ротация ===
+import asyncio
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKUP_PAGES_PER_STEP = 256   # страниц SQLite за один шаг копирования
+BACKUP_STEP_SLEEP = 0.02      # пауза между шагами, чтобы писатели не ждали
+
+
+def next_backup_time(now: datetime, weekday: int, hour: int) -> datetime:
+    """Ближайший момент weekday/hour:00 строго после now (0 — понедельник)."""
+    candidate = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    candidate += timedelta(days=(weekday - now.weekday()) % 7)
+    if candidate <= now:
+        candidate += timedelta(days=7)
+    return candidate
+
+
+def _sqlite_integrity_ok(db_file) -> bool:
+    check = sqlite3.connect(db_file)
+    try:
+        return check.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        check.close()
+
+
+def _gzip_file(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
+class BackupManager:
+    """
+    Делает консистентные копии users.db, пока бот работает.
+
+    Копия снимается через sqlite3.Connection.backup небольшими шагами
+    из отдельного потока, поэтому основное соединение не блокируется надолго.
+    Каждый архив после записи распаковывается и проверяется
+    (PRAGMA integrity_check для базы, json.load для JSON-файлов).
+    """
+
+    def __init__(self, db_path, backup_dir, extra_files=(), keep: int = 8,
+                 max_age_days: int = 90, weekday: int = 0, hour: int = 3):
+        self.db_path = str(db_path)
+        self.backup_dir = Path(backup_dir)
+        self.extra_files = [Path(p) for p in extra_files]
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.weekday = weekday
+        self.hour = hour
+        self._lock = asyncio.Lock()
+
+    # --- Снятие копии (выполняется в потоке) ---
+    def _snapshot_db(self, dest: Path):
+        src = sqlite3.connect(self.db_path)
+        dst = sqlite3.connect(dest)
+
+        def progress(status, remaining, total):
+            # Отдаём блокировку писателям между шагами
+            if remaining:
+                time.sleep(BACKUP_STEP_SLEEP)
+
+        try:
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        finally:
+            dst.close()
+            src.close()
+
+    def _create_sync(self) -> list:
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        created = []
+
+        with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp:
+            snapshot = Path(tmp) / "snapshot.db"
+            self._snapshot_db(snapshot)
+            if not _sqlite_integrity_ok(snapshot):
+                raise RuntimeError("integrity_check снимка базы не прошёл")
+            db_name = Path(self.db_path).stem
+            artifact = self.backup_dir / f"{db_name}_{stamp}.db.gz"
+            _gzip_file(snapshot, artifact)
+            created.append(artifact)
+
+        for extra in self.extra_files:
+            if not extra.exists():
+                continue
+            artifact = self.backup_dir / f"{extra.stem}_{stamp}{extra.suffix}.gz"
+            _gzip_file(extra, artifact)
+            created.append(artifact)
+
+        for artifact in created:
+            if not self.verify(artifact):
+                artifact.unlink(missing_ok=True)
+                raise RuntimeError(f"Архив {artifact.name} повреждён")
+
+        self.prune()
+        return created
+
+    async def create(self) -> list:
+        """Снимает копию сейчас. Возвращает пути созданных архивов."""
+        async with self._lock:
+            created = await asyncio.to_thread(self._create_sync)
+        logging.info(f"📦 Резервные копии созданы: {', '.join(p.name for p in created)}")
+        return created
+
+    # --- Проверка, список, ротация ---
+    def verify(self, artifact: Path) -> bool:
+        """Распаковывает архив во временный файл и проверяет содержимое."""
+        artifact = Path(artifact)
+        try:
+            with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp:
+                unpacked = Path(tmp) / artifact.name[:-len(".gz")]
+                with gzip.open(artifact, "rb") as src, open(unpacked, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                if unpacked.suffix == ".db":
+                    return _sqlite_integrity_ok(unpacked)
+                if unpacked.suffix == ".json":
+                    with open(unpacked, "r", encoding="utf-8") as f:
+                        json.load(f)
+                return True
+        except Exception as e:
+            logging.error(f"❌ Проверка архива {artifact.name} не прошла: {e}")
+            return False
+
+    def list(self) -> list:
+        """Архивы от новых к старым."""
+        if not self.backup_dir.exists():
+            return []
+        return sorted(self.backup_dir.glob("*.gz"), key=lambda p: p.stat().st_mtime, reverse=True)
+
+    def prune(self) -> list:
+        """Оставляет keep последних архивов каждого вида и удаляет слишком старые."""
+        removed = []
+        cutoff = time.time() - self.max_age_days * 86400
+        groups = {}
+        for artifact in self.list():
+            groups.setdefault(artifact.name.rsplit("_", 2)[0], []).append(artifact)
+        for artifacts in groups.values():
+            for i, artifact in enumerate(artifacts):
+                if i >= self.keep or artifact.stat().st_mtime < cutoff:
+                    artifact.unlink(missing_ok=True)
+                    removed.append(artifact)
+        if removed:
+            logging.info(f"🗑 Удалены старые резервные копии: {', '.join(p.name for p in removed)}")
+        return removed
+
+    # --- Расписание ---
+    async def run_forever(self):
+        """Фоновая задача: копия раз в неделю в заданный день и час."""
+        while True:
+            wake_at = next_backup_time(datetime.now(), self.weekday, self.hour)
+            await asyncio.sleep(max(0.0, (wake_at - datetime.now()).total_seconds()))
+            try:
+                await self.create()
+            except Exception as e:
+                logging.error(f"❌ Ошибка при резервном копировании: {e}", exc_info=True)
+
+
+def backup_manager_from_env(db_path, backup_dir, extra_files=()) -> BackupManager:
+    """BACKUP_KEEP, BACKUP_MAX_AGE_DAYS, BACKUP_WEEKDAY (0 — пн), BACKUP_HOUR."""
+    return BackupManager(
+        db_path,
+        backup_dir,
+        extra_files=extra_files,
+        keep=int(os.getenv("BACKUP_KEEP", "8")),
+        max_age_days=int(os.getenv("BACKUP_MAX_AGE_DAYS", "90")),
+        weekday=int(os.getenv("BACKUP_WEEKDAY", "0")),
+        hour=int(os.getenv("BACKUP_HOUR", "3")),
+    )
@@ -0,0 +1,372 @@
+# bench/loadtest.py
+# === Нагрузочный тест /webhook с заглушками Bot API и OpenAI ===
+#
+#   python -m bench.loadtest --scenarios mixed,dialog --rate 50 --duration 30 --users 100
+#
+# Бот запускается отдельным процессом uvicorn (как в проде) с временной базой;
+# Bot API и OpenAI заменены заглушками из bench/stubs.py. Всё работает офлайн.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import aiohttp
+
+from bench.stubs import OpenAIStub, TelegramStub, Upstream
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+BOT_TOKEN = "123456:LOADTEST"
+ADMIN_ID = 1
+FIRST_USER_ID = 10_000_000
+
+
+# === Синтетические апдейты ===
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load", "language_code": "ru"},
+            "text": text,
+        },
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_message_ids)),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+            "data": data,
+        },
+    }
+
+
+_DIALOG_PROMPTS = [
+    "Как приготовить плов?", "Переведи на английский: доброе утро", "Напиши короткое стихотворение о море",
+    "Что такое квантовый компьютер?", "Придумай название для кофейни",
+]
+_IMAGE_PROMPTS = ["Кот в космосе, 8K", "Закат над горами", "Киберпанк улица ночью", "Замок на облаках"]
+_EXAMPLES = ["img_landscape", "img_anime_girl", "weather_example", "news_example", "random_example"]
+
+# Сценарий — бесконечная последовательность апдейтов одного виртуального пользователя
+SCENARIOS = {
+    "menu": lambda uid: itertools.cycle([
+        lambda: message_update(uid, "/start"),
+        lambda: message_update(uid, "👤 Профиль"),
+        lambda: message_update(uid, "📚 Как пользоваться?"),
+        lambda: message_update(uid, "📎 Остальные проекты"),
+    ]),
+    "dialog": lambda uid: itertools.chain(
+        [lambda: message_update(uid, "🌌 Gemini AI")],
+        itertools.repeat(lambda: message_update(uid, random.choice(_DIALOG_PROMPTS))),
+    ),
+    "image": lambda uid: itertools.cycle([
+        lambda: message_update(uid, "🎨 Создать изображение"),
+        lambda: message_update(uid, random.choice(_IMAGE_PROMPTS)),
+    ]),
+    "callbacks": lambda uid: itertools.repeat(lambda: callback_update(uid, random.choice(_EXAMPLES))),
+}
+
+
+def _mixed(uid: int):
+    # Примерная доля трафика: меню 40%, диалог 35%, примеры 15%, картинки 10%
+    streams = {name: SCENARIOS[name](uid) for name in ("menu", "dialog", "callbacks", "image")}
+    weights = [40, 35, 15, 10]
+    names = list(streams)
+    while True:
+        yield next(streams[random.choices(names, weights)[0]])
+
+
+SCENARIOS["mixed"] = _mixed
+
+
+# === Статистика ===
+def percentile(values: list, p: float) -> float:
+    """Перцентиль методом ближайшего ранга; values должны быть отсортированы."""
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def latency_summary(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+    }
+
+
+def parse_metric_counts(text: str, name: str) -> int:
+    """Сумма всех серий <name>_count из вывода /metrics."""
+    total = 0.0
+    prefix = f"{name}_count"
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            total += float(line.rsplit(" ", 1)[1])
+    return int(total)
+
+
+# === Процесс бота ===
+class AppUnderTest:
+    """uvicorn main:create_app во временном каталоге, направленный на заглушки."""
+
+    def __init__(self, telegram_url: str, openai_url: str, workers: int = 1, port: int = 0,
+                 extra_env: dict = None):
+        self.telegram_url = telegram_url
+        self.openai_url = openai_url
+        self.workers = workers
+        self.port = port or random.randint(20000, 40000)
+        self.extra_env = extra_env or {}
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workdir = Path(tempfile.mkdtemp(prefix="gemini-bench-"))
+        self.db_path = self.workdir / "users.db"
+        self._process = None
+        self._output = None
+
+    async def start(self, timeout: float = 60.0):
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BOT_TOKEN,
+            "ADMIN_ID": str(ADMIN_ID),
+            "OPENAI_API_KEY": "sk-stub",
+            "TELEGRAM_API_URL": self.telegram_url,
+            "OPENAI_BASE_URL": self.openai_url + "/v1",
+            "DB_PATH": str(self.db_path),
+            "DATA_DIR": str(self.workdir / "data"),
+            "WORKERS": str(self.workers),
+            "PYTHONPATH": str(REPO_DIR),
+        })
+        env.pop("DOMAIN_URL", None)  # не регистрировать webhook
+        env.pop("METRICS_TOKEN", None)
+        env.update(self.extra_env)
+        # Вывод бота — в файл, чтобы не смешивался с отчётом
+        self._output = open(self.workdir / "app.out", "wb")
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "main:create_app", "--factory",
+            "--app-dir", str(REPO_DIR), "--host", "127.0.0.1", "--port", str(self.port),
+            "--workers", str(self.workers), "--log-level", "warning",
+            cwd=self.workdir, env=env, stdout=self._output, stderr=asyncio.subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self._process.returncode is not None:
+                    raise RuntimeError(f"Бот завершился с кодом {self._process.returncode}, "
+                                       f"см. {self.workdir / 'app.out'}")
+                try:
+                    async with session.get(self.url + "/") as resp:
+                        if resp.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError("Бот не запустился")
+
+    def subscribe_users(self, user_ids):
+        """Оформляет подписку, чтобы лимит бесплатных запросов не искажал тест."""
+        expires = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+        today = datetime.now().strftime("%Y-%m-%d")
+        with sqlite3.connect(self.db_path, timeout=10) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) "
+                "VALUES (?, 0, 1, ?, ?)",
+                [(uid, expires, today) for uid in user_ids]
+            )
+
+    async def metrics(self, session: aiohttp.ClientSession) -> str:
+        async with session.get(self.url + "/metrics") as resp:
+            return await resp.text()
+
+    async def stop(self):
+        if self._process is not None and self._process.returncode is None:
+            self._process.terminate()
+            try:
+                await asyncio.wait_for(self._process.wait(), 15)
+            except asyncio.TimeoutError:
+                self._process.kill()
+            self._output.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# === Генератор нагрузки ===
+class Pacer:
+    """Равномерно раздаёт слоты отправки: rate апдейтов в секунду на всех пользователей."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(self._next, now)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class ReplyTracker:
+    """Время от отправки апдейта до первого сообщения бота этому пользователю."""
+
+    def __init__(self):
+        self.waiting = {}
+        self.latencies = []
+
+    def sent(self, chat_id: int):
+        self.waiting[chat_id] = time.perf_counter()
+
+    def on_send(self, chat_id: int, method: str):
+        started = self.waiting.pop(chat_id, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+
+async def run_scenario(app: AppUnderTest, telegram: TelegramStub, openai: OpenAIStub,
+                       name: str, rate: float, duration: float, users: list) -> dict:
+    tracker = ReplyTracker()
+    telegram.on_send = tracker.on_send
+    telegram.reset()
+    openai.reset()
+    pacer = Pacer(rate)
+    webhook_latencies = []
+    errors = defaultdict(int)
+    connector = aiohttp.TCPConnector(limit=len(users))
+    async with aiohttp.ClientSession(connector=connector) as session:
+        before = await app.metrics(session)
+        deadline = time.monotonic() + duration
+
+        async def virtual_user(uid: int):
+            steps = SCENARIOS[name](uid)
+            while time.monotonic() < deadline:
+                await pacer.wait()
+                if time.monotonic() >= deadline:
+                    return
+                update = next(steps)()
+                tracker.sent(uid)
+                started = time.perf_counter()
+                try:
+                    async with session.post(app.url + "/webhook", json=update) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors[f"http_{resp.status}"] += 1
+                except aiohttp.ClientError as e:
+                    errors[type(e).__name__] += 1
+                    continue
+                webhook_latencies.append(time.perf_counter() - started)
+
+        started = time.monotonic()
+        await asyncio.gather(*(virtual_user(uid) for uid in users))
+        elapsed = time.monotonic() - started
+        after = await app.metrics(session)
+
+    def delta(metric):
+        return parse_metric_counts(after, metric) - parse_metric_counts(before, metric)
+
+    telegram.on_send = None
+    return {
+        "scenario": name,
+        "updates": len(webhook_latencies),
+        "errors": dict(errors),
+        "seconds": round(elapsed, 2),
+        "throughput_per_s": round(len(webhook_latencies) / elapsed, 1) if elapsed else 0.0,
+        "webhook": latency_summary(webhook_latencies),
+        "first_reply": latency_summary(tracker.latencies),
+        "db_queries": delta("sqlite_query_duration_seconds"),
+        "openai_calls": delta("openai_request_duration_seconds"),
+        "openai_errors": sum(openai.errors.values()),
+        "bot_api_calls": sum(telegram.calls.values()),
+        "bot_api_errors": sum(telegram.errors.values()),
+    }
+
+
+def print_report(results: list):
+    header = (f"{'сценарий':<10} {'апдейтов':>8} {'в сек':>7} {'p50':>8} {'p95':>8} {'p99':>8} "
+              f"{'ответ p95':>10} {'SQL':>7} {'OpenAI':>7} {'Bot API':>8} {'ошибок':>7}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        w = r["webhook"]
+        print(f"{r['scenario']:<10} {r['updates']:>8} {r['throughput_per_s']:>7} "
+              f"{w['p50_ms']:>8} {w['p95_ms']:>8} {w['p99_ms']:>8} {r['first_reply']['p95_ms']:>10} "
+              f"{r['db_queries']:>7} {r['openai_calls']:>7} {r['bot_api_calls']:>8} "
+              f"{sum(r['errors'].values()) + r['openai_errors'] + r['bot_api_errors']:>7}")
+    print("(задержки в мс; p50–p99 — полный ответ /webhook, «ответ» — до первого сообщения бота)")
+
+
+async def main(args):
+    telegram = TelegramStub(Upstream(args.tg_latency, args.tg_jitter, args.tg_errors))
+    openai = OpenAIStub(Upstream(args.openai_latency, args.openai_jitter, args.openai_errors))
+    await telegram.start()
+    await openai.start()
+    app = AppUnderTest(telegram.url, openai.url, workers=args.workers)
+    results = []
+    try:
+        await app.start()
+        users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+        if not args.free_users:
+            app.subscribe_users(users)
+        for name in args.scenarios.split(","):
+            print(f"▶ {name}: {args.rate or 'max'} апд/с, {args.duration} с, {args.users} пользователей")
+            results.append(await run_scenario(app, telegram, openai, name, args.rate, args.duration, users))
+    finally:
+        await app.stop()
+        await telegram.stop()
+        await openai.stop()
+    print_report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"💾 Результаты сохранены в {args.json}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /webhook с заглушками Bot API и OpenAI")
+    parser.add_argument("--scenarios", default="menu,dialog,image,callbacks,mixed",
+                        help=f"через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--rate", type=float, default=20, help="апдейтов в секунду (0 — без ограничения)")
+    parser.add_argument("--duration", type=float, default=15, help="секунд на сценарий")
+    parser.add_argument("--users", type=int, default=50, help="виртуальных пользователей (параллельность)")
+    parser.add_argument("--workers", type=int, default=1, help="процессов uvicorn у бота")
+    parser.add_argument("--free-users", action="store_true", help="не оформлять подписку (проверить лимиты)")
+    parser.add_argument("--openai-latency", type=float, default=0.8, help="медиана задержки OpenAI, с")
+    parser.add_argument("--openai-jitter", type=float, default=0.4, help="разброс (sigma логнормального)")
+    parser.add_argument("--openai-errors", type=float, default=0.0, help="доля ответов 500 от OpenAI")
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="медиана задержки Bot API, с")
+    parser.add_argument("--tg-jitter", type=float, default=0.3)
+    parser.add_argument("--tg-errors", type=float, default=0.0, help="доля ответов 500 от Bot API")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,197 @@
+# bench/micro.py
+# === Микробенчмарки хранилища: users.db и JSON-файлы ===
+#
+#   python -m bench.micro --save bench/baseline.json          # записать базовую линию
+#   python -m bench.micro --compare bench/baseline.json       # сравнить, код 1 при регрессии
+#
+# Замеры идут на временной базе со --users синтетическими пользователями (по умолчанию 100k),
+# поэтому любая переделка хранилища может показать выигрыш на реальном объёме.
+import argparse
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from db import Database
+
+ADMIN_ID = 1
+DEFAULT_THRESHOLD = 0.15  # +15% времени на операцию — регрессия
+
+
+# === Синтетические данные ===
+def build_users_db(path: Path, users: int, seed: int = 42) -> Database:
+    """users.db с users пользователями: ~10% подписчиков, даты регистрации за 2 года, история."""
+    rng = random.Random(seed)
+    db = Database(str(path), ADMIN_ID)
+    db.init_schema()
+    today = datetime.now()
+    rows, history = [], []
+    for i in range(users):
+        user_id = 100_000 + i
+        joined = (today - timedelta(days=rng.randint(0, 730))).strftime("%Y-%m-%d")
+        subscribed = rng.random() < 0.1
+        expires = (today + timedelta(days=rng.randint(1, 30))).strftime("%Y-%m-%d") if subscribed else None
+        rows.append((user_id, rng.randint(0, 15), int(subscribed), expires, joined))
+        for _ in range(rng.randint(0, 3)):
+            history.append((user_id, rng.choice(["text", "image", "gemini"]), "синтетический запрос"))
+    with db.transaction() as tx:
+        tx.executemany(
+            "INSERT OR REPLACE INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) "
+            "VALUES (?, ?, ?, ?, ?)", rows
+        )
+        tx.executemany("INSERT INTO history (user_id, type, prompt) VALUES (?, ?, ?)", history)
+    return db
+
+
+def build_json_store(path: Path, records: int, kind: str):
+    now = datetime.now().isoformat()
+    if kind == "images":
+        data = [{"prompt": f"prompt {i}", "url": f"https://example.com/{i}.png", "created_at": now}
+                for i in range(records)]
+    else:
+        data = [{"user_id": 100_000 + i, "action": "bench", "details": "x", "timestamp": now}
+                for i in range(records)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+# === Замер ===
+def measure(func, number: int, repeat: int = 5, setup=None) -> dict:
+    """Медиана и минимум времени одной операции по repeat прогонам из number вызовов."""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return {
+        "us_per_op": round(statistics.median(samples) * 1e6, 2),
+        "us_min": round(min(samples) * 1e6, 2),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run_suite(users: int, quick: bool = False) -> dict:
+    # main импортируется здесь: так бенчмарки меряют те же функции, что работают в боте
+    import main
+
+    scale = 0.1 if quick else 1.0
+    n = lambda count: max(int(count * scale), 1)
+    workdir = Path(tempfile.mkdtemp(prefix="gemini-micro-"))
+    results = {}
+    try:
+        db = build_users_db(workdir / "users.db", users)
+        rng = random.Random(1)
+        user_ids = [100_000 + rng.randrange(users) for _ in range(10_000)]
+        ids = iter(user_ids * 1000)
+        new_ids = iter(range(10_000_000, 20_000_000))
+
+        results["ensure_user_existing"] = measure(lambda: db.ensure_user(next(ids)), n(5000))
+        results["ensure_user_new"] = measure(lambda: db.ensure_user(next(new_ids)), n(2000))
+        results["is_limited"] = measure(lambda: db.is_limited(next(ids)), n(5000))
+        results["increment_usage"] = measure(lambda: db.increment_usage(next(ids)), n(2000))
+        results["record_usage"] = measure(lambda: db.record_usage(next(ids), "text", "бенчмарк"), n(2000))
+        today = datetime.now().date()
+        results["admin_stats"] = measure(
+            lambda: (db.signup_stats(today), db.count_subscribers()), n(20), repeat=3
+        )
+
+        for records in (1_000, 10_000, 100_000):
+            path = workdir / f"logs_{records}.json"
+            record = {"user_id": 1, "action": "bench", "details": "x", "timestamp": datetime.now().isoformat()}
+            results[f"append_json_{records // 1000}k"] = measure(
+                lambda: main.append_json(path, record),
+                number=1 if records >= 100_000 else n(20), repeat=3,
+                setup=lambda: build_json_store(path, records, "logs"),
+            )
+
+        images = workdir / "images.json"
+        build_json_store(images, 10_000, "images")
+        results["gallery_10k"] = measure(lambda: main.gallery_html(images), n(20), repeat=3)
+
+        db.import_payments([(i, 100_000 + rng.randrange(users), "1.00", "USDT", None) for i in range(10_000)])
+        results["pending_payments_10k"] = measure(lambda: db.pending_payments(20), n(10), repeat=3)
+        db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# === Базовая линия и сравнение ===
+def environment(users: int) -> dict:
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "users": users,
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> list:
+    """Список (имя, было, стало, изменение) для замеров, ставших медленнее порога."""
+    regressions = []
+    print(f"{'замер':<24} {'было, мкс':>12} {'стало, мкс':>12} {'изменение':>10}")
+    for name, current in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<24} {'—':>12} {current['us_per_op']:>12} {'новый':>10}")
+            continue
+        change = current["us_per_op"] / before["us_per_op"] - 1 if before["us_per_op"] else 0.0
+        mark = ""
+        if change > threshold:
+            regressions.append((name, before["us_per_op"], current["us_per_op"], change))
+            mark = " ❌"
+        elif change < -threshold:
+            mark = " ✅"
+        print(f"{name:<24} {before['us_per_op']:>12} {current['us_per_op']:>12} {change:>+9.0%}{mark}")
+    return regressions
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки users.db и JSON-хранилищ")
+    parser.add_argument("--users", type=int, default=100_000, help="синтетических пользователей в базе")
+    parser.add_argument("--quick", action="store_true", help="в 10 раз меньше повторов (для быстрой проверки)")
+    parser.add_argument("--save", help="сохранить результаты как базовую линию")
+    parser.add_argument("--compare", help="сравнить с базовой линией")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="допустимое замедление (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    print(f"⏱ Бенчмарки на базе из {args.users} пользователей...")
+    results = run_suite(args.users, quick=args.quick)
+
+    if args.save:
+        Path(args.save).write_text(
+            json.dumps({"environment": environment(args.users), "results": results}, ensure_ascii=False, indent=2),
+            encoding="utf-8"
+        )
+        print(f"💾 Базовая линия сохранена в {args.save}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if baseline["environment"].get("users") != args.users:
+            print(f"⚠️ Базовая линия снята на {baseline['environment'].get('users')} пользователях")
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"❌ Регрессии больше {args.threshold:.0%}: {', '.join(r[0] for r in regressions)}")
+            return 1
+        print("✅ Регрессий нет")
+    elif not args.save:
+        for name, r in results.items():
+            print(f"{name:<24} {r['us_per_op']:>12} мкс/оп")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,169 @@
+# bench/replay.py
+# === Воспроизведение записанного трафика (RECORD_UPDATES) против тестового экземпляра ===
+#
+#   python -m bench.replay updates.jsonl.gz --speed 10 --json new.json
+#   python -m bench.replay updates.jsonl.gz --speed 10 --compare old.json
+#
+# Бот и заглушки поднимаются так же, как в bench/loadtest.py; апдейты отправляются
+# с исходными интервалами, ускоренными в --speed раз (max — без пауз). Апдейты одного
+# пользователя всегда уходят по порядку, чтобы FSM-сценарии не ломались.
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+
+from bench.loadtest import AppUnderTest, ReplyTracker, latency_summary, parse_metric_counts
+from bench.stubs import OpenAIStub, TelegramStub, Upstream
+from recorder import REPLAY_ADMIN_ID, read_recording
+
+
+def _sender_id(update: dict):
+    for key in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+        event = update.get(key)
+        if event and "from" in event:
+            return event["from"]["id"]
+    return None
+
+
+async def replay(app: AppUnderTest, telegram: TelegramStub, records: list, speed: float,
+                 concurrency: int) -> dict:
+    tracker = ReplyTracker()
+    telegram.on_send = tracker.on_send
+    locks = defaultdict(asyncio.Lock)
+    limit = asyncio.Semaphore(concurrency)
+    webhook_latencies = []
+    lateness = []
+    errors = defaultdict(int)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        before = await app.metrics(session)
+        started = time.monotonic()
+
+        async def send(offset: float, update: dict):
+            due = started + offset / speed if speed else started
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            user_id = _sender_id(update)
+            async with locks[user_id], limit:
+                lateness.append(max(time.monotonic() - due, 0.0))
+                if user_id is not None:
+                    tracker.sent(user_id)
+                sent_at = time.perf_counter()
+                try:
+                    async with session.post(app.url + "/webhook", json=update) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors[f"http_{resp.status}"] += 1
+                except aiohttp.ClientError as e:
+                    errors[type(e).__name__] += 1
+                    return
+                webhook_latencies.append(time.perf_counter() - sent_at)
+
+        # Задачи создаются в порядке записи: asyncio.Lock честный, поэтому порядок
+        # апдейтов одного пользователя сохраняется и при --speed max
+        await asyncio.gather(*(send(offset, update) for offset, update in records))
+        elapsed = time.monotonic() - started
+        after = await app.metrics(session)
+
+    telegram.on_send = None
+    return {
+        "updates": len(webhook_latencies),
+        "errors": dict(errors),
+        "seconds": round(elapsed, 2),
+        "recorded_seconds": round(records[-1][0] - records[0][0], 2) if records else 0.0,
+        "throughput_per_s": round(len(webhook_latencies) / elapsed, 1) if elapsed else 0.0,
+        "webhook": latency_summary(webhook_latencies),
+        "first_reply": latency_summary(tracker.latencies),
+        "send_lateness": latency_summary(lateness),
+        "db_queries": parse_metric_counts(after, "sqlite_query_duration_seconds")
+        - parse_metric_counts(before, "sqlite_query_duration_seconds"),
+        "openai_calls": parse_metric_counts(after, "openai_request_duration_seconds")
+        - parse_metric_counts(before, "openai_request_duration_seconds"),
+        "bot_api_calls": sum(telegram.calls.values()),
+    }
+
+
+def print_result(result: dict, baseline: dict = None):
+    print(f"Апдейтов: {result['updates']} за {result['seconds']} с "
+          f"(в записи {result['recorded_seconds']} с), {result['throughput_per_s']}/с, "
+          f"ошибок: {sum(result['errors'].values())}")
+    print(f"SQL: {result['db_queries']}, OpenAI: {result['openai_calls']}, Bot API: {result['bot_api_calls']}")
+    if result["send_lateness"]["p95_ms"] > 100:
+        print(f"⚠️ Генератор отставал от расписания (p95 {result['send_lateness']['p95_ms']} мс) — "
+              f"задержки ниже включают очередь")
+    print(f"{'':<14} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for key, title in (("webhook", "webhook"), ("first_reply", "первый ответ")):
+        row = result[key]
+        print(f"{title:<14} " + " ".join(f"{row[p]:>9}" for p in ("p50_ms", "p95_ms", "p99_ms", "max_ms")))
+        if baseline:
+            old = baseline[key]
+            print(f"{'  было':<14} " + " ".join(f"{old[p]:>9}" for p in ("p50_ms", "p95_ms", "p99_ms", "max_ms")))
+            print(f"{'  изменение':<14} " + " ".join(
+                f"{(row[p] / old[p] - 1 if old[p] else 0):>+9.0%}" for p in ("p50_ms", "p95_ms", "p99_ms", "max_ms")
+            ))
+    print("(задержки в мс)")
+
+
+async def main(args):
+    records = []
+    for path in args.recordings:
+        records.extend(read_recording(path))
+    records.sort(key=lambda r: r[0])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("📭 Запись пуста")
+        return None
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+
+    telegram = TelegramStub(Upstream(args.tg_latency, args.tg_jitter))
+    openai = OpenAIStub(Upstream(args.openai_latency, args.openai_jitter, args.openai_errors))
+    await telegram.start()
+    await openai.start()
+    app = AppUnderTest(telegram.url, openai.url, workers=args.workers)
+    try:
+        await app.start()
+        if not args.free_users:
+            users = {_sender_id(u) for _, u in records} - {None, REPLAY_ADMIN_ID}
+            app.subscribe_users(sorted(users))
+        print(f"▶ {len(records)} апдейтов, скорость {'максимальная' if not speed else args.speed + 'x'}")
+        result = await replay(app, telegram, records, speed, args.concurrency)
+    finally:
+        await app.stop()
+        await telegram.stop()
+        await openai.stop()
+
+    result["speed"] = args.speed
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_result(result, baseline)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"💾 Результаты сохранены в {args.json}")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    parser.add_argument("recordings", nargs="+", help="файлы RECORD_UPDATES (*.jsonl.gz)")
+    parser.add_argument("--speed", default="1", help="1, 10, ... или max")
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременных запросов к /webhook")
+    parser.add_argument("--limit", type=int, default=0, help="воспроизвести только первые N апдейтов")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--free-users", action="store_true", help="не оформлять подписку пользователям записи")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-jitter", type=float, default=0.4)
+    parser.add_argument("--openai-errors", type=float, default=0.0)
+    parser.add_argument("--tg-latency", type=float, default=0.03)
+    parser.add_argument("--tg-jitter", type=float, default=0.3)
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--compare", help="результаты прошлого прогона (--json) для сравнения")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
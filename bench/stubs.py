@@ -0,0 +1,163 @@
+# bench/stubs.py
+# === Заглушки Bot API и OpenAI для нагрузочных тестов (aiohttp) ===
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from aiohttp import web
+
+
+@dataclass
+class Upstream:
+    """
+    Поведение заглушки: задержка — логнормальное распределение с медианой
+    latency и разбросом jitter (0 — фиксированная), error_rate — доля ответов 500.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    def delay(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.jitter <= 0:
+            return self.latency
+        return random.lognormvariate(0, self.jitter) * self.latency
+
+    def fails(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class _StubServer:
+    def __init__(self, upstream: Upstream):
+        self.upstream = upstream
+        self.calls = Counter()
+        self.errors = Counter()
+        self.app = web.Application(client_max_size=32 * 1024 * 1024)
+        self._runner = None
+        self.url = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _simulate(self, name: str) -> bool:
+        """Ждёт задержку; False — нужно ответить ошибкой."""
+        self.calls[name] += 1
+        delay = self.upstream.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if self.upstream.fails():
+            self.errors[name] += 1
+            return False
+        return True
+
+    def reset(self):
+        self.calls.clear()
+        self.errors.clear()
+
+
+# === Bot API ===
+class TelegramStub(_StubServer):
+    """
+    Отвечает на /bot<token>/<method> правдоподобными объектами.
+    on_send(chat_id, method) вызывается для каждого сообщения пользователю —
+    так генератор нагрузки меряет время до ответа.
+    """
+
+    _SENDS = {"sendMessage", "sendPhoto", "sendDocument", "editMessageText", "sendMediaGroup"}
+
+    def __init__(self, upstream: Upstream = None, on_send=None):
+        super().__init__(upstream or Upstream())
+        self.on_send = on_send
+        self._message_ids = itertools.count(1000)
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        return {k: v for k, v in form.items() if isinstance(v, str)}
+
+    def _message(self, chat_id) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": "ok",
+        }
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if not await self._simulate(method):
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error: stub"}, status=500
+            )
+        chat_id = params.get("chat_id", 0)
+        if method in self._SENDS:
+            if self.on_send is not None:
+                self.on_send(int(chat_id), method)
+            result = self._message(chat_id)
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getMyCommands":
+            result = []
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "stub", "username": "stub_bot"}
+        else:
+            result = True  # answerCallbackQuery, deleteMessage, setWebhook, ...
+        return web.json_response({"ok": True, "result": result})
+
+
+# === OpenAI ===
+class OpenAIStub(_StubServer):
+    def __init__(self, upstream: Upstream = None, image_url: str = "https://example.com/stub.png"):
+        super().__init__(upstream or Upstream())
+        self.image_url = image_url
+        self.app.router.add_post("/v1/chat/completions", self._chat)
+        self.app.router.add_post("/v1/images/generations", self._image)
+
+    @staticmethod
+    def _error():
+        return web.json_response(
+            {"error": {"message": "stub overloaded", "type": "server_error", "code": None}}, status=500
+        )
+
+    async def _chat(self, request: web.Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o")
+        if not await self._simulate(f"chat:{model}"):
+            return self._error()
+        return web.json_response({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Ответ заглушки OpenAI."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+
+    async def _image(self, request: web.Request):
+        body = await request.json()
+        if not await self._simulate(f"image:{body.get('model', 'dall-e-3')}"):
+            return self._error()
+        return web.json_response({"created": int(time.time()), "data": [{"url": self.image_url}]})
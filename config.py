@@ -0,0 +1,55 @@
+# config.py
+# === Настройки экземпляра бота ===
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+@dataclass
+class Config:
+    bot_token: str
+    admin_id: int = 1082828397
+    domain_url: Optional[str] = None
+    openai_api_key: Optional[str] = None
+    cryptopay_api_key: Optional[str] = None
+    db_path: str = "users.db"
+    data_dir: str = "data"
+    workers: int = 1
+    # Как часто сверять оплаты с CryptoBot на случай потерянных вебхуков (0 — не сверять)
+    reconcile_interval: int = 300
+    metrics_token: Optional[str] = None
+    slow_update_ms: int = 1000
+    loop_lag_ms: int = 100
+    # Свои адреса Bot API и OpenAI: локальный Bot API сервер, прокси или заглушки нагрузочного теста
+    telegram_api_url: Optional[str] = None
+    openai_base_url: Optional[str] = None
+    # Запись апдейтов для bench/replay.py: путь к файлу .jsonl.gz и политика текста (keep/hash/drop)
+    record_updates: Optional[str] = None
+    record_text: str = "hash"
+
+    @classmethod
+    def from_env(cls, **overrides) -> "Config":
+        """Читает .env и переменные окружения; overrides имеют приоритет."""
+        load_dotenv()
+        values = dict(
+            bot_token=os.getenv("BOT_TOKEN"),
+            admin_id=int(os.getenv("ADMIN_ID", "1082828397")),
+            domain_url=os.getenv("DOMAIN_URL"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            cryptopay_api_key=os.getenv("CRYPTOPAY_API_KEY"),
+            db_path=os.getenv("DB_PATH", "users.db"),
+            data_dir=os.getenv("DATA_DIR", "data"),
+            workers=int(os.getenv("WORKERS", "1")),
+            reconcile_interval=int(os.getenv("RECONCILE_INTERVAL", "300")),
+            metrics_token=os.getenv("METRICS_TOKEN"),
+            slow_update_ms=int(os.getenv("SLOW_UPDATE_MS", "1000")),
+            loop_lag_ms=int(os.getenv("LOOP_LAG_MS", "100")),
+            telegram_api_url=os.getenv("TELEGRAM_API_URL"),
+            openai_base_url=os.getenv("OPENAI_BASE_URL"),
+            record_updates=os.getenv("RECORD_UPDATES"),
+            record_text=os.getenv("RECORD_TEXT", "hash"),
+        )
+        values.update(overrides)
+        return cls(**values)
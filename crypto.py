@@ -1,27 +1,148 @@
-import os
-from aiocryptopay import AioCryptoPay, Networks
-from dotenv import load_dotenv
+import asyncio
+import logging
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
 
-load_dotenv()
+# Срок жизни инвойса и запас, с которым его ещё можно отдать пользователю
+INVOICE_TTL = 3600
+INVOICE_REUSE_MARGIN = 300
 
-CRYPTOPAY_API_KEY = os.getenv("CRYPTOPAY_API_KEY")
-if not CRYPTOPAY_API_KEY:
-    raise ValueError("❌ Не задан CRYPTOPAY_API_KEY в .env")
+# Сверка оплат: максимум, который отдаёт getInvoices за запрос, и сколько ещё проверять
+# инвойсы после истечения (оплата могла пройти в последнюю минуту, а вебхук — потеряться)
+RECONCILE_PAGE_SIZE = 1000
+RECONCILE_LOOKBACK = 86400
+SUBSCRIPTION_DAYS = 30
+HIGH_WATER_KEY = "paid_invoices_high_water"
 
-cryptopay = AioCryptoPay(token=CRYPTOPAY_API_KEY, network=Networks.MAIN_NET)
+# Замки по пользователю: несколько быстрых нажатий /buy создают один инвойс, а не несколько
+_invoice_locks = weakref.WeakValueDictionary()
+
+
+# === Клиент CryptoBot ===
+def make_cryptopay(api_key: str | None):
+    if not api_key:
+        raise ValueError("❌ Не задан CRYPTOPAY_API_KEY в .env")
+    from aiocryptopay import AioCryptoPay, Networks  # тяжёлый импорт (pydantic-модели)
+    return AioCryptoPay(token=api_key, network=Networks.MAIN_NET)
 
 # === Создание инвойса ===
-async def create_invoice(user_id: int) -> str | None:
+async def create_invoice(cryptopay, user_id: int, expires_in: int = INVOICE_TTL):
     if not user_id:
         raise ValueError("❌ user_id не может быть None")
     try:
-        invoice = await cryptopay.create_invoice(
+        return await cryptopay.create_invoice(
             asset="USDT",
             amount="1.00",
             hidden_message="Спасибо за покупку!",
-            payload=str(user_id)
+            payload=str(user_id),
+            expires_in=expires_in
         )
-        return invoice.bot_invoice_url
     except Exception as e:
         print(f"[CryptoBot] ❌ Ошибка создания инвойса: {e}")
         return None
+
+async def get_invoice_url(cryptopay, db, user_id: int) -> str | None:
+    """
+    Ссылка на оплату: повторные /buy отдают уже созданный инвойс, пока он действителен.
+    Новый инвойс вытесняет старый, а старый удаляется в CryptoBot, чтобы его нельзя
+    было оплатить второй раз.
+    """
+    lock = _invoice_locks.get(user_id)
+    if lock is None:
+        lock = _invoice_locks[user_id] = asyncio.Lock()
+    async with lock:
+        cached = db.active_invoice(user_id, time.time() + INVOICE_REUSE_MARGIN)
+        if cached:
+            return cached[1]
+        invoice = await create_invoice(cryptopay, user_id)
+        if invoice is None:
+            return None
+        superseded = db.save_invoice(user_id, invoice.invoice_id, invoice.bot_invoice_url, time.time() + INVOICE_TTL)
+    if superseded is not None:
+        try:
+            await cryptopay.delete_invoice(superseded)
+        except Exception as e:
+            # Уже оплачен или истёк — удалять нечего; сверка проверит его сама
+            logging.info(f"[CryptoBot] Инвойс {superseded} не удалён: {e}")
+        else:
+            db.forget_superseded([superseded])
+    return invoice.bot_invoice_url
+
+
+# === Сверка оплат (запасной путь для потерянных вебхуков) ===
+def _as_list(result) -> list:
+    # getInvoices возвращает None на пустой странице и один объект, если запрошен один id
+    if result is None:
+        return []
+    return result if isinstance(result, list) else [result]
+
+def _payment_row(invoice):
+    try:
+        user_id = int(invoice.payload)
+    except (TypeError, ValueError):
+        return None  # инвойс создан не ботом
+    asset = invoice.paid_asset or invoice.asset
+    return (
+        invoice.invoice_id,
+        user_id,
+        invoice.paid_amount if invoice.paid_amount is not None else invoice.amount,
+        getattr(asset, "value", asset),
+        invoice.paid_at.isoformat() if invoice.paid_at else None,
+    )
+
+async def fetch_paid_invoices(cryptopay, db) -> tuple:
+    """
+    Оплаченные инвойсы, которых может не быть в payments, и новый high-water mark.
+
+    Сначала выданные ботом инвойсы проверяются пачками invoice_ids, затем
+    оплаченные листаются страницами по RECONCILE_PAGE_SIZE, пока не дойдут до
+    уже просмотренного id (getInvoices отдаёт новые инвойсы первыми).
+    """
+    found = {}
+    ids = db.unpaid_invoice_ids(time.time() - RECONCILE_LOOKBACK)
+    for start in range(0, len(ids), RECONCILE_PAGE_SIZE):
+        batch = ids[start:start + RECONCILE_PAGE_SIZE]
+        result = await cryptopay.get_invoices(invoice_ids=batch, status="paid", count=len(batch))
+        for invoice in _as_list(result):
+            found[invoice.invoice_id] = invoice
+
+    high_water = int(db.get_meta(HIGH_WATER_KEY, 0))
+    newest = high_water
+    offset = 0
+    while True:
+        page = _as_list(await cryptopay.get_invoices(status="paid", offset=offset, count=RECONCILE_PAGE_SIZE))
+        for invoice in page:
+            newest = max(newest, invoice.invoice_id)
+            if invoice.invoice_id > high_water:
+                found[invoice.invoice_id] = invoice
+        if len(page) < RECONCILE_PAGE_SIZE or min(i.invoice_id for i in page) <= high_water:
+            break
+        offset += RECONCILE_PAGE_SIZE
+    return list(found.values()), newest
+
+async def reconcile_payments(cryptopay, db) -> list:
+    """
+    Применяет пропущенные оплаты одной транзакцией; возвращает новые (как record_payments).
+    Оплаты старше срока подписки (первая сверка видит всю историю) только записываются.
+    """
+    # Истёкший инвойс оплатить уже нельзя: после этой проверки вытесненные можно забыть
+    settled = db.expired_superseded_ids(time.time())
+    invoices, newest = await fetch_paid_invoices(cryptopay, db)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=SUBSCRIPTION_DAYS)
+    recent, old = [], []
+    for invoice in invoices:
+        row = _payment_row(invoice)
+        if row is not None:
+            paid_at = invoice.paid_at
+            if paid_at is not None and paid_at.tzinfo is None:
+                paid_at = paid_at.replace(tzinfo=timezone.utc)
+            (old if paid_at is not None and paid_at < cutoff else recent).append(row)
+    if old:
+        db.import_payments(old)
+    applied = db.record_payments(recent, days=SUBSCRIPTION_DAYS, label="reconcile_payments") if recent else []
+    # Курсор сдвигается только после записи: упавшая сверка повторится целиком
+    db.set_meta(HIGH_WATER_KEY, newest)
+    if settled:
+        db.forget_superseded(settled)
+    return applied
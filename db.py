@@ -0,0 +1,386 @@
+# db.py
+# === Работа с SQLite (users.db) ===
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+FREE_USES_LIMIT = 10
+
+# Сколько SQLite сам ждёт блокировку, если базу держит другой процесс
+BUSY_TIMEOUT_MS = 5000
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)", re.IGNORECASE)
+_query_labels = {}
+
+
+def query_label(sql: str) -> str:
+    """Короткая метка запроса для метрик: «SELECT users», «UPDATE users»."""
+    label = _query_labels.get(sql)
+    if label is None:
+        verb = sql.split(None, 1)[0].upper() if sql.strip() else "?"
+        table = _TABLE_RE.search(sql)
+        label = f"{verb} {table.group(1)}" if table else verb
+        _query_labels[sql] = label
+    return label
+
+
+class Database:
+    """
+    Одно соединение на процесс.
+
+    Файл открыт в режиме WAL: читатели не ждут писателей, а несколько
+    процессов (uvicorn workers) могут безопасно писать в одну базу.
+    Все многошаговые записи идут через transaction() — BEGIN IMMEDIATE
+    сразу берёт блокировку на запись, поэтому два процесса не могут
+    одновременно прочитать и затем перезаписать одни и те же данные.
+    """
+
+    def __init__(self, path: str, admin_id: int):
+        self.path = path
+        self.admin_id = admin_id
+        self._conn = None
+        self._lock = threading.RLock()
+        # Хук для метрик: on_query(label, seconds, error)
+        self.on_query = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Файл открывается при первом запросе, а не при создании объекта
+        if self._conn is None:
+            # isolation_level=None — autocommit: одиночные запросы атомарны сами по себе,
+            # а транзакции открываются явно в transaction()
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                   timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Низкоуровневые методы ---
+    def _run(self, sql: str, params, fetch):
+        with self._lock:
+            if self.on_query is None:
+                return fetch(self.conn.execute(sql, params))
+            started = time.perf_counter()
+            error = None
+            try:
+                return fetch(self.conn.execute(sql, params))
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.on_query(query_label(sql), time.perf_counter() - started, error)
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self._run(sql, params, lambda cur: cur)
+
+    def fetchone(self, sql: str, params=()):
+        return self._run(sql, params, sqlite3.Cursor.fetchone)
+
+    def fetchall(self, sql: str, params=()) -> list:
+        return self._run(sql, params, sqlite3.Cursor.fetchall)
+
+    @contextmanager
+    def transaction(self, label: str = "transaction"):
+        """Транзакция на запись; занятую базу ждёт сам SQLite (busy_timeout), без пауз в цикле."""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e):
+                    logging.warning(f"⏳ База занята другим процессом дольше {BUSY_TIMEOUT_MS} мс: {label}")
+                raise
+            try:
+                yield self.conn
+            except BaseException as e:
+                self.conn.execute("ROLLBACK")
+                if self.on_query is not None:
+                    self.on_query(label, time.perf_counter() - started, e)
+                raise
+            else:
+                self.conn.execute("COMMIT")
+                if self.on_query is not None:
+                    self.on_query(label, time.perf_counter() - started, None)
+
+    # --- Схема ---
+    def init_schema(self):
+        with self.transaction("init_schema") as tx:
+            tx.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    usage_count INTEGER DEFAULT 0,
+                    subscribed INTEGER DEFAULT 0,
+                    subscription_expires TEXT,
+                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            tx.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    type TEXT,
+                    prompt TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # invoice_id — PRIMARY KEY: повторная доставка того же вебхука ничего не меняет
+            tx.execute("""
+                CREATE TABLE IF NOT EXISTS payments (
+                    invoice_id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    amount TEXT,
+                    asset TEXT,
+                    paid_at TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            tx.execute("CREATE INDEX IF NOT EXISTS payments_user_id ON payments (user_id)")
+            tx.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Последний неоплаченный инвойс пользователя: /buy отдаёт его ссылку, пока он не истёк
+            tx.execute("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    user_id INTEGER PRIMARY KEY,
+                    invoice_id INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            # Вытесненные инвойсы, которые не удалось удалить в CryptoBot (например, уже оплачены):
+            # сверка проверяет их, пока оплата не записана или инвойс не истёк без оплаты
+            tx.execute("""
+                CREATE TABLE IF NOT EXISTS superseded_invoices (
+                    invoice_id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            tx.execute(
+                "INSERT OR IGNORE INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) "
+                "VALUES (?, 0, 1, NULL, ?)",
+                (self.admin_id, datetime.now().strftime("%Y-%m-%d"))
+            )
+
+    # --- Пользователи и лимиты ---
+    def is_admin(self, user_id: int) -> bool:
+        return int(user_id) == self.admin_id
+
+    def user_tier(self, user_id: int) -> str:
+        """Тариф для метрик: admin, subscriber или free."""
+        if self.is_admin(user_id):
+            return "admin"
+        return "subscriber" if self.is_subscribed(user_id) else "free"
+
+    def ensure_user(self, user_id: int):
+        # INSERT OR IGNORE — один атомарный запрос вместо SELECT + INSERT
+        self.execute(
+            "INSERT OR IGNORE INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) "
+            "VALUES (?, 0, ?, NULL, ?)",
+            (user_id, 1 if self.is_admin(user_id) else 0, datetime.now().strftime("%Y-%m-%d"))
+        )
+
+    def activate_subscription(self, user_id: int, days: int = 30):
+        expires = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+        self.execute(
+            "UPDATE users SET subscribed = 1, subscription_expires = ? WHERE user_id = ?",
+            (expires, user_id)
+        )
+
+    # --- Оплаты ---
+    def record_payment(self, invoice_id: int, user_id: int, amount, asset: str = None,
+                       paid_at: str = None, days: int = 30) -> bool:
+        """
+        Сохраняет оплату и открывает подписку одной транзакцией.
+        False — этот инвойс уже был учтён (повторная доставка вебхука).
+        """
+        return bool(self.record_payments([(invoice_id, user_id, amount, asset, paid_at)], days))
+
+    def record_payments(self, payments: list, days: int = 30, label: str = "record_payment") -> list:
+        """
+        Пачка оплат (invoice_id, user_id, amount, asset, paid_at) одной транзакцией.
+        Возвращает только новые — уже учтённые инвойсы пропускаются.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        expires = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+        applied = []
+        with self.transaction(label) as tx:
+            for invoice_id, user_id, amount, asset, paid_at in payments:
+                inserted = tx.execute(
+                    "INSERT OR IGNORE INTO payments (invoice_id, user_id, amount, asset, paid_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (invoice_id, user_id, str(amount), asset, paid_at)
+                ).rowcount
+                if not inserted:
+                    continue
+                tx.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
+                tx.execute("DELETE FROM superseded_invoices WHERE invoice_id = ?", (invoice_id,))
+                tx.execute(
+                    "INSERT OR IGNORE INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) "
+                    "VALUES (?, 0, 0, NULL, ?)",
+                    (user_id, today)
+                )
+                tx.execute(
+                    "UPDATE users SET subscribed = 1, subscription_expires = ? WHERE user_id = ?",
+                    (expires, user_id)
+                )
+                applied.append((invoice_id, user_id, amount, asset, paid_at))
+        return applied
+
+    def import_payments(self, payments: list) -> int:
+        """Старые оплаты (как в record_payments): только запись в таблицу, подписки не трогаются."""
+        with self.transaction("import_payments") as tx:
+            before = tx.total_changes
+            tx.executemany(
+                "INSERT OR IGNORE INTO payments (invoice_id, user_id, amount, asset, paid_at) VALUES (?, ?, ?, ?, ?)",
+                [(invoice_id, user_id, str(amount), asset, paid_at)
+                 for invoice_id, user_id, amount, asset, paid_at in payments]
+            )
+            return tx.total_changes - before
+
+    def unpaid_invoice_ids(self, expired_after: float) -> list:
+        """
+        Выданные пользователям инвойсы без оплаты, истёкшие не раньше expired_after,
+        и все вытесненные инвойсы, которые ещё не сняты с проверки.
+        """
+        return [row[0] for row in self.fetchall(
+            "SELECT invoice_id FROM invoices WHERE expires_at > ? "
+            "UNION SELECT invoice_id FROM superseded_invoices ORDER BY invoice_id",
+            (expired_after,)
+        )]
+
+    def expired_superseded_ids(self, before: float) -> list:
+        """Вытесненные инвойсы, истёкшие до before: после ещё одной проверки их можно забыть."""
+        return [row[0] for row in self.fetchall(
+            "SELECT invoice_id FROM superseded_invoices WHERE expires_at < ?", (before,)
+        )]
+
+    def forget_superseded(self, invoice_ids: list):
+        """Снимает вытесненные инвойсы с проверки: удалены в CryptoBot или истекли без оплаты."""
+        with self.transaction("forget_superseded") as tx:
+            tx.executemany("DELETE FROM superseded_invoices WHERE invoice_id = ?", [(i,) for i in invoice_ids])
+
+    def pending_payments(self, limit: int = 20) -> list:
+        """
+        Последние оплаты пользователей без активной подписки.
+        Идёт по первичному ключу payments от новых к старым и проверяет users по
+        первичному ключу — останавливается на limit найденных, без полного чтения.
+        """
+        return self.fetchall(
+            "SELECT p.user_id, p.amount, p.asset, p.invoice_id FROM payments p "
+            "JOIN users u ON u.user_id = p.user_id "
+            "WHERE u.subscribed = 0 ORDER BY p.invoice_id DESC LIMIT ?",
+            (limit,)
+        )
+
+    # --- Служебные значения (курсоры фоновых задач) ---
+    def get_meta(self, key: str, default=None):
+        row = self.fetchone("SELECT value FROM meta WHERE key = ?", (key,))
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def is_subscribed(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return True
+        result = self.fetchone("SELECT subscribed, subscription_expires FROM users WHERE user_id = ?", (user_id,))
+        if result:
+            subscribed, expires = result
+            if subscribed and expires:
+                return datetime.strptime(expires, "%Y-%m-%d") >= datetime.now()
+        return False
+
+    def get_usage_count(self, user_id: int) -> int:
+        result = self.fetchone("SELECT usage_count FROM users WHERE user_id = ?", (user_id,))
+        return result[0] if result else 0
+
+    def increment_usage(self, user_id: int):
+        if self.is_admin(user_id):
+            return
+        self.execute("UPDATE users SET usage_count = usage_count + 1 WHERE user_id = ?", (user_id,))
+
+    def is_limited(self, user_id: int) -> bool:
+        if self.is_admin(user_id):
+            return False
+        return not self.is_subscribed(user_id) and self.get_usage_count(user_id) >= FREE_USES_LIMIT
+
+    def record_usage(self, user_id: int, kind: str, prompt: str):
+        """Засчитывает генерацию и пишет её в историю одной транзакцией."""
+        if self.is_admin(user_id):
+            return
+        with self.transaction("record_usage") as tx:
+            tx.execute("UPDATE users SET usage_count = usage_count + 1 WHERE user_id = ?", (user_id,))
+            tx.execute(
+                "INSERT INTO history (user_id, type, prompt) VALUES (?, ?, ?)",
+                (user_id, kind, prompt)
+            )
+
+    # --- Активные инвойсы ---
+    def active_invoice(self, user_id: int, valid_until: float):
+        """(invoice_id, url) инвойса, который не истечёт раньше valid_until (unix time)."""
+        return self.fetchone(
+            "SELECT invoice_id, url FROM invoices WHERE user_id = ? AND expires_at > ?", (user_id, valid_until)
+        )
+
+    def save_invoice(self, user_id: int, invoice_id: int, url: str, expires_at: float):
+        """
+        Запоминает новый инвойс. Возвращает id вытесненного инвойса или None.
+        Вытесненный остаётся в superseded_invoices, пока его не снимет forget_superseded
+        или не запишет оплату record_payments.
+        """
+        with self.transaction("save_invoice") as tx:
+            previous = tx.execute(
+                "SELECT invoice_id, expires_at FROM invoices WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if previous and previous[0] != invoice_id:
+                tx.execute(
+                    "INSERT OR IGNORE INTO superseded_invoices (invoice_id, user_id, expires_at) VALUES (?, ?, ?)",
+                    (previous[0], user_id, previous[1])
+                )
+            tx.execute(
+                "INSERT OR REPLACE INTO invoices (user_id, invoice_id, url, expires_at) VALUES (?, ?, ?, ?)",
+                (user_id, invoice_id, url, expires_at)
+            )
+        if previous and previous[0] != invoice_id:
+            return previous[0]
+        return None
+
+    # --- Статистика для админки ---
+    def signup_stats(self, today) -> dict:
+        """Число пользователей, пришедших с начала времён / сегодня / за неделю / месяц / год."""
+        def count_since(date):
+            return self.fetchone("SELECT COUNT(*) FROM users WHERE joined_at >= ?", (date.strftime("%Y-%m-%d"),))[0]
+
+        return {
+            "Всего": count_since(datetime(1970, 1, 1)),
+            "Сегодня": count_since(today),
+            "Неделя": count_since(today - timedelta(days=7)),
+            "Месяц": count_since(today - timedelta(days=30)),
+            "Год": count_since(today - timedelta(days=365))
+        }
+
+    def count_subscribers(self) -> int:
+        return self.fetchone("SELECT COUNT(*) FROM users WHERE subscribed = 1")[0]
+
+    def expire_subscriptions(self, date: str) -> list:
+        """Снимает подписки, истекающие в date. Возвращает id пользователей."""
+        with self.transaction("expire_subscriptions") as tx:
+            users = [row[0] for row in tx.execute(
+                "SELECT user_id FROM users WHERE subscribed = 1 AND subscription_expires = ?", (date,)
+            )]
+            tx.execute(
+                "UPDATE users SET subscribed = 0, subscription_expires = NULL "
+                "WHERE subscribed = 1 AND subscription_expires = ?",
+                (date,)
+            )
+        return users
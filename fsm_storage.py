@@ -0,0 +1,206 @@
+# fsm_storage.py
+# === FSM-хранилище aiogram на SQLite с горячим кэшем в памяти ===
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None):
+        self.state = state
+        self.data = data or {}
+        self.touched = time.monotonic()
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Замена MemoryStorage: состояния переживают перезапуск, память ограничена.
+
+    - Чтение идёт из кэша; промах — один SELECT по первичному ключу.
+    - Запись меняет только кэш и помечает ключ «грязным»; фоновая задача раз в
+      flush_interval секунд сбрасывает все изменения одной транзакцией.
+    - Записи, к которым не обращались cache_ttl секунд, выгружаются из кэша,
+      а в базе удаляются состояния, не менявшиеся state_ttl секунд.
+
+    shared=True — режим нескольких процессов: кэш не используется, каждое
+    чтение идёт в базу, каждая запись сразу фиксируется (WAL + busy_timeout),
+    иначе процессы видели бы устаревшие состояния друг друга.
+    """
+
+    def __init__(self, path: str = "data/fsm.db", state_ttl: float = 7 * 86400,
+                 cache_ttl: float = 600, max_cached: int = 10000,
+                 flush_interval: float = 2.0, shared: bool = False):
+        self.shared = shared
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty = set()
+        self._flusher: Optional[asyncio.Task] = None
+        self.path = path
+        self._db = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # База открывается при первом обращении к состояниям
+        if self._db is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at)")
+            conn.commit()
+            self._db = conn
+        return self._db
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        thread_id = "" if key.thread_id is None else key.thread_id
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+    # --- Кэш ---
+    def _load(self, skey: str) -> _Record:
+        row = self._conn.execute(
+            "SELECT state, data, updated_at FROM fsm WHERE key = ?", (skey,)
+        ).fetchone()
+        if row and time.time() - row[2] <= self.state_ttl:
+            return _Record(row[0], json.loads(row[1]) if row[1] else {})
+        return _Record()
+
+    def _get_record(self, key: StorageKey) -> _Record:
+        skey = self._key(key)
+        if self.shared:
+            return self._load(skey)
+        record = self._cache.get(skey)
+        if record is None:
+            record = self._load(skey)
+            self._cache[skey] = record
+            self._evict_overflow(keep=skey)
+        else:
+            self._cache.move_to_end(skey)
+            record.touched = time.monotonic()
+        return record
+
+    def _mark_dirty(self, key: StorageKey, record: _Record):
+        if self.shared:
+            self._write([(self._key(key), record)])
+            return
+        self._dirty.add(self._key(key))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def _evict_overflow(self, keep: Optional[str] = None):
+        # Самые давние записи в начале OrderedDict; грязные ждут сброса, а только что
+        # загруженную запись (keep) вызывающий сейчас изменит — её не трогаем.
+        # Если выгрузить нечего, кэш временно превышает лимит до следующего сброса
+        while len(self._cache) > self.max_cached:
+            for skey in self._cache:
+                if skey not in self._dirty and skey != keep:
+                    del self._cache[skey]
+                    break
+            else:
+                return
+
+    def evict_idle(self) -> int:
+        """Выгружает из кэша записи без обращений дольше cache_ttl."""
+        deadline = time.monotonic() - self.cache_ttl
+        idle = [k for k, r in self._cache.items() if r.touched < deadline and k not in self._dirty]
+        for skey in idle:
+            del self._cache[skey]
+        return len(idle)
+
+    # --- Сброс в базу ---
+    def flush(self):
+        """Пишет все изменённые записи одной транзакцией."""
+        if not self._dirty:
+            return
+        self._write([(skey, self._cache.get(skey)) for skey in self._dirty])
+        self._dirty.clear()
+
+    def _write(self, records: list):
+        now = time.time()
+        upserts, deletes = [], []
+        for skey, record in records:
+            if record is None or record.empty:
+                deletes.append((skey,))
+            else:
+                upserts.append((skey, record.state, json.dumps(record.data, ensure_ascii=False), now))
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                    "data = excluded.data, updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+    def purge_expired(self) -> int:
+        """Удаляет из базы состояния, которые не менялись дольше state_ttl."""
+        with self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.state_ttl,)
+            )
+        return cur.rowcount
+
+    async def _flush_loop(self):
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+                self._evict_overflow()
+                self.evict_idle()
+                if time.monotonic() - last_purge > 3600:
+                    self.purge_expired()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                logging.error(f"❌ Ошибка сохранения FSM-состояний: {e}", exc_info=True)
+
+    # --- API BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._get_record(key).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._get_record(key)
+        record.data = data.copy()
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._get_record(key).data.copy()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._db is None:
+            return
+        self.flush()
+        self._db.close()
+        self._db = None
@@ -1,6 +1,20 @@
 # launch.py
 import uvicorn
-from main import app
+
+from config import Config
+
+# WORKERS > 1 — несколько процессов uvicorn: разбор апдейтов идёт на всех ядрах,
+# фоновые задачи выполняет только процесс-лидер (см. leader.py).
+# Берём из Config, чтобы значение из .env тоже учитывалось
+WORKERS = Config.from_env().workers
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        # Каждый процесс собирает своё приложение через фабрику
+        uvicorn.run("main:create_app", factory=True, host="0.0.0.0", port=8000, workers=WORKERS)
+    else:
+        from main import create_app
+        uvicorn.run(create_app(), host="0.0.0.0", port=8000)
+else:
+    from main import create_app
+    app = create_app()  # для запуска через `uvicorn launch:app`
@@ -0,0 +1,60 @@
+# leader.py
+# === Выбор лидера среди процессов (uvicorn workers) через файловую блокировку ===
+import asyncio
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: там всегда один процесс
+    fcntl = None
+
+
+class LeaderLock:
+    """
+    Эксклюзивная flock-блокировка на файле.
+
+    Её держит ровно один процесс — он и выполняет фоновые задачи
+    (напоминания, бэкапы, регистрацию вебхука). Если лидер падает,
+    ОС снимает блокировку, и её подхватывает другой процесс.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+    async def campaign(self, on_elected, retry_interval: float = 15.0):
+        """Ждёт, пока процесс станет лидером, и один раз вызывает on_elected()."""
+        while not self.try_acquire():
+            await asyncio.sleep(retry_interval)
+        logging.info(f"👑 Процесс {os.getpid()} стал лидером: запускаю фоновые задачи")
+        await on_elected()
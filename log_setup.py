@@ -0,0 +1,233 @@
+# log_setup.py
+# === Асинхронное логирование: QueueHandler → фоновый поток с файлами ===
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+from datetime import datetime
+
+from tracing import current_trace_id
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+WEBHOOK_LOG = "webhook.log"
+ERRORS_LOG = "errors.log"
+ADMIN_LOG = "admin.log"
+BROADCAST_LOG = "broadcast.log"
+
+# Эти логгеры пишут в отдельные файлы и никогда не сэмплируются
+ADMIN_LOGGER = "admin"
+BROADCAST_LOGGER = "broadcast"
+_NEVER_SAMPLED = {ADMIN_LOGGER, BROADCAST_LOGGER}
+
+_listener = None
+_multiprocess_files = []
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись. Доп. поля передаются через extra={"fields": {...}}."""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            payload["trace_id"] = trace_id
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, dict):
+            payload.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class InfoSampler(logging.Filter):
+    """
+    Пропускает только долю INFO-записей (rate от 0 до 1).
+    WARNING и выше проходят всегда, как и записи с extra={"sample": False}.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno != logging.INFO:
+            return True
+        if record.name in _NEVER_SAMPLED or getattr(record, "sample", True) is False:
+            return True
+        return random.random() < self.rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    В отличие от стандартного, не склеивает запись в строку заранее:
+    форматирование (текст или JSON) выполняется уже в потоке-слушателе.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # correlation ID берём здесь: в потоке-слушателе contextvars апдейта уже нет
+        record.trace_id = current_trace_id()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(filename: str, formatter: logging.Formatter, level=logging.NOTSET,
+                  multiprocess: bool = False):
+    rotation = os.getenv("LOG_ROTATION", "size")
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    if multiprocess:
+        # Несколько процессов пишут в один файл: ротирует только лидер
+        # через rotate_logs(), остальные переоткрывают файл после переименования
+        handler = logging.handlers.WatchedFileHandler(filename, encoding="utf-8")
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        _multiprocess_files.append(filename)
+        return handler
+    if rotation == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            filename,
+            when=os.getenv("LOG_ROTATE_WHEN", "midnight"),
+            backupCount=backup_count,
+            encoding="utf-8",
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            filename,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", "5000000")),
+            backupCount=backup_count,
+            encoding="utf-8",
+        )
+    # Старые куски лога сжимаются в .gz
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    handler.setLevel(level)
+    handler.setFormatter(formatter)
+    return handler
+
+
+def rotate_logs() -> list:
+    """
+    Ротация по размеру для режима нескольких процессов (LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT). Вызывается периодически только процессом-лидером.
+    """
+    max_bytes = int(os.getenv("LOG_MAX_BYTES", "5000000"))
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    rotated = []
+    for filename in _multiprocess_files:
+        if not os.path.exists(filename) or os.path.getsize(filename) < max_bytes:
+            continue
+        for i in range(backup_count - 1, 0, -1):
+            src = _gzip_namer(f"{filename}.{i}")
+            if os.path.exists(src):
+                os.replace(src, _gzip_namer(f"{filename}.{i + 1}"))
+        pending = f"{filename}.rotating"
+        os.replace(filename, pending)
+        _gzip_rotator(pending, _gzip_namer(f"{filename}.1"))
+        rotated.append(filename)
+    return rotated
+
+
+def setup_logging(json_lines: bool = None, info_sample_rate: float = None,
+                  multiprocess: bool = None):
+    """
+    Настраивает корневой логгер: записи кладутся в очередь, а файлы
+    пишутся в отдельном потоке QueueListener и не блокируют event loop.
+
+    - webhook.log — всё от INFO и выше (INFO можно сэмплировать);
+    - errors.log — только ERROR и выше;
+    - admin.log / broadcast.log — логгеры "admin" и "broadcast".
+
+    Параметры по умолчанию берутся из окружения: LOG_JSON, LOG_INFO_SAMPLE_RATE,
+    LOG_ROTATION (size|time), LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT.
+    При WORKERS > 1 файлы открываются в multiprocess-режиме (см. rotate_logs).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    if json_lines is None:
+        json_lines = os.getenv("LOG_JSON", "0") == "1"
+    if info_sample_rate is None:
+        info_sample_rate = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+    if multiprocess is None:
+        multiprocess = int(os.getenv("WORKERS", "1")) > 1
+
+    text_formatter = logging.Formatter(LOG_FORMAT)
+    formatter = JsonFormatter() if json_lines else text_formatter
+
+    admin_handler = _file_handler(ADMIN_LOG, logging.Formatter("%(asctime)s — %(message)s"),
+                                  multiprocess=multiprocess)
+    admin_handler.addFilter(logging.Filter(ADMIN_LOGGER))
+    broadcast_handler = _file_handler(BROADCAST_LOG, logging.Formatter("%(asctime)s %(message)s"),
+                                      multiprocess=multiprocess)
+    broadcast_handler.addFilter(logging.Filter(BROADCAST_LOGGER))
+    console = logging.StreamHandler()
+    console.setFormatter(text_formatter)
+
+    log_queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(
+        log_queue,
+        _file_handler(WEBHOOK_LOG, formatter, multiprocess=multiprocess),
+        _file_handler(ERRORS_LOG, formatter, level=logging.ERROR, multiprocess=multiprocess),
+        admin_handler,
+        broadcast_handler,
+        console,
+        respect_handler_level=True,
+    )
+
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(InfoSampler(info_sample_rate))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def log_queue_size() -> int:
+    """Сколько записей ждут фонового потока записи логов."""
+    return _listener.queue.qsize() if _listener is not None else 0
+
+
+def stop_logging():
+    """Дописывает всё, что осталось в очереди, и закрывает файлы."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
@@ -1,22 +1,30 @@
 # === Импорты стандартных библиотек ===
+import time
+IMPORT_STARTED = time.perf_counter()  # для отчёта о времени старта
+
 import os
 import asyncio
 import random
 import logging
-import sqlite3
 from datetime import datetime, timedelta
 from fastapi import FastAPI, Request, APIRouter, Response, Form, UploadFile, File
 import base64
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
+from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import json
+import hmac
+import html
+import sqlite3
 from pathlib import Path
 
 
 # === Импорты сторонних библиотек ===
-from dotenv import load_dotenv
+try:
+    from orjson import loads as json_loads  # быстрый разбор тел вебхуков, если установлен
+except ImportError:
+    from json import loads as json_loads
 import aiohttp
-import httpx
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.types import (
     Message, BotCommand,
@@ -26,178 +34,243 @@ from aiogram.types import (
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import StorageKey
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.utils.markdown import hbold
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
-from openai import AsyncOpenAI
-from crypto import create_invoice
-from openai import APITimeoutError
-import shutil
-from aiogram.types import ForceReply
-
-# === Настройка логирования ===
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("webhook.log", encoding="utf-8"),
-        logging.FileHandler("errors.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
+from crypto import INVOICE_TTL, get_invoice_url, make_cryptopay, reconcile_payments
+from aiogram.types import ForceReply, BufferedInputFile
+
+from backup import backup_manager_from_env
+from config import Config
+from db import Database
+from fsm_storage import SQLiteStorage
+from leader import LeaderLock
+from metrics import (
+    BotMetrics, UpdateMetricsMiddleware, HandlerMetricsMiddleware,
+    BotApiMetricsMiddleware, InstrumentedClient, CONTENT_TYPE as METRICS_CONTENT_TYPE
+)
+from profiling import SamplingProfiler, SlowUpdateLog, SlowUpdateMiddleware, LoopLagMonitor
+from tracing import tracer_from_env, span
+from recorder import Anonymizer, UpdateRecorder
+from log_setup import (
+    setup_logging, rotate_logs, log_queue_size, ADMIN_LOGGER, BROADCAST_LOGGER,
+    WEBHOOK_LOG, ERRORS_LOG, ADMIN_LOG, BROADCAST_LOG
 )
 
+admin_logger = logging.getLogger(ADMIN_LOGGER)
+broadcast_logger = logging.getLogger(BROADCAST_LOGGER)
 
-# === Загрузка переменных окружения ===
+# === Routers объявляем СРАЗУ после импортов и переменных ===
+router = APIRouter()
+crypto_router = APIRouter()
+site_router = APIRouter()
 
-load_dotenv()
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-DOMAIN_URL = os.getenv("DOMAIN_URL")
-ADMIN_ID = int(os.getenv("ADMIN_ID", "1082828397"))
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-text_client = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=60.0)
-image_client = AsyncOpenAI(api_key=OPENAI_API_KEY)  # Использовать один и тот же ключ!
+# === Реестр хендлеров aiogram ===
+class HandlerRegistry:
+    """
+    Запоминает хендлеры, объявленные декораторами на уровне модуля,
+    и подключает их к каждому новому Dispatcher в create_app().
+    Так модуль можно импортировать без создания бота, а в одном процессе
+    можно поднять сколько угодно независимых экземпляров.
+    """
 
-# === Инициализация базы данных ===
-conn = sqlite3.connect("users.db", check_same_thread=False)
-cursor = conn.cursor()
-FREE_USES_LIMIT = 10
+    def __init__(self):
+        self._entries = []
 
-# === Routers объявляем СРАЗУ после импортов и переменных ===
-router = APIRouter()
-crypto_router = APIRouter()
+    def _observer(self, name: str):
+        def register(*filters, **kwargs):
+            def decorator(callback):
+                self._entries.append((name, callback, filters, kwargs))
+                return callback
+            return decorator
+        return register
 
-def init_db():
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            usage_count INTEGER DEFAULT 0,
-            subscribed INTEGER DEFAULT 0,
-            subscription_expires TEXT,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            type TEXT,
-            prompt TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (ADMIN_ID,))
-    if not cursor.fetchone():
-        cursor.execute(
-            "INSERT INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) VALUES (?, 0, 1, NULL, ?)",
-            (ADMIN_ID, datetime.now().strftime("%Y-%m-%d"))
-        )
-    conn.commit()
-init_db()
+    @property
+    def message(self):
+        return self._observer("message")
+
+    @property
+    def callback_query(self):
+        return self._observer("callback_query")
+
+    def setup(self, dp: Dispatcher):
+        for name, callback, filters, kwargs in self._entries:
+            dp.observers[name].register(callback, *filters, **kwargs)
+
+handlers = HandlerRegistry()
 
 
 # === Middleware EnsureUser ===
 class EnsureUserMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
         if isinstance(event, types.Message) or isinstance(event, types.CallbackQuery):
-            user_id = event.from_user.id
-            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-            if not cursor.fetchone():
-                is_admin = int(user_id) == ADMIN_ID
-                cursor.execute(
-                    "INSERT INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) VALUES (?, 0, ?, NULL, ?)",
-                    (user_id, 1 if is_admin else 0, datetime.now().strftime("%Y-%m-%d"))
-                )
-                conn.commit()
+            data["db"].ensure_user(event.from_user.id)
         return await handler(event, data)
 
-session = AiohttpSession()
-bot = Bot(token=BOT_TOKEN, session=session)
-storage = MemoryStorage()
-dp = Dispatcher(bot=bot, storage=storage)
-dp.message.middleware(EnsureUserMiddleware())
-dp.callback_query.middleware(EnsureUserMiddleware())
-
-async def weekly_backup():
-    while True:
-        try:
-            now = datetime.now()
-            if now.weekday() == 0 and now.hour == 3:  # Понедельник, 03:00
-                backup_dir = data_dir / "backups"
-                backup_dir.mkdir(exist_ok=True)
-                users_backup = backup_dir / f"users_{now.strftime('%Y%m%d_%H%M')}.db"
-                payments_backup = backup_dir / f"payments_{now.strftime('%Y%m%d_%H%M')}.json"
-                shutil.copy("users.db", users_backup)
-                shutil.copy(payments_path, payments_backup)
-                logging.info(f"📦 Резервные копии созданы: {users_backup}, {payments_backup}")
-                await asyncio.sleep(3600)  # чтобы не делать backup несколько раз за утро
-            await asyncio.sleep(1800)  # Проверка дважды в час
-        except Exception as e:
-            logging.error(f"❌ Ошибка при резервном копировании: {e}", exc_info=True)
-
 
-# === Вспомогательные функции ===
+# === Экземпляр бота: все компоненты одного приложения ===
+class BotApp:
+    """
+    Всё состояние одного экземпляра: база, бот, диспетчер, клиенты, фоновые задачи.
+    Хендлеры aiogram получают его как ctx (и базу как db), эндпоинты FastAPI —
+    через request.app.state.ctx.
+    """
 
-def ensure_user(user_id: int):
-    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-    if not cursor.fetchone():
-        is_admin_user = int(user_id) == ADMIN_ID
-        cursor.execute(
-            "INSERT INTO users (user_id, usage_count, subscribed, subscription_expires, joined_at) VALUES (?, 0, ?, NULL, ?)",
-            (user_id, 1 if is_admin_user else 0, datetime.now().strftime("%Y-%m-%d")),
+    def __init__(self, config: Config, bot: Bot = None, text_client=None,
+                 image_client=None, cryptopay=None):
+        self.config = config
+        self.data_dir = Path(config.data_dir)
+        self.quotes_path = self.data_dir / "quotes.json"
+        self.images_path = self.data_dir / "images.json"
+        self.payments_path = self.data_dir / "payments.json"
+        self.logs_path = self.data_dir / "logs.json"
+
+        # Метрики экземпляра (/metrics); замеры делают middleware и обёртки ниже
+        self.metrics = BotMetrics()
+        # Апдейты дольше SLOW_UPDATE_MS с разбивкой времени (/slow) и профилировщик (/profiler)
+        self.slow_updates = SlowUpdateLog(threshold=config.slow_update_ms / 1000)
+        self.profiler = SamplingProfiler()
+        # Задержка цикла событий и стеки блокирующего кода (/lag)
+        self.loop_monitor = LoopLagMonitor(threshold=config.loop_lag_ms / 1000,
+                                           on_lag=self.metrics.observe_loop_lag)
+        # Спаны апдейтов: TRACE_SAMPLE_RATE, экспорт в data/traces.jsonl или OTLP (см. tracing.py)
+        self.tracer = tracer_from_env(str(self.data_dir / "traces.jsonl"))
+        # Запись апдейтов (RECORD_UPDATES) — только по явному включению
+        self.recorder = None
+        if config.record_updates:
+            path = config.record_updates
+            if config.workers > 1:
+                path = path.replace(".jsonl", f".{os.getpid()}.jsonl")  # свой файл у каждого процесса
+            self.recorder = UpdateRecorder(path, Anonymizer(config.admin_id, config.record_text, MENU_TEXTS))
+
+        # WAL + BEGIN IMMEDIATE: в базу безопасно пишут несколько процессов (см. db.py)
+        self.db = Database(config.db_path, config.admin_id)
+        self.db.on_query = self.metrics.observe_query
+        if bot is None:
+            api = TelegramAPIServer.from_base(config.telegram_api_url) if config.telegram_api_url else None
+            session = AiohttpSession(api=api) if api else AiohttpSession()
+            bot = Bot(token=config.bot_token, session=session)
+        self.bot = bot
+        self.bot.session.middleware(BotApiMetricsMiddleware(self.metrics))
+        # FSM-состояния хранятся в data/fsm.db и переживают перезапуск.
+        # Несколько процессов (WORKERS > 1) работают с базой напрямую, без кэша.
+        self.storage = SQLiteStorage(str(self.data_dir / "fsm.db"), shared=config.workers > 1)
+        self.dp = Dispatcher(bot=self.bot, storage=self.storage)
+        self.dp["db"] = self.db
+        self.dp["ctx"] = self
+        self.dp.update.outer_middleware(SlowUpdateMiddleware(self.slow_updates))
+        self.dp.update.outer_middleware(UpdateMetricsMiddleware(self.metrics))
+        self.dp.message.middleware(HandlerMetricsMiddleware(self.metrics, "message"))
+        self.dp.callback_query.middleware(HandlerMetricsMiddleware(self.metrics, "callback_query"))
+        self.dp.message.middleware(EnsureUserMiddleware())
+        self.dp.callback_query.middleware(EnsureUserMiddleware())
+        handlers.setup(self.dp)
+
+        # === Резервные копии (data/backups) ===
+        self.backups = backup_manager_from_env(
+            config.db_path, self.data_dir / "backups", extra_files=[self.payments_path]
         )
-        conn.commit()
-
-def activate_subscription(user_id: int):
-    expires = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
-    cursor.execute(
-        "UPDATE users SET subscribed = 1, subscription_expires = ? WHERE user_id = ?",
-        (expires, user_id)
-    )
-    conn.commit()
-
-def is_subscribed(user_id: int) -> bool:
-    if str(user_id) == str(ADMIN_ID):
-        return True
-    cursor.execute("SELECT subscribed, subscription_expires FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    if result:
-        subscribed, expires = result
-        if subscribed and expires:
-            return datetime.strptime(expires, "%Y-%m-%d") >= datetime.now()
-    return False
+        # При WORKERS > 1 фоновые задачи выполняет только процесс, захвативший data/leader.lock
+        self.leader = LeaderLock(str(self.data_dir / "leader.lock"))
+        self.background_tasks = set()
+
+        self._text_client = text_client and InstrumentedClient(text_client, self.metrics)
+        self._image_client = image_client and InstrumentedClient(image_client, self.metrics)
+        self._cryptopay = cryptopay
+
+        # Очереди: записи логов, несохранённые FSM-состояния, фоновые задачи
+        registry = self.metrics.registry
+        registry.gauge("log_queue_depth", "Записи логов, ожидающие записи на диск", collect=log_queue_size)
+        registry.gauge("fsm_dirty_records", "FSM-состояния, ожидающие сброса в базу",
+                       collect=lambda: len(self.storage._dirty))
+        registry.gauge("fsm_cached_records", "FSM-состояния в кэше", collect=lambda: len(self.storage._cache))
+        registry.gauge("background_tasks", "Запущенные фоновые задачи", collect=lambda: len(self.background_tasks))
+
+    # === OpenAI и CryptoBot: пакеты тяжёлые, поэтому импорт и клиенты — при первом запросе ===
+    @property
+    def text_client(self):
+        if self._text_client is None:
+            from openai import AsyncOpenAI
+            self._text_client = InstrumentedClient(
+                AsyncOpenAI(api_key=self.config.openai_api_key, base_url=self.config.openai_base_url,
+                            timeout=60.0), self.metrics
+            )
+        return self._text_client
+
+    @property
+    def image_client(self):
+        if self._image_client is None:
+            from openai import AsyncOpenAI
+            self._image_client = InstrumentedClient(
+                AsyncOpenAI(api_key=self.config.openai_api_key, base_url=self.config.openai_base_url),
+                self.metrics  # Использовать один и тот же ключ!
+            )
+        return self._image_client
+
+    @property
+    def cryptopay(self):
+        if self._cryptopay is None:
+            self._cryptopay = make_cryptopay(self.config.cryptopay_api_key)
+        return self._cryptopay
+
+    def prepare_data_files(self):
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        for path in [self.quotes_path, self.images_path, self.logs_path]:
+            if not path.exists():
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump([], f, ensure_ascii=False, indent=2)
+
+    def migrate_legacy_payments(self):
+        """Один раз переносит старый payments.json в таблицу payments."""
+        if self.db.get_meta("legacy_payments_imported") or not self.payments_path.exists():
+            return
+        with open(self.payments_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        rows = [
+            (int(p["invoice_id"]), int(p["user_id"]), p.get("amount"), "USDT", p.get("timestamp"))
+            for p in records if p.get("invoice_id") is not None and p.get("user_id") is not None
+        ]
+        imported = self.db.import_payments(rows) if rows else 0
+        self.db.set_meta("legacy_payments_imported", 1)
+        logging.info(f"📦 Перенесено оплат из payments.json: {imported}")
+
+    def start_background_task(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def start(self, timer=None):
+        self.loop_monitor.start()
+        # Всё, что трогает диск, выполняется при старте сервера, а не при импорте
+        self.prepare_data_files()
+        self.db.init_schema()
+        self.migrate_legacy_payments()
+        if timer:
+            timer.mark("база и файлы")
+        if self.leader.try_acquire():
+            await start_leader_jobs(self, timer)
+        else:
+            # Лидер уже есть; ждём своей очереди на случай его падения
+            self.start_background_task(self.leader.campaign(lambda: start_leader_jobs(self)))
+
+    async def stop(self):
+        self.loop_monitor.stop()
+        for task in list(self.background_tasks):
+            task.cancel()
+        self.leader.release()
+        await self.storage.close()
+        await self.bot.session.close()
+        self.db.close()
+        self.tracer.close()
+        if self.recorder is not None:
+            self.recorder.close()
 
-def get_usage_count(user_id: int) -> int:
-    cursor.execute("SELECT usage_count FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else 0
 
-def increment_usage(user_id: int):
-    if str(user_id) == str(ADMIN_ID):
-        return
-    cursor.execute("UPDATE users SET usage_count = usage_count + 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
-
-def is_limited(user_id: int) -> bool:
-    if str(user_id) == str(ADMIN_ID):
-        return False
-    return not is_subscribed(user_id) and get_usage_count(user_id) >= FREE_USES_LIMIT
-
-def is_admin(user_id: int) -> bool:
-    return int(user_id) == ADMIN_ID
-
-# === JSON-логика, автофайлы и т.д. ===
-data_dir = Path("data")
-data_dir.mkdir(exist_ok=True)
-quotes_path = data_dir / "quotes.json"
-images_path = data_dir / "images.json"
-payments_path = data_dir / "payments.json"
-logs_path = data_dir / "logs.json"
-for path in [quotes_path, images_path, payments_path, logs_path]:
-    if not path.exists():
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+# === Вспомогательные функции ===
 
 def append_json(path, record):
     try:
@@ -209,76 +282,94 @@ def append_json(path, record):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
-def save_image_record(prompt, url):
-    append_json(images_path, {
+def save_image_record(ctx: BotApp, prompt, url):
+    append_json(ctx.images_path, {
         "prompt": prompt,
         "url": url,
         "created_at": datetime.now().isoformat()
     })
 
-def log_user_action(user_id, action, details):
-    append_json(logs_path, {
+def log_user_action(ctx: BotApp, user_id, action, details):
+    append_json(ctx.logs_path, {
         "user_id": user_id,
         "action": action,
         "details": details,
         "timestamp": datetime.now().isoformat()
     })
 
-def save_payment(user_id, invoice_id, amount):
-    append_json(payments_path, {
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "amount": amount,
-        "timestamp": datetime.now().isoformat()
-    })
+async def notify_payment(ctx: BotApp, user_id, invoice_id, amount, asset, source="вебхук"):
+    try:
+        await ctx.bot.send_message(user_id, "🎉 Оплата получена, подписка активирована на 30 дней! Спасибо.")
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось уведомить {user_id} об активации: {e}")
+    text = (
+        f"💸 <b>Поступила новая оплата!</b>\n"
+        f"🧑‍💻 User ID: <code>{user_id}</code>\n"
+        f"💰 Сумма: {amount} {asset}\n"
+        f"🧾 Invoice: <code>{invoice_id}</code> ({source})\n\n"
+        f"✅ Подписка активирована автоматически."
+    )
+    await ctx.bot.send_message(ctx.config.admin_id, text, parse_mode="HTML")
 
 
 # === Endpoint для Telegram Webhook ===
 @router.post("/webhook", response_class=JSONResponse)
 async def telegram_webhook(request: Request):
-    try:
-        data = await request.json()
-        update = types.Update(**data)
-        await dp.feed_update(bot, update)
-    except Exception as e:
-        logging.exception("Ошибка обработки апдейта")
+    ctx: BotApp = request.app.state.ctx
+    with ctx.tracer.trace("telegram.webhook") as root:
+        try:
+            data = json_loads(await request.body())
+            if ctx.recorder is not None:
+                ctx.recorder.record(data)
+            # Сразу привязываем апдейт к bot: иначе feed_update пересобирает его повторно
+            update = types.Update.model_validate(data, context={"bot": ctx.bot})
+            root.set(update_id=update.update_id, event=update.event_type)
+            with span("dispatcher.feed_update"):
+                await ctx.dp.feed_update(ctx.bot, update)
+        except Exception as e:
+            logging.exception("Ошибка обработки апдейта")
     return JSONResponse(content={"ok": True}, media_type="application/json")
 
 # === Endpoint для CryptoBot Webhook ===
 @crypto_router.post("/cryptobot", response_class=JSONResponse)
 async def cryptobot_webhook(request: Request):
     """
-    Вебхук для CryptoBot.
-    Автоматически уведомляет админа и присылает кнопку для активации подписки.
+    Вебхук для CryptoBot (invoice_paid).
+    Подпись проверяется до разбора тела, оплата и подписка пишутся одной
+    транзакцией, повторные доставки того же инвойса игнорируются.
     """
+    ctx: BotApp = request.app.state.ctx
+    raw = await request.body()
+    signature = request.headers.get("Crypto-Pay-Api-Signature", "")
     try:
-        data = await request.json()
-        logging.info(f"🔔 Webhook от CryptoBot: {data}")
-
-        if data.get("status") == "paid":
-            user_id = int(data.get("payload"))
-            amount = data.get("amount")
-            invoice_id = data.get("invoice_id")
-            # Сохраняем платеж в payments.json
-            save_payment(user_id, invoice_id, amount)
-            # Инлайн-кнопка для активации
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(
-                        text="✅ Активировать",
-                        callback_data=f"activate_user_{user_id}"
-                    )]
-                ]
-            )
-            text = (
-                f"💸 <b>Поступила новая оплата!</b>\n"
-                f"🧑‍💻 User ID: <code>{user_id}</code>\n"
-                f"💰 Сумма: {amount} USDT\n"
-                f"🧾 Invoice: <code>{invoice_id}</code>\n\n"
-                f"⚡ Для активации подпишки нажми кнопку ниже."
-            )
-            await bot.send_message(ADMIN_ID, text, parse_mode="HTML", reply_markup=keyboard)
-            logging.info(f"🟢 Админ уведомлён о платеже от {user_id} ({amount})")
+        # Подписанное тело CryptoBot — всегда UTF-8 JSON; остальное отклоняем сразу
+        body = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        body = None
+    if body is None or not ctx.cryptopay.check_signature(body_text=body, crypto_pay_signature=signature):
+        logging.warning("🚫 Вебхук CryptoBot с неверной подписью отклонён")
+        return JSONResponse(content={"status": "invalid signature"}, status_code=401)
+
+    try:
+        data = json_loads(body)
+        if data.get("update_type") != "invoice_paid":
+            return JSONResponse(content={"status": "ok"}, media_type="application/json")
+        invoice = data["payload"]
+        user_id = int(invoice["payload"])
+        invoice_id = int(invoice["invoice_id"])
+        amount = invoice.get("paid_amount") or invoice.get("amount")
+        asset = invoice.get("paid_asset") or invoice.get("asset")
+
+        if not ctx.db.record_payment(invoice_id, user_id, amount, asset, invoice.get("paid_at")):
+            logging.info(f"🔁 Инвойс {invoice_id} уже учтён, повторная доставка")
+            return JSONResponse(content={"status": "ok"}, media_type="application/json")
+        logging.info(f"🟢 Оплата {invoice_id} от {user_id} ({amount} {asset}), подписка активирована")
+
+        await notify_payment(ctx, user_id, invoice_id, amount, asset)
+    except sqlite3.Error as e:
+        # Оплата не сохранена — отвечаем ошибкой, чтобы CryptoBot повторил доставку
+        logging.error(f"❌ Оплата не записана в базу: {e}", exc_info=True)
+        return JSONResponse(content={"status": "retry"}, status_code=500)
     except Exception as e:
         logging.error(f"❌ Ошибка Webhook CryptoBot: {e}", exc_info=True)
     return JSONResponse(content={"status": "ok"}, media_type="application/json")
@@ -286,45 +377,117 @@ async def cryptobot_webhook(request: Request):
 # === Остальные функции и endpoint'ы ===
 # ... manual_activate, admin-панель, генерация изображений и т.д. ...
 
+# === Фоновые задачи процесса-лидера ===
+async def log_rotation_loop():
+    while True:
+        try:
+            await asyncio.to_thread(rotate_logs)
+        except Exception as e:
+            logging.error(f"❌ Ошибка ротации логов: {e}", exc_info=True)
+        await asyncio.sleep(60)
+
+async def payment_reconcile_loop(ctx: BotApp):
+    """Раз в reconcile_interval сверяет оплаты с CryptoBot: ловит потерянные вебхуки."""
+    while True:
+        try:
+            applied = await reconcile_payments(ctx.cryptopay, ctx.db)
+            if applied:
+                logging.warning(f"🧾 Сверка нашла оплаты без вебхука: {len(applied)}")
+            for invoice_id, user_id, amount, asset, _ in applied:
+                await notify_payment(ctx, user_id, invoice_id, amount, asset, source="сверка")
+        except Exception as e:
+            logging.error(f"❌ Ошибка сверки оплат: {e}", exc_info=True)
+        await asyncio.sleep(ctx.config.reconcile_interval)
+
+async def fsm_purge_loop(ctx: BotApp):
+    """В shared-режиме у хранилища нет цикла сброса: устаревшие FSM-состояния чистит лидер."""
+    while True:
+        try:
+            purged = ctx.storage.purge_expired()
+            if purged:
+                logging.info(f"🧹 Удалено устаревших FSM-состояний: {purged}")
+        except Exception as e:
+            logging.error(f"❌ Ошибка очистки FSM-состояний: {e}", exc_info=True)
+        await asyncio.sleep(3600)
+
+BOT_COMMANDS = [
+    BotCommand(command="start", description="🚀 Запуск бота"),
+    BotCommand(command="buy", description="💰 Купить подписку"),
+    BotCommand(command="profile", description="👤 Ваш профиль"),
+    BotCommand(command="help", description="📚 Как пользоваться?"),
+    BotCommand(command="admin", description="⚙️ Админка")
+]
+
+async def register_webhook(ctx: BotApp):
+    """
+    Регистрирует webhook и команды, только если они отличаются от текущих.
+    Накопившиеся за время деплоя апдейты не сбрасываются.
+    """
+    bot = ctx.bot
+    expected_url = f"{ctx.config.domain_url}/webhook"
+    info, commands = await asyncio.gather(bot.get_webhook_info(), bot.get_my_commands())
+    if info.url != expected_url:
+        await bot.set_webhook(expected_url, drop_pending_updates=False)
+        logging.info(f"✅ Установлен webhook: {expected_url}")
+    else:
+        logging.info(f"✅ Webhook уже установлен, ожидают обработки: {info.pending_update_count}")
+    current = [(c.command, c.description) for c in commands]
+    if current != [(c.command, c.description) for c in BOT_COMMANDS]:
+        await bot.set_my_commands(BOT_COMMANDS)
+        logging.info("✅ Команды бота обновлены")
+
+async def start_leader_jobs(ctx: BotApp, timer=None):
+    if ctx.config.domain_url:
+        try:
+            await register_webhook(ctx)
+        except Exception as e:
+            logging.error(f"❌ Ошибка регистрации webhook: {e}", exc_info=True)
+    if timer:
+        timer.mark("webhook и команды")
+    ctx.start_background_task(check_subscription_reminders(ctx))
+    ctx.start_background_task(ctx.backups.run_forever())
+    ctx.start_background_task(log_rotation_loop())
+    if ctx.config.cryptopay_api_key and ctx.config.reconcile_interval > 0:
+        ctx.start_background_task(payment_reconcile_loop(ctx))
+    if ctx.storage.shared:
+        ctx.start_background_task(fsm_purge_loop(ctx))
+    logging.info("⏰ Задачи напоминаний о подписках и резервного копирования запущены.")
+
+# === Замер времени старта ===
+class StartupTimer:
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self._last = started_at
+        self.phases = []
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def report(self):
+        total = self._last - self.started_at
+        parts = ", ".join(f"{name}: {seconds * 1000:.0f} мс" for name, seconds in self.phases)
+        logging.info(f"🚀 Старт за {total * 1000:.0f} мс ({parts})")
+
 # === Lifespan ===
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global reminder_task_started
-    expected_url = f"{DOMAIN_URL}/webhook"
-    await bot.delete_webhook(drop_pending_updates=True)
-    await bot.set_webhook(expected_url)
-    logging.info(f"✅ Установлен webhook: {expected_url}")
-    await bot.set_my_commands([
-        BotCommand(command="start", description="🚀 Запуск бота"),
-        BotCommand(command="buy", description="💰 Купить подписку"),
-        BotCommand(command="profile", description="👤 Ваш профиль"),
-        BotCommand(command="help", description="📚 Как пользоваться?"),
-        BotCommand(command="admin", description="⚙️ Админка")
-    ])
-    # 🛡️ Запускаем только один раз
-    if not reminder_task_started:
-        asyncio.create_task(check_subscription_reminders())
-        reminder_task_started = True
-        logging.info("⏰ Задача напоминаний о подписках запущена.")
+    ctx: BotApp = app.state.ctx
+    setup_logging()
+    await ctx.start(app.state.startup_timer)
+    app.state.startup_timer.report()
     yield
-    await session.close()
-
-# === Очистка логов ===
-for log_file in ["webhook.log", "errors.log"]:
-    if os.path.exists(log_file) and os.path.getsize(log_file) > 5_000_000:
-        with open(log_file, "w", encoding="utf-8") as f:
-            f.write(f"⚠️ Автоочистка лога {log_file}: {datetime.now()}\n")
-
-reminder_task_started = False  # глобальный флаг вне lifespan
+    await ctx.stop()
 
 # === Фоновая задача — напоминания о подписках ===
-async def check_subscription_reminders():
+async def check_subscription_reminders(ctx: BotApp):
+    db, bot = ctx.db, ctx.bot
     while True:
         try:
             print("🔔 Проверка напоминаний о подписках...")
             tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-            cursor.execute("SELECT user_id FROM users WHERE subscribed = 1 AND subscription_expires = ?", (tomorrow,))
-            users = cursor.fetchall()
+            users = db.fetchall("SELECT user_id FROM users WHERE subscribed = 1 AND subscription_expires = ?", (tomorrow,))
             for user_id_tuple in users:
                 user_id = user_id_tuple[0]
                 try:
@@ -338,18 +501,11 @@ async def check_subscription_reminders():
                     logging.warning(f"❌ Не удалось отправить сообщение {user_id}: {e}")
 
             # Новая часть: уведомление о завершении подписки сегодня
+            # (подписки снимаются одной транзакцией, до отправки сообщений)
             today = datetime.now().strftime("%Y-%m-%d")
-            cursor.execute("SELECT user_id FROM users WHERE subscribed = 1 AND subscription_expires = ?", (today,))
-            users_expired = cursor.fetchall()
-            for user_id_tuple in users_expired:
-                user_id = user_id_tuple[0]
+            users_expired = db.expire_subscriptions(today)
+            for user_id in users_expired:
                 try:
-                    # Снять подписку
-                    cursor.execute(
-                        "UPDATE users SET subscribed = 0, subscription_expires = NULL WHERE user_id = ?",
-                        (user_id,)
-                    )
-                    conn.commit()
                     await bot.send_message(
                         user_id,
                         "🔴 <b>Ваша подписка завершилась сегодня.</b>\nДля продолжения оформления — оплатите повторно.",
@@ -363,38 +519,53 @@ async def check_subscription_reminders():
             logging.error(f"❌ Ошибка при проверке подписок: {e}", exc_info=True)
         await asyncio.sleep(3600)  # Проверка раз в час
 
-# === И только теперь создаём app и регистрируем роутеры! ===
-app = FastAPI(lifespan=lifespan)
-app.include_router(router)
-app.include_router(crypto_router)
-
-@app.get("/")
+@site_router.get("/")
 async def root():
     return {"status": "ok"}
 
+# === Метрики Prometheus ===
+def check_metrics_token(request: Request, required: bool = False) -> bool:
+    """
+    METRICS_TOKEN в .env закрывает служебные эндпоинты: Bearer-заголовок или ?token=.
+    required=True — без заданного токена эндпоинт недоступен вовсе.
+    """
+    token = request.app.state.ctx.config.metrics_token
+    if not token:
+        return not required
+    header = request.headers.get("authorization", "")
+    query = request.query_params.get("token", "")
+    # Сравнение за постоянное время, чтобы токен нельзя было подобрать по таймингу
+    return (hmac.compare_digest(header.encode(), f"Bearer {token}".encode())
+            or hmac.compare_digest(query.encode(), token.encode()))
+
+@site_router.get("/metrics")
+async def metrics_endpoint(request: Request):
+    if not check_metrics_token(request):
+        return PlainTextResponse("forbidden", status_code=403)
+    return PlainTextResponse(request.app.state.ctx.metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+# === Профилирование (только с METRICS_TOKEN) ===
+@site_router.get("/debug/profile")
+async def profile_endpoint(request: Request, seconds: float = 10):
+    if not check_metrics_token(request, required=True):
+        return PlainTextResponse("forbidden", status_code=403)
+    try:
+        collapsed = await request.app.state.ctx.profiler.profile(seconds)
+    except RuntimeError as e:
+        return PlainTextResponse(str(e), status_code=409)
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@site_router.get("/debug/slow-updates")
+async def slow_updates_endpoint(request: Request):
+    if not check_metrics_token(request, required=True):
+        return PlainTextResponse("forbidden", status_code=403)
+    return JSONResponse(request.app.state.ctx.slow_updates.dump())
+
 # Не делай asyncio.create_task вне lifespan!
 # Все фоновые задачи лучше запускать через lifespan!
 
 
-# === Сайты ==== 
-
-from fastapi.middleware.cors import CORSMiddleware
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "https://itm-code.ru",
-        "https://itm-code.ru/geminiapp",
-        "https://www.itm-code.ru",
-        "http://localhost:3000",
-        "http://localhost"
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
 # === Состояния ===
 class GenStates(StatesGroup):
     await_text = State()
@@ -418,9 +589,14 @@ def main_menu() -> ReplyKeyboardMarkup:
         ],
         resize_keyboard=True
     )
+# Тексты кнопок и команд бота: при записи апдейтов не хешируются (см. recorder.py)
+MENU_TEXTS = [button.text for row in main_menu().keyboard for button in row] + [
+    "💰 Купить подписку", "⚙️ Админка", "админ", "Админ", "admin", "Admin"
+]
+
 # === Создать изображения в боте === 
 
-@dp.message(F.text.in_(["🎨 Создать изображение"]))
+@handlers.message(F.text.in_(["🎨 Создать изображение"]))
 async def handle_image_prompt(message: Message, state: FSMContext):
     await state.clear()
     control_buttons = InlineKeyboardMarkup(inline_keyboard=[
@@ -430,24 +606,25 @@ async def handle_image_prompt(message: Message, state: FSMContext):
     await state.set_state(GenStates.await_image)
     await message.answer("🖼 Введите промпт для изображения (или /cancel для отмены):", reply_markup=control_buttons)
 
-@dp.message(GenStates.await_image)
-async def generate_dalle_image(message: Message, state: FSMContext):
+@handlers.message(GenStates.await_image)
+async def generate_dalle_image(message: Message, state: FSMContext, db: Database, ctx: BotApp):
     user_id = message.from_user.id
     prompt = message.text.strip()
-    ensure_user(user_id)
+    db.ensure_user(user_id)
 
     if not prompt or len(prompt) < 3:
         await message.answer("❌ Введите осмысленный запрос для генерации.")
         return
 
-    if str(user_id) != str(ADMIN_ID) and is_limited(user_id):
+    if db.is_limited(user_id):
         await message.answer("🔐 Лимит исчерпан. Купите подписку 💰")
         return
 
     await message.answer("🎨 Генерирую изображение...")
 
+    from openai import APITimeoutError  # openai уже загружен клиентом или загрузится здесь
     try:
-        dalle = await image_client.images.generate(
+        dalle = await ctx.image_client.images.generate(
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
@@ -461,15 +638,9 @@ async def generate_dalle_image(message: Message, state: FSMContext):
             return
 
         await message.answer_photo(image_url, caption=f"🖼 Ваш запрос: {prompt}")
-        save_image_record(prompt, image_url)
+        save_image_record(ctx, prompt, image_url)
 
-        if str(user_id) != str(ADMIN_ID):
-            increment_usage(user_id)
-            cursor.execute(
-                "INSERT INTO history (user_id, type, prompt) VALUES (?, ?, ?)",
-                (user_id, "image", prompt)
-            )
-            conn.commit()
+        db.record_usage(user_id, "image", prompt)
     except APITimeoutError:
         await message.answer("⏳ OpenAI долго думает или перегружен. Попробуйте снова через минуту!")
     except Exception as e:
@@ -505,14 +676,14 @@ def gemini_keyboard() -> InlineKeyboardMarkup:
 
 # === Обработчик выхода из Gemini ===
 
-@dp.callback_query(F.data == "back_to_menu")
+@handlers.callback_query(F.data == "back_to_menu")
 async def back_to_main_menu(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await state.clear()
     await callback.message.answer("🔙 Возвращаюсь в главное меню.", reply_markup=main_menu())
     await callback.answer()
 
-@dp.message(Command("stop"))
+@handlers.message(Command("stop"))
 async def stop_command(message: Message, state: FSMContext):
     await state.clear()
     await state.clear()
@@ -520,7 +691,7 @@ async def stop_command(message: Message, state: FSMContext):
     
     # === Остальная логика перенесена в следующую часть ===
 
-@dp.message(F.text == "🌐 Генерация на сайте")
+@handlers.message(F.text == "🌐 Генерация на сайте")
 async def open_site(message: types.Message):
     await message.answer(
         "Открой наш AI генератор прямо в Telegram! Нажми на кнопку ниже и запускай Mini App:",
@@ -534,14 +705,14 @@ async def open_site(message: types.Message):
         )
     )
 
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
+@handlers.message(Command("start"))
+async def cmd_start(message: Message, db: Database):
     user_id = message.from_user.id
-    ensure_user(user_id)
+    db.ensure_user(user_id)
     await message.answer("👋 Добро пожаловать! Выберите действие из меню:", reply_markup=main_menu())
 
-@dp.message(Command("help"))
-@dp.message(F.text == "📚 Как пользоваться?")
+@handlers.message(Command("help"))
+@handlers.message(F.text == "📚 Как пользоваться?")
 async def how_to_use(message: Message):
     text = (
         "📚 <b>Инструкция:</b>\n\n"
@@ -554,19 +725,18 @@ async def how_to_use(message: Message):
     await message.answer(text, parse_mode="HTML")
 
 # === Профиль пользователя ===
-@dp.message(Command("profile"))
-@dp.message(F.text == "👤 Профиль")
-async def cmd_profile(message: Message):
+@handlers.message(Command("profile"))
+@handlers.message(F.text == "👤 Профиль")
+async def cmd_profile(message: Message, db: Database):
     user_id = message.from_user.id
-    ensure_user(user_id)
-    cursor.execute("SELECT usage_count, subscribed, subscription_expires FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
+    db.ensure_user(user_id)
+    row = db.fetchone("SELECT usage_count, subscribed, subscription_expires FROM users WHERE user_id = ?", (user_id,))
     if not row:
         await message.answer("⚠️ Не удалось загрузить данные профиля.")
         return
     usage_count, subscribed, expires = row
 
-    if str(user_id) == str(ADMIN_ID):
+    if db.is_admin(user_id):
         sub_status = "🟢 Администратор — доступ всегда активен"
     elif subscribed and expires:
         expires_date = datetime.strptime(expires, "%Y-%m-%d").strftime("%d.%m.%Y")
@@ -581,8 +751,7 @@ async def cmd_profile(message: Message):
     )
     await message.answer(profile_text)
 
-    cursor.execute("SELECT type, prompt, created_at FROM history WHERE user_id = ? ORDER BY created_at DESC LIMIT 10", (user_id,))
-    rows = cursor.fetchall()
+    rows = db.fetchall("SELECT type, prompt, created_at FROM history WHERE user_id = ? ORDER BY created_at DESC LIMIT 10", (user_id,))
     if not rows:
         await message.answer("📜 История пуста")
     else:
@@ -604,19 +773,25 @@ class AdminStates(StatesGroup):
     awaiting_user_id = State()
 
 def log_admin_action(user_id: int, action: str):
-    with open("admin.log", "a", encoding="utf-8") as f:
-        f.write(f"{datetime.now().isoformat()} — ADMIN [{user_id}]: {action}\n")
-
-def is_admin(user_id: int) -> bool:
-    return str(user_id) == str(ADMIN_ID)
-
-# Сохраняем последние id сообщений с карточками для удаления при смене страницы
-admin_last_card_msgs = {}
+    admin_logger.info(f"ADMIN [{user_id}]: {action}")
+
+# id последних карточек пользователей храним в FSM-хранилище под отдельным destiny,
+# чтобы state.clear() их не стирал, а после перезапуска их всё ещё можно было удалить
+ADMIN_CARDS_DESTINY = "admin_cards"
+
+def admin_cards_key(state: FSMContext) -> StorageKey:
+    return StorageKey(
+        bot_id=state.key.bot_id,
+        chat_id=state.key.chat_id,
+        user_id=state.key.user_id,
+        thread_id=state.key.thread_id,
+        destiny=ADMIN_CARDS_DESTINY,
+    )
 
-@dp.message(Command("admin"))
-async def admin_panel(message: types.Message, state: FSMContext):
+@handlers.message(Command("admin"))
+async def admin_panel(message: types.Message, state: FSMContext, db: Database):
     user_id = message.from_user.id
-    if not is_admin(user_id):
+    if not db.is_admin(user_id):
         await message.answer("❌ Доступ запрещён")
         return
 
@@ -625,25 +800,8 @@ async def admin_panel(message: types.Message, state: FSMContext):
     log_admin_action(user_id, "Открыл админку /admin")
     logging.info(f"🕤 Запрос на админку от: {user_id}")
 
-    today = datetime.now().date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    year_ago = today - timedelta(days=365)
-
-    def count_since(date):
-        cursor.execute("SELECT COUNT(*) FROM users WHERE joined_at >= ?", (date.strftime("%Y-%m-%d"),))
-        return cursor.fetchone()[0]
-
-    stats = {
-        "Всего": count_since(datetime(1970, 1, 1)),
-        "Сегодня": count_since(today),
-        "Неделя": count_since(week_ago),
-        "Месяц": count_since(month_ago),
-        "Год": count_since(year_ago)
-    }
-
-    cursor.execute("SELECT COUNT(*) FROM users WHERE subscribed = 1")
-    total_subs = cursor.fetchone()[0]
+    stats = db.signup_stats(datetime.now().date())
+    total_subs = db.count_subscribers()
 
     text = f"📊 <b>Админка:</b>\n<b>Подписок активно:</b> {total_subs}\n\n"
     text += "\n".join([f"<b>{k}:</b> {v}" for k, v in stats.items()])
@@ -692,9 +850,9 @@ async def send_log_file(message: Message, filename: str):
         logging.exception(f"Ошибка при отправке {filename}")
         await message.answer(f"❌ Ошибка при чтении {filename}: {e}")
 
-@dp.callback_query(F.data.startswith("user_list"))
-async def admin_show_user_list(callback: types.CallbackQuery, state: FSMContext):
-    if not is_admin(callback.from_user.id):
+@handlers.callback_query(F.data.startswith("user_list"))
+async def admin_show_user_list(callback: types.CallbackQuery, state: FSMContext, db: Database):
+    if not db.is_admin(callback.from_user.id):
         await callback.message.answer("❌ Доступ запрещён")
         return
 
@@ -705,28 +863,28 @@ async def admin_show_user_list(callback: types.CallbackQuery, state: FSMContext)
     offset = (page - 1) * per_page
 
     # 1. Удаляем старые карточки, если были
-    old_msgs = admin_last_card_msgs.get(callback.from_user.id, [])
+    cards_key = admin_cards_key(state)
+    old_msgs = (await state.storage.get_data(cards_key)).get("msg_ids", [])
     for msg_id in old_msgs:
         try:
             await callback.bot.delete_message(callback.message.chat.id, msg_id)
         except Exception:
             pass  # иногда сообщения уже удалены
-    admin_last_card_msgs[callback.from_user.id] = []
+    await state.storage.set_data(cards_key, {})
 
     # SQL фильтр
 # 2. Фильтруем юзеров
     if filter_type == "no_sub":
-        cursor.execute(
+        users = db.fetchall(
             "SELECT user_id, usage_count, subscribed, subscription_expires FROM users WHERE subscribed = 0 ORDER BY joined_at DESC LIMIT ? OFFSET ?",
             (per_page, offset)
         )
     else:
-        cursor.execute(
+        users = db.fetchall(
             "SELECT user_id, usage_count, subscribed, subscription_expires FROM users ORDER BY joined_at DESC LIMIT ? OFFSET ?",
             (per_page, offset)
         )
 
-    users = cursor.fetchall()
     if not users:
         await callback.message.edit_text(f"Пользователей не найдено на этой странице (страница {page}).", reply_markup=None)
         await callback.answer()
@@ -764,23 +922,22 @@ async def admin_show_user_list(callback: types.CallbackQuery, state: FSMContext)
         msg_ids.append(m.message_id)
         await asyncio.sleep(0.07)
     # Сохраняем id карточек для автоудаления при перелистывании
-    admin_last_card_msgs[callback.from_user.id] = msg_ids
+    await state.storage.set_data(cards_key, {"msg_ids": msg_ids})
 
 
 # Поиск по ID
-@dp.callback_query(F.data == "find_user_id")
+@handlers.callback_query(F.data == "find_user_id")
 async def start_find_user_id(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.awaiting_user_id)
     await callback.message.answer("Введите ID пользователя для поиска:", reply_markup=ForceReply())
     await callback.answer()
 
-@dp.message(AdminStates.awaiting_user_id)
-async def process_find_user_id(message: types.Message, state: FSMContext):
+@handlers.message(AdminStates.awaiting_user_id)
+async def process_find_user_id(message: types.Message, state: FSMContext, db: Database):
     await state.clear()
     try:
         user_id = int(message.text.strip())
-        cursor.execute("SELECT user_id, usage_count, subscribed, subscription_expires FROM users WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
+        row = db.fetchone("SELECT user_id, usage_count, subscribed, subscription_expires FROM users WHERE user_id = ?", (user_id,))
         if not row:
             await message.answer("Пользователь не найден.")
             return
@@ -799,48 +956,144 @@ async def process_find_user_id(message: types.Message, state: FSMContext):
         await message.answer(f"❌ Ошибка поиска: {e}")
 
 # === Команды логов ===
-@dp.message(Command("logs"))
-async def show_logs(message: Message):
-    if not is_admin(message.from_user.id):
+@handlers.message(Command("logs"))
+async def show_logs(message: Message, db: Database):
+    if not db.is_admin(message.from_user.id):
         await message.answer("❌ Доступ запрещён")
         return
     log_admin_action(message.from_user.id, "Просмотрел /logs")
-    await send_log_file(message, "webhook.log")
+    await send_log_file(message, WEBHOOK_LOG)
 
-@dp.message(Command("errors"))
-async def show_errors(message: Message):
-    if not is_admin(message.from_user.id):
+@handlers.message(Command("errors"))
+async def show_errors(message: Message, db: Database):
+    if not db.is_admin(message.from_user.id):
         await message.answer("❌ Доступ запрещён")
         return
     log_admin_action(message.from_user.id, "Просмотрел /errors")
-    await send_log_file(message, "errors.log")
+    await send_log_file(message, ERRORS_LOG)
+
+# === Резервные копии ===
+@handlers.message(Command("backup"))
+async def cmd_backup(message: Message, db: Database, ctx: BotApp):
+    if not db.is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+    log_admin_action(message.from_user.id, "Запустил /backup")
+    await message.answer("📦 Создаю резервную копию...")
+    try:
+        created = await ctx.backups.create()
+    except Exception as e:
+        logging.error(f"❌ Ошибка при резервном копировании: {e}", exc_info=True)
+        await message.answer(f"❌ Ошибка резервного копирования: {e}")
+        return
+    lines = [f"• <code>{p.name}</code> — {p.stat().st_size // 1024} КБ ✅" for p in created]
+    await message.answer("✅ Резервная копия создана и проверена:\n" + "\n".join(lines), parse_mode="HTML")
+
+@handlers.message(Command("backups"))
+async def cmd_list_backups(message: Message, db: Database, ctx: BotApp):
+    if not db.is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+    artifacts = ctx.backups.list()
+    if not artifacts:
+        await message.answer("📭 Резервных копий пока нет. Создать: /backup")
+        return
+    lines = [
+        f"• <code>{p.name}</code> — {p.stat().st_size // 1024} КБ, "
+        f"{datetime.fromtimestamp(p.stat().st_mtime).strftime('%d.%m.%Y %H:%M')}"
+        for p in artifacts[:20]
+    ]
+    await message.answer("🗄 <b>Резервные копии:</b>\n" + "\n".join(lines), parse_mode="HTML")
+
+# === Профилирование ===
+@handlers.message(Command("profiler"))
+async def cmd_profiler(message: Message, db: Database, ctx: BotApp):
+    if not db.is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+    parts = message.text.split()
+    seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+    log_admin_action(message.from_user.id, f"Запустил /profiler на {seconds} с")
+    await message.answer(f"🔬 Снимаю профиль {seconds} с...")
+    try:
+        collapsed = await ctx.profiler.profile(seconds)
+    except RuntimeError as e:
+        await message.answer(f"⏳ {e}")
+        return
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    await message.answer_document(
+        BufferedInputFile(collapsed.encode("utf-8"), filename=filename),
+        caption="🔥 Collapsed stacks: откройте в speedscope.app или flamegraph.pl"
+    )
+
+@handlers.message(Command("slow"))
+async def cmd_slow_updates(message: Message, db: Database, ctx: BotApp):
+    if not db.is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+    records = ctx.slow_updates.dump()
+    if not records:
+        await message.answer(f"✅ Апдейтов дольше {ctx.config.slow_update_ms} мс не было.")
+        return
+    lines = []
+    for r in records[-10:]:
+        top = ", ".join(f"{name} {p['ms']:.0f}" for name, p in list(r["phases"].items())[:3])
+        lines.append(f"• {r['at'][11:]} <code>{r['handler']}</code> — {r['total_ms']:.0f} мс ({top or 'без внешних вызовов'})")
+    await message.answer(
+        f"🐢 <b>Медленные апдейты</b> (всего {len(records)}):\n" + "\n".join(lines), parse_mode="HTML"
+    )
+    dump = json.dumps(records, ensure_ascii=False, indent=2).encode("utf-8")
+    await message.answer_document(BufferedInputFile(dump, filename="slow_updates.json"))
+
+@handlers.message(Command("lag"))
+async def cmd_loop_lag(message: Message, db: Database, ctx: BotApp):
+    if not db.is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещён")
+        return
+    monitor = ctx.loop_monitor
+    text = (
+        f"⏱ <b>Цикл событий</b>\n"
+        f"Блокировок дольше {ctx.config.loop_lag_ms} мс: {monitor.stalls}\n"
+        f"Максимальная задержка: {monitor.max_lag * 1000:.0f} мс"
+    )
+    worst = monitor.worst()
+    if worst:
+        text += "\n\n<b>Главные виновники:</b>\n" + "\n".join(
+            f"• <code>{html.escape(key)}</code> — {e['count']}×, всего {e['total'] * 1000:.0f} мс, "
+            f"макс. {e['max'] * 1000:.0f} мс"
+            for key, e in worst
+        )
+    await message.answer(text, parse_mode="HTML")
+    stacks = "\n\n".join(f"# {key}\n{e['stack']}" for key, e in worst if e["stack"])
+    if stacks:
+        await message.answer_document(BufferedInputFile(stacks.encode("utf-8"), filename="loop_stalls.txt"))
 
 # === Кнопки логов ===
-@dp.callback_query(F.data == "view_admin_log")
-async def cb_view_admin_log(callback: types.CallbackQuery):
-    if not is_admin(callback.from_user.id):
+@handlers.callback_query(F.data == "view_admin_log")
+async def cb_view_admin_log(callback: types.CallbackQuery, db: Database):
+    if not db.is_admin(callback.from_user.id):
         await callback.message.answer("❌ Доступ запрещён")
         return
     log_admin_action(callback.from_user.id, "Просмотрел admin.log")
-    await send_log_file(callback.message, "admin.log")
+    await send_log_file(callback.message, ADMIN_LOG)
     await callback.answer()
 
-@dp.callback_query(F.data == "view_logs")
-async def cb_view_logs(callback: types.CallbackQuery):
-    if not is_admin(callback.from_user.id):
+@handlers.callback_query(F.data == "view_logs")
+async def cb_view_logs(callback: types.CallbackQuery, db: Database):
+    if not db.is_admin(callback.from_user.id):
         await callback.message.answer("❌ Доступ запрещён")
         return
     log_admin_action(callback.from_user.id, "Просмотрел webhook.log")
-    await send_log_file(callback.message, "webhook.log")
+    await send_log_file(callback.message, WEBHOOK_LOG)
     await callback.answer()
 
-@dp.callback_query(F.data == "clear_logs")
-async def cb_clear_logs(callback: types.CallbackQuery):
-    if not is_admin(callback.from_user.id):
+@handlers.callback_query(F.data == "clear_logs")
+async def cb_clear_logs(callback: types.CallbackQuery, db: Database):
+    if not db.is_admin(callback.from_user.id):
         await callback.message.answer("❌ Доступ запрещён")
         return
 
-    for log_file in ["webhook.log", "errors.log", "admin.log"]:
+    for log_file in [WEBHOOK_LOG, ERRORS_LOG, ADMIN_LOG, BROADCAST_LOG]:
         try:
             if os.path.exists(log_file):
                 open(log_file, "w", encoding="utf-8").close()
@@ -852,22 +1105,21 @@ async def cb_clear_logs(callback: types.CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data == "start_broadcast")
-async def initiate_broadcast(callback: types.CallbackQuery, state: FSMContext):
+@handlers.callback_query(F.data == "start_broadcast")
+async def initiate_broadcast(callback: types.CallbackQuery, state: FSMContext, db: Database):
     await state.clear()
-    if not is_admin(callback.from_user.id):
+    if not db.is_admin(callback.from_user.id):
         await callback.message.answer("❌ Доступ запрещён")
         return
     await state.set_state(AdminStates.awaiting_broadcast_content)
     await callback.message.answer("📢 Введите сообщение или прикрепите файл/изображение для рассылки:")
     await callback.answer()
 
-@dp.message(AdminStates.awaiting_broadcast_content)
-async def process_broadcast_content(message: Message, state: FSMContext):
+@handlers.message(AdminStates.awaiting_broadcast_content)
+async def process_broadcast_content(message: Message, state: FSMContext, db: Database):
     await state.clear()
     await state.clear()
-    cursor.execute("SELECT user_id FROM users WHERE subscribed = 1")
-    users = [row[0] for row in cursor.fetchall()]
+    users = [row[0] for row in db.fetchall("SELECT user_id FROM users WHERE subscribed = 1")]
 
     success, failed = 0, 0
 
@@ -875,20 +1127,19 @@ async def process_broadcast_content(message: Message, state: FSMContext):
         try:
             if message.photo:
                 photo = message.photo[-1].file_id
-                await bot.send_photo(user_id, photo, caption=message.caption or "")
+                await message.bot.send_photo(user_id, photo, caption=message.caption or "")
             elif message.document:
                 file = message.document.file_id
-                await bot.send_document(user_id, file)
+                await message.bot.send_document(user_id, file)
             elif message.text:
-                await bot.send_message(user_id, message.text)
+                await message.bot.send_message(user_id, message.text)
             else:
                 continue  # игнорировать неподдерживаемые типы
             await asyncio.sleep(0.1)  # задержка чтобы не спамить
             success += 1
         except Exception as e:
             # Записываем ошибку в broadcast.log
-            with open("broadcast.log", "a", encoding="utf-8") as logf:
-                logf.write(f"[Broadcast Error] User {user_id}: {e}\n")
+            broadcast_logger.warning(f"[Broadcast Error] User {user_id}: {e}")
             failed += 1
 
     log_admin_action(
@@ -899,41 +1150,41 @@ async def process_broadcast_content(message: Message, state: FSMContext):
         f"✅ Рассылка завершена.\n\n📬 Успешно: {success}\n❌ Ошибок: {failed}"
     )
 
-@dp.message(Command("cancel"), AdminStates.awaiting_broadcast_content)
+@handlers.message(Command("cancel"), AdminStates.awaiting_broadcast_content)
 async def cancel_broadcast(message: Message, state: FSMContext):
     await state.clear()
     await state.clear()
     await message.answer("❌ Рассылка отменена.")
 
-@dp.message(F.text.in_(["⚙️ Админка", "админ", "Админ", "admin", "Admin"]))
-async def alias_admin_panel(message: Message):
-    await admin_panel(message)
+@handlers.message(F.text.in_(["⚙️ Админка", "админ", "Админ", "admin", "Admin"]))
+async def alias_admin_panel(message: Message, state: FSMContext, db: Database):
+    await admin_panel(message, state, db)
 
-@dp.message(Command("admin"))
-async def cmd_admin(message: Message):
-    await admin_panel(message)
+@handlers.message(Command("admin"))
+async def cmd_admin(message: Message, state: FSMContext, db: Database):
+    await admin_panel(message, state, db)
 
 # === Callback обработчик кнопки Криптобота === 
 
-@dp.callback_query(lambda c: c.data.startswith("activate_user_"))
-async def activate_user_callback(callback: types.CallbackQuery):
-    if not is_admin(callback.from_user.id):
+@handlers.callback_query(lambda c: c.data.startswith("activate_user_"))
+async def activate_user_callback(callback: types.CallbackQuery, db: Database):
+    if not db.is_admin(callback.from_user.id):
         await callback.answer("❌ Только для администратора!", show_alert=True)
         return
 
     try:
         user_id = int(callback.data.replace("activate_user_", ""))
-        activate_subscription(user_id)
+        db.activate_subscription(user_id)
         await callback.message.edit_reply_markup()  # убираем кнопку
         await callback.message.answer(f"✅ Подписка активирована для <code>{user_id}</code>!", parse_mode="HTML")
-        await bot.send_message(user_id, "🎉 Ваша подписка активирована администратором! Спасибо за оплату.")
+        await callback.bot.send_message(user_id, "🎉 Ваша подписка активирована администратором! Спасибо за оплату.")
         logging.info(f"[ADMIN] Подписка вручную открыта для {user_id} (через inline)")
         await callback.answer("Готово! Подписка активирована.")
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {e}", show_alert=True)
 
 # === Остальные проекты ===
-@dp.message(F.text.in_(["📎 Остальные проекты"]))
+@handlers.message(F.text.in_(["📎 Остальные проекты"]))
 async def project_links(message: Message):
     buttons = [
         [InlineKeyboardButton(text="🔗 It Market", url="https://t.me/Itmarket1_bot")],
@@ -946,13 +1197,13 @@ async def project_links(message: Message):
     await message.answer("📌 <b>Наши другие проекты:</b>", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
 
 # === Оплата подписки пользователем === 
-@dp.message(Command("buy"))
-@dp.message(F.text == "💰 Купить подписку")
-async def buy_subscription(message: Message):
+@handlers.message(Command("buy"))
+@handlers.message(F.text == "💰 Купить подписку")
+async def buy_subscription(message: Message, db: Database, ctx: BotApp):
     user_id = message.from_user.id
-    ensure_user(user_id)
+    db.ensure_user(user_id)
     try:
-        invoice_url = await create_invoice(user_id)
+        invoice_url = await get_invoice_url(ctx.cryptopay, db, user_id)
         if not invoice_url:
             await message.answer("❌ Не удалось создать ссылку на оплату. Попробуйте позже.")
             return
@@ -964,50 +1215,44 @@ async def buy_subscription(message: Message):
             )
         )
         await message.answer(
-            "⏳ После оплаты администратор вручную активирует вашу подписку.\n"
-            "Если хотите ускорить процесс — напишите админу свой ID!"
+            f"⏳ Ссылка действительна {INVOICE_TTL // 60} минут. "
+            "Подписка активируется автоматически сразу после оплаты."
         )
     except Exception as e:
         await message.answer(f"❌ Ошибка создания подписки: {e}")
  
 
 # ========== ТЕСТОВАЯ АКТИВАЦИЯ ==========
-@dp.message(Command("testpay"))
-async def test_payment(message: Message):
+@handlers.message(Command("testpay"))
+async def test_payment(message: Message, db: Database):
     user_id = message.from_user.id
-    if not is_admin(user_id):
+    if not db.is_admin(user_id):
         await message.answer("❌ Только для администратора!")
         return
-    activate_subscription(user_id)
+    db.activate_subscription(user_id)
     await message.answer("✅ Тестовая оплата прошла! Подписка активирована на 30 дней.")
     logging.info(f"🚦 [TESTPAY] Подписка активирована вручную для {user_id}")
 
         
-@dp.message(Command("pending_payments"))
-async def show_pending_payments(message: Message):
-    if not is_admin(message.from_user.id):
+@handlers.message(Command("pending_payments"))
+async def show_pending_payments(message: Message, db: Database):
+    if not db.is_admin(message.from_user.id):
         await message.answer("❌ Доступ запрещён")
         return
-    # Загрузить все оплаты
-    with open(payments_path, "r", encoding="utf-8") as f:
-        payments = json.load(f)
-    # Получить всех подписанных пользователей
-    cursor.execute("SELECT user_id FROM users WHERE subscribed = 1")
-    active_users = set(row[0] for row in cursor.fetchall())
-    # Найти тех, у кого есть оплата, но нет подписки
-    pending = [p for p in payments if int(p["user_id"]) not in active_users]
+    pending = db.pending_payments(20)
     if not pending:
         await message.answer("✅ Нет неоплаченных/неактивированных платежей.")
         return
     msg = "⏳ <b>Ожидают активации:</b>\n" + "\n".join(
-        f"• <code>{p['user_id']}</code> — {p['amount']} USDT, invoice: {p['invoice_id']}" for p in pending[-20:]
+        f"• <code>{user_id}</code> — {amount} {asset}, invoice: {invoice_id}"
+        for user_id, amount, asset, invoice_id in pending
     )
     await message.answer(msg, parse_mode="HTML")
 
 # === ✍️ Цитаты дня ===
 
-@dp.message(F.text.in_(['✍️ Цитаты дня']))
-async def handle_text_generation(message: Message, state: FSMContext):
+@handlers.message(F.text.in_(['✍️ Цитаты дня']))
+async def handle_text_generation(message: Message, state: FSMContext, db: Database, ctx: BotApp):
     await state.clear()
     control_buttons = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⏹ Остановить", callback_data="stop_generation")],
@@ -1015,22 +1260,22 @@ async def handle_text_generation(message: Message, state: FSMContext):
     ])
     await state.set_state("generating_text")
     await message.answer("🔄 Генерация цитаты...", reply_markup=control_buttons)
-    await generate_text_logic(message, state)
+    await generate_text_logic(message, state, db, ctx)
 
 
 # === Логика генерации ===
 
-async def generate_text_logic(message: Message, state: FSMContext):
+async def generate_text_logic(message: Message, state: FSMContext, db: Database, ctx: BotApp):
     try:
         user_id = message.from_user.id
-        ensure_user(user_id)
-        client = text_client
+        db.ensure_user(user_id)
+        client = ctx.text_client
 
         if client is None:
             await message.answer("❌ Ошибка: AI-клиент не настроен.")
             return
 
-        if str(user_id) != str(ADMIN_ID) and is_limited(user_id):
+        if db.is_limited(user_id):
             await message.answer("🔐 Лимит исчерпан. Купите подписку 💰")
             return
 
@@ -1042,13 +1287,7 @@ async def generate_text_logic(message: Message, state: FSMContext):
         text = response.choices[0].message.content.strip()
         await message.answer(f"🗋 Цитата дня:\n{text}")
 
-        if str(user_id) != str(ADMIN_ID):
-            increment_usage(user_id)
-            cursor.execute(
-                "INSERT INTO history (user_id, type, prompt) VALUES (?, ?, ?)",
-                (user_id, "text", "цитата дня")
-            )
-            conn.commit()
+        db.record_usage(user_id, "text", "цитата дня")
 
     except Exception as e:
         logging.exception("Ошибка генерации текста:")
@@ -1059,26 +1298,26 @@ async def generate_text_logic(message: Message, state: FSMContext):
 
 # === Управление и отмена ===
 
-@dp.callback_query(F.data == "stop_generation")
+@handlers.callback_query(F.data == "stop_generation")
 async def stop_generation(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer("⏹ Генерация остановлена.", reply_markup=main_menu())
     await callback.answer()
 
-@dp.callback_query(F.data == "back_to_menu")
+@handlers.callback_query(F.data == "back_to_menu")
 async def back_to_menu(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer("🔙 Возврат в меню", reply_markup=main_menu())
     await callback.answer()
 
-@dp.message(Command("cancel"))
+@handlers.message(Command("cancel"))
 async def cancel_generation(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("❌ Генерация отменена.", reply_markup=main_menu())
 
 # === 🌌 Gemini AI — Умный диалог ===
 
-@dp.message(F.text.in_("🌌 Gemini AI"))
+@handlers.message(F.text.in_("🌌 Gemini AI"))
 async def start_gemini_dialog(message: Message, state: FSMContext):
     await state.clear()
     control_buttons = InlineKeyboardMarkup(inline_keyboard=[
@@ -1089,8 +1328,8 @@ async def start_gemini_dialog(message: Message, state: FSMContext):
     await message.answer("🌌 Добро пожаловать в режим Gemini! Напиши свой вопрос:", reply_markup=control_buttons)
 
 
-@dp.message(StateAssistant.dialog)
-async def handle_gemini_dialog(message: Message, state: FSMContext):
+@handlers.message(StateAssistant.dialog)
+async def handle_gemini_dialog(message: Message, state: FSMContext, db: Database, ctx: BotApp):
     if message.text in ["🌌 Gemini AI", "🌠 Gemini Примеры", "🎨Создать изображение", "✍️ Цитаты дня"]:
         return
 
@@ -1102,14 +1341,14 @@ async def handle_gemini_dialog(message: Message, state: FSMContext):
             await message.answer("❌ Введите более развернутый запрос.")
             return
 
-        ensure_user(user_id)
-        client = text_client
+        db.ensure_user(user_id)
+        client = ctx.text_client
 
         if client is None:
             await message.answer("❌ Ошибка: AI-клиент не настроен.")
             return
 
-        if str(user_id) != str(ADMIN_ID) and is_limited(user_id):
+        if db.is_limited(user_id):
             await message.answer("🔒 Лимит исчерпан. Купите подписку 💰")
             return
 
@@ -1122,13 +1361,7 @@ async def handle_gemini_dialog(message: Message, state: FSMContext):
         reply = response.choices[0].message.content.strip()
         await message.answer(reply)
 
-        if str(user_id) != str(ADMIN_ID):
-            increment_usage(user_id)
-            cursor.execute(
-                "INSERT INTO history (user_id, type, prompt) VALUES (?, ?, ?)",
-                (user_id, "gemini", prompt)
-            )
-            conn.commit()
+        db.record_usage(user_id, "gemini", prompt)
 
     except Exception as e:
         logging.exception("Ошибка в Gemini:")
@@ -1136,14 +1369,14 @@ async def handle_gemini_dialog(message: Message, state: FSMContext):
 
 
 # === Обработчик остановки Gemini ===
-@dp.callback_query(F.data == "stop_assistant")
+@handlers.callback_query(F.data == "stop_assistant")
 async def stop_gemini(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer("⏹ Gemini остановлен.", reply_markup=main_menu())
     await callback.answer()
 
 
-@dp.callback_query(F.data == "back_to_menu")
+@handlers.callback_query(F.data == "back_to_menu")
 async def back_to_menu(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer("🔙 Возврат в меню", reply_markup=main_menu())
@@ -1153,7 +1386,7 @@ async def back_to_menu(callback: types.CallbackQuery, state: FSMContext):
 # === Gemini Примеры и обработка ===
 
 # === 🌠 Gemini Примеры ===
-@dp.message(F.text == "🌠 Gemini Примеры")
+@handlers.message(F.text == "🌠 Gemini Примеры")
 async def gemini_examples(message: Message, state: FSMContext):
     await state.clear()
     examples = [
@@ -1177,19 +1410,19 @@ async def gemini_examples(message: Message, state: FSMContext):
     await state.set_state(StateAssistant.dialog)
 
 
-@dp.callback_query()
-async def gemini_dispatch(callback: types.CallbackQuery, state: FSMContext):
+@handlers.callback_query()
+async def gemini_dispatch(callback: types.CallbackQuery, state: FSMContext, db: Database, ctx: BotApp):
     await state.clear()
     user_id = callback.from_user.id
-    ensure_user(user_id)
-    client = text_client
+    db.ensure_user(user_id)
+    client = ctx.text_client
 
     if client is None:
         await callback.message.answer("❌ AI-клиент не инициализирован.")
         await callback.answer()
         return
 
-    if str(user_id) != str(ADMIN_ID) and is_limited(user_id):
+    if db.is_limited(user_id):
         await callback.message.answer("🔒 Лимит исчерпан. Купите подписку 💰")
         await callback.answer()
         return
@@ -1229,13 +1462,7 @@ async def gemini_dispatch(callback: types.CallbackQuery, state: FSMContext):
         reply = response.choices[0].message.content.strip()
         await callback.message.answer(reply)
 
-        if str(user_id) != str(ADMIN_ID):
-            increment_usage(user_id)
-            cursor.execute(
-                "INSERT INTO history (user_id, type, prompt) VALUES (?, ?, ?)",
-                (user_id, "example", prompt)
-            )
-            conn.commit()
+        db.record_usage(user_id, "example", prompt)
 
     except Exception as e:
         logging.exception(f"Ошибка при генерации Gemini-ответа для prompt: {prompt}")
@@ -1244,10 +1471,11 @@ async def gemini_dispatch(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # === Endpoint для сайта /generate-image ===
-@app.post("/generate-image")
-async def generate_image(prompt: str = Form(...)):
+@site_router.post("/generate-image")
+async def generate_image(request: Request, prompt: str = Form(...)):
+    ctx: BotApp = request.app.state.ctx
     try:
-        dalle = await image_client.images.generate(
+        dalle = await ctx.image_client.images.generate(
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
@@ -1257,7 +1485,7 @@ async def generate_image(prompt: str = Form(...)):
         image_url = dalle.data[0].url if dalle and dalle.data else None
         if not image_url:
             return HTMLResponse(content="<b>❌ Не удалось получить изображение.</b>", status_code=500)
-        save_image_record(prompt, image_url)
+        save_image_record(ctx, prompt, image_url)
         return HTMLResponse(content=f"""
             <div style='text-align:center'>
                 <img src="{image_url}" style="max-width:320px;border-radius:12px;box-shadow:0 4px 18px #673ab722;">
@@ -1273,11 +1501,13 @@ async def generate_image(prompt: str = Form(...)):
 MAX_IMAGE_SIZE_MB = 10  # Максимальный размер файла (например, 10 МБ)
 MAX_PROMPT_LEN = 400    # Максимальная длина текста запроса
 
-@app.post("/analyze-image")
+@site_router.post("/analyze-image")
 async def analyze_image(
+    request: Request,
     prompt: str = Form(...), 
     file: UploadFile = File(...)
 ):
+    ctx: BotApp = request.app.state.ctx
     try:
         # Проверка длины prompt
         if len(prompt.strip()) < 2:
@@ -1300,7 +1530,7 @@ async def analyze_image(
         data_url = f"data:image/png;base64,{b64_image}"
 
         # Запрос к OpenAI Vision (gpt-4o)
-        vision_response = await image_client.chat.completions.create(
+        vision_response = await ctx.image_client.chat.completions.create(
             model="gpt-4o",
             messages=[{
                 "role": "user",
@@ -1326,17 +1556,55 @@ async def analyze_image(
         )
 
 # === Endpoint для сайта /gallery (коллаж) ===
-@app.get("/gallery")
-async def gallery():
+def gallery_html(images_path) -> str:
+    """Последние 9 картинок из images.json для коллажа на сайте."""
+    with open(images_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    img_tags = ""
+    for entry in reversed(data[-9:]):
+        url = entry.get("url")
+        if url:
+            img_tags += f'<img src="{url}" alt="AI Image" />\n'
+    return img_tags
+
+@site_router.get("/gallery")
+async def gallery(request: Request):
+    ctx: BotApp = request.app.state.ctx
     try:
-        with open(images_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        img_tags = ""
-        for entry in reversed(data[-9:]):
-            url = entry.get("url")
-            if url:
-                img_tags += f'<img src="{url}" alt="AI Image" />\n'
-        return HTMLResponse(img_tags)
+        return HTMLResponse(gallery_html(ctx.images_path))
     except Exception as e:
         return HTMLResponse(f"<b>Ошибка загрузки галереи: {e}</b>", status_code=500)
 
+# === Фабрика приложения ===
+def create_app(config: Config = None, *, bot: Bot = None, text_client=None,
+               image_client=None, cryptopay=None) -> FastAPI:
+    """
+    Собирает независимый экземпляр: своя база, бот, диспетчер и клиенты.
+    Клиенты можно передать готовыми (заглушки в тестах, общий пул соединений).
+    """
+    startup_timer = StartupTimer(IMPORT_STARTED)
+    startup_timer.mark("импорт модулей")
+    config = config or Config.from_env()
+    ctx = BotApp(config, bot=bot, text_client=text_client,
+                 image_client=image_client, cryptopay=cryptopay)
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.ctx = ctx
+    app.state.startup_timer = startup_timer
+    app.include_router(router)
+    app.include_router(crypto_router)
+    app.include_router(site_router)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "https://itm-code.ru",
+            "https://itm-code.ru/geminiapp",
+            "https://www.itm-code.ru",
+            "http://localhost:3000",
+            "http://localhost"
+        ],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
@@ -0,0 +1,357 @@
+# metrics.py
+# === Метрики в формате Prometheus (text exposition 0.0.4) ===
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+
+from profiling import record_phase, set_current_handler
+from tracing import record_span, span
+
+# Границы корзин в секундах: от быстрых запросов к SQLite до долгих генераций DALL·E
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение задаётся явно (set/inc/dec) или считается функцией в момент выгрузки."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), collect: Callable[[], float] = None):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+        self._collect = collect
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> list:
+        lines = self.header()
+        if self._collect is not None:
+            try:
+                lines.append(f"{self.name} {float(self._collect()):g}")
+            except Exception:
+                pass  # источник ещё не создан (например, логирование не настроено)
+            return lines
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, _HistogramSeries] = {}
+
+    def observe(self, *labels, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = _HistogramSeries(len(self.buckets) + 1)
+        # Храним попадания в отдельные корзины; накопительные суммы — только при выгрузке
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return series.count if series else 0
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, hits in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += hits
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.label_names, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_str} {series.sum:g}")
+            lines.append(f"{self.name}_count{label_str} {series.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), collect=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """
+    Набор метрик одного экземпляра бота.
+
+    Все замеры проходят через несколько точек: middleware aiogram (апдейты и
+    хендлеры), middleware сессии бота (Bot API), обёртка клиентов OpenAI и
+    хук Database.on_query (SQLite). Внутри хендлеров таймеров нет.
+    Эти же точки пишут фазы медленных апдейтов (profiling.py) и спаны (tracing.py).
+    """
+
+    def __init__(self):
+        self.registry = Registry()
+        r = self.registry
+        self.updates = r.counter("bot_updates_total", "Обработанные апдейты по типу события и тарифу пользователя",
+                                 ("event", "tier"))
+        self.updates_in_flight = r.gauge("bot_updates_in_flight", "Апдейты в обработке")
+        self.handler_latency = r.histogram("bot_handler_duration_seconds", "Время работы хендлера aiogram",
+                                           ("handler",))
+        self.handler_errors = r.counter("bot_handler_errors_total", "Исключения в хендлерах aiogram",
+                                        ("handler", "error"))
+        self.openai_latency = r.histogram("openai_request_duration_seconds", "Время запроса к OpenAI",
+                                          ("model", "call"))
+        self.openai_errors = r.counter("openai_errors_total", "Ошибки запросов к OpenAI",
+                                       ("model", "call", "error"))
+        self.openai_in_flight = r.gauge("openai_requests_in_flight", "Запросы к OpenAI в процессе")
+        self.db_latency = r.histogram("sqlite_query_duration_seconds", "Время запроса к users.db", ("query",))
+        self.db_errors = r.counter("sqlite_errors_total", "Ошибки запросов к users.db", ("query",))
+        self.bot_api_latency = r.histogram("telegram_api_duration_seconds", "Время запроса к Bot API",
+                                           ("method",))
+        self.bot_api_errors = r.counter("telegram_api_errors_total", "Ошибки запросов к Bot API",
+                                        ("method", "error"))
+        self.bot_api_in_flight = r.gauge("telegram_api_requests_in_flight", "Запросы к Bot API в процессе")
+        self.loop_lag = r.histogram("event_loop_lag_seconds", "Задержка цикла событий",
+                                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+        self.loop_stalls = r.counter("event_loop_stalls_total", "Блокировки цикла событий дольше порога")
+
+    def render(self) -> str:
+        return self.registry.render()
+
+    def observe_loop_lag(self, seconds: float, stalled: bool):
+        self.loop_lag.observe(value=seconds)
+        if stalled:
+            self.loop_stalls.inc()
+
+    def observe_query(self, label: str, seconds: float, error: BaseException = None):
+        self.db_latency.observe(label, value=seconds)
+        record_phase("sqlite", seconds)
+        record_span(f"sqlite {label}", seconds, error, query=label)
+        if error is not None:
+            self.db_errors.inc(label)
+
+
+# === aiogram: апдейты и хендлеры ===
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: считает апдейты в обработке."""
+
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        gauge = self.metrics.updates_in_flight
+        gauge.inc()
+        try:
+            return await handler(event, data)
+        finally:
+            gauge.dec()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner-middleware на message/callback_query: к этому моменту фильтры уже
+    выбрали хендлер, поэтому время и ошибки пишутся с его именем.
+
+    Тариф пользователя (метка user_tier) кэшируется на tier_ttl секунд, чтобы
+    метрики не добавляли запрос к базе в каждый апдейт.
+    """
+
+    def __init__(self, metrics: BotMetrics, event_name: str,
+                 tier_ttl: float = 60.0, max_cached: int = 10000):
+        self.metrics = metrics
+        self.event_name = event_name
+        self.tier_ttl = tier_ttl
+        self.max_cached = max_cached
+        self._tiers: "OrderedDict[int, Tuple[str, float]]" = OrderedDict()
+
+    def _user_tier(self, db, user_id: int) -> str:
+        now = time.monotonic()
+        cached = self._tiers.get(user_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        try:
+            tier = db.user_tier(user_id)
+        except Exception as e:
+            # Метрики не должны ронять апдейт пользователя
+            logging.warning(f"⚠️ Не удалось определить тариф {user_id} для метрик: {e}")
+            return "unknown"
+        self._tiers[user_id] = (tier, now + self.tier_ttl)
+        self._tiers.move_to_end(user_id)
+        if len(self._tiers) > self.max_cached:
+            self._tiers.popitem(last=False)
+        return tier
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        set_current_handler(name)
+        db = data.get("db")
+        user = getattr(event, "from_user", None)
+        tier = self._user_tier(db, user.id) if db is not None and user is not None else "unknown"
+        self.metrics.updates.inc(self.event_name, tier)
+        started = time.perf_counter()
+        try:
+            with span(f"handler.{name}", handler=name, user_tier=tier, user_id=user.id if user else 0):
+                return await handler(event, data)
+        except Exception as e:
+            self.metrics.handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.metrics.handler_latency.observe(name, value=time.perf_counter() - started)
+
+
+# === Bot API: middleware сессии aiogram ===
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        self.metrics.bot_api_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            with span(f"telegram.{name}", method=name):
+                return await make_request(bot, method)
+        except Exception as e:
+            self.metrics.bot_api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.bot_api_latency.observe(name, value=elapsed)
+            record_phase(f"telegram.{name}", elapsed)
+            self.metrics.bot_api_in_flight.dec()
+
+
+# === OpenAI: прозрачная обёртка клиента ===
+class InstrumentedClient:
+    """
+    Проксирует клиент AsyncOpenAI: client.chat.completions.create(...) и
+    client.images.generate(...) работают как прежде, но каждый вызов
+    корутины замеряется с метками model и call ("chat.completions.create").
+    """
+
+    __slots__ = ("_target", "_path", "_metrics")
+
+    def __init__(self, target, metrics: BotMetrics, path: str = ""):
+        self._target = target
+        self._path = path
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+        # методы openai обёрнуты синхронным декоратором (required_args) — смотрим на исходную функцию
+        if callable(value) and inspect.iscoroutinefunction(inspect.unwrap(value)):
+            return self._timed(value, path)
+        if name.startswith("_") or callable(value) or isinstance(value, (str, int, float, bool, type(None))):
+            return value
+        return InstrumentedClient(value, self._metrics, path)
+
+    def _timed(self, func, call: str):
+        metrics = self._metrics
+
+        async def wrapper(*args, **kwargs):
+            model = kwargs.get("model", "default")
+            metrics.openai_in_flight.inc()
+            started = time.perf_counter()
+            try:
+                with span(f"openai.{call}", model=model, call=call):
+                    return await func(*args, **kwargs)
+            except Exception as e:
+                metrics.openai_errors.inc(model, call, type(e).__name__)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                metrics.openai_latency.observe(model, call, value=elapsed)
+                record_phase(f"openai.{call}", elapsed)
+                metrics.openai_in_flight.dec()
+
+        return wrapper
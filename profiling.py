@@ -0,0 +1,279 @@
+# profiling.py
+# === Семплирующий профилировщик, журнал медленных апдейтов и задержка цикла событий ===
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+
+MAX_PROFILE_SECONDS = 60
+DEFAULT_INTERVAL = 0.005  # 200 снимков стека в секунду
+
+
+# === Профилировщик ===
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()  # формат flamegraph.pl: от корня к листу
+    return ";".join(labels)
+
+
+class SamplingProfiler:
+    """
+    Раз в interval секунд снимает стеки всех потоков процесса через
+    sys._current_frames() из отдельного потока. Цикл событий не
+    останавливается, накладные расходы — доли процента на время замера.
+    Результат — collapsed stacks для flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def _sample(self, seconds: float) -> _Counter:
+        stacks = _Counter()
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stacks[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def profile_sync(self, seconds: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Профилировщик уже запущен")
+        try:
+            stacks = self._sample(min(seconds, MAX_PROFILE_SECONDS))
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    async def profile(self, seconds: float) -> str:
+        """Снимает профиль в отдельном потоке, не блокируя цикл событий."""
+        return await asyncio.to_thread(self.profile_sync, seconds)
+
+
+# === Разбивка времени апдейта ===
+class UpdateTiming:
+    __slots__ = ("started", "handler", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler: Optional[str] = None
+        self.phases: Dict[str, list] = {}
+
+    def add(self, phase: str, seconds: float):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+_current_timing: ContextVar[Optional[UpdateTiming]] = ContextVar("update_timing", default=None)
+
+
+def record_phase(phase: str, seconds: float):
+    """Добавляет время в разбивку текущего апдейта (если он есть)."""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+def set_current_handler(name: str):
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.handler = name
+
+
+class SlowUpdateLog:
+    """Кольцевой буфер последних апдейтов дольше threshold секунд."""
+
+    def __init__(self, threshold: float = 1.0, maxlen: int = 200):
+        self.threshold = threshold
+        self._records = deque(maxlen=maxlen)
+
+    def add(self, record: dict):
+        self._records.append(record)
+
+    def dump(self) -> List[dict]:
+        return list(self._records)
+
+    def clear(self):
+        self._records.clear()
+
+
+class SlowUpdateMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на dp.update: открывает разбивку времени апдейта, а
+    замеры Bot API, OpenAI и SQLite (см. metrics.py) дописывают в неё свои фазы.
+    """
+
+    def __init__(self, log: SlowUpdateLog):
+        self.log = log
+
+    async def __call__(self, handler, event, data):
+        timing = UpdateTiming()
+        token = _current_timing.set(timing)
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_timing.reset(token)
+            total = time.perf_counter() - timing.started
+            if total >= self.log.threshold:
+                self.log.add(self._record(event, data, timing, total, error))
+
+    @staticmethod
+    def _record(event, data, timing: UpdateTiming, total: float, error: Optional[str]) -> dict:
+        user = data.get("event_from_user")
+        accounted = sum(seconds for seconds, _ in timing.phases.values())
+        return {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "update_id": getattr(event, "update_id", None),
+            "event": getattr(event, "event_type", None),
+            "user_id": user.id if user else None,
+            "handler": timing.handler,
+            "total_ms": round(total * 1000, 1),
+            "phases": {
+                phase: {"ms": round(seconds * 1000, 1), "calls": calls}
+                for phase, (seconds, calls) in sorted(timing.phases.items(), key=lambda p: -p[1][0])
+            },
+            "other_ms": round(max(total - accounted, 0.0) * 1000, 1),
+            "error": error,
+        }
+
+
+# === Задержка цикла событий ===
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _describe(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _offender(frame) -> str:
+    """Ключ виновника: ближайший кадр нашего кода и то, что он вызвал."""
+    leaf = _describe(frame)
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(_PROJECT_DIR):
+            own = _describe(frame)
+            return own if own == leaf else f"{own} → {leaf}"
+        frame = frame.f_back
+    return leaf
+
+
+class LoopLagMonitor:
+    """
+    Корутина раз в interval секунд засыпает и меряет, насколько позже
+    проснулась — это и есть задержка цикла. Сторожевой поток следит за её
+    «пульсом»: если цикл не отвечает дольше threshold, он снимает стек
+    потока цикла — там и находится блокирующий код (sync SQLite, файлы и т.п.).
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05,
+                 on_lag=None, max_offenders: int = 200):
+        self.threshold = threshold
+        self.interval = interval
+        self.on_lag = on_lag  # on_lag(seconds, stalled) — экспорт в метрики
+        self.max_offenders = max_offenders
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.offenders: Dict[str, dict] = {}
+        self._heartbeat = time.monotonic()
+        self._captured: Optional[str] = None
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(now - expected, 0.0)
+            stalled = lag >= self.threshold
+            if self.on_lag is not None:
+                self.on_lag(lag, stalled)
+            self.max_lag = max(self.max_lag, lag)
+            if stalled:
+                self.stalls += 1
+                self._account(self._captured or "не пойман (короче интервала сторожа)", lag)
+            self._captured = None
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            if self._captured is not None:
+                continue  # этот простой уже пойман, ждём, пока цикл оживёт
+            if time.monotonic() - self._heartbeat < self.threshold + self.interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            key = _offender(frame)
+            entry = self._entry(key)
+            if entry is not None and not entry["stack"]:
+                entry["stack"] = _collapse(frame).replace(";", "\n")
+            self._captured = key
+
+    def _entry(self, key: str) -> Optional[dict]:
+        entry = self.offenders.get(key)
+        if entry is None:
+            if len(self.offenders) >= self.max_offenders:
+                return None
+            entry = self.offenders[key] = {"count": 0, "total": 0.0, "max": 0.0, "stack": ""}
+        return entry
+
+    def _account(self, key: str, lag: float):
+        entry = self._entry(key)
+        if entry is not None:
+            entry["count"] += 1
+            entry["total"] += lag
+            entry["max"] = max(entry["max"], lag)
+
+    def worst(self, limit: int = 10) -> List[tuple]:
+        return sorted(self.offenders.items(), key=lambda item: -item[1]["total"])[:limit]
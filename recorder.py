@@ -0,0 +1,148 @@
+# recorder.py
+# === Запись входящих апдейтов для воспроизведения (bench/replay.py) ===
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Iterator, Optional
+
+# Служебный id, под которым в записи оказывается администратор (в тестовом экземпляре ADMIN_ID=1)
+REPLAY_ADMIN_ID = 1
+
+# Что делать с текстом сообщений: keep — сохранить, hash — заменить хешем той же длины,
+# drop — выкинуть. Команды, кнопки меню и callback_data бота сохраняются всегда.
+TEXT_POLICIES = ("keep", "hash", "drop")
+
+_NAME_FIELDS = ("first_name", "last_name", "username", "title", "bio")
+_DROP_FIELDS = ("contact", "location", "venue", "photo", "document", "video", "voice",
+                "audio", "sticker", "animation", "video_note")
+
+
+class Anonymizer:
+    """
+    id пользователей и чатов заменяются на стабильные псевдонимы (HMAC с солью,
+    которая живёт только в памяти процесса), так что последовательности действий
+    одного пользователя сохраняются, а исходные id восстановить нельзя.
+    """
+
+    def __init__(self, admin_id: int, text_policy: str = "hash", keep_texts=()):
+        if text_policy not in TEXT_POLICIES:
+            raise ValueError(f"RECORD_TEXT должен быть одним из {TEXT_POLICIES}")
+        self.admin_id = admin_id
+        self.text_policy = text_policy
+        self.keep_texts = set(keep_texts)
+        self._salt = os.urandom(16)
+
+    def user_id(self, value: int) -> int:
+        if value == self.admin_id:
+            return REPLAY_ADMIN_ID
+        digest = hmac.new(self._salt, str(value).encode(), hashlib.sha256).digest()
+        sign = -1 if value < 0 else 1  # группы и каналы остаются отрицательными
+        return sign * (10**9 + int.from_bytes(digest[:6], "big") % 10**9)
+
+    def text(self, value: str) -> Optional[str]:
+        if self.text_policy == "keep" or value.startswith("/") or value in self.keep_texts:
+            return value
+        if self.text_policy == "drop":
+            return None
+        digest = hmac.new(self._salt, value.encode(), hashlib.sha256).hexdigest()
+        return (digest * (len(value) // len(digest) + 1))[:len(value)]
+
+    def update(self, data):
+        if isinstance(data, list):
+            return [self.update(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        result = {}
+        for key, value in data.items():
+            if key in _DROP_FIELDS:
+                continue
+            if key in _NAME_FIELDS and isinstance(value, str):
+                result[key] = "anon" if key == "first_name" else None
+            elif key == "id" and isinstance(value, int) and ("is_bot" in data or "type" in data):
+                result[key] = self.user_id(value)  # объекты User и Chat
+            elif key in ("user_id", "chat_id") and isinstance(value, int):
+                result[key] = self.user_id(value)
+            elif key in ("text", "caption") and isinstance(value, str):
+                text = self.text(value)
+                if text is not None:
+                    result[key] = text
+            elif key == "data" and isinstance(value, str) and value.startswith("activate_user_"):
+                result[key] = f"activate_user_{self.user_id(int(value[len('activate_user_'):]))}"
+            else:
+                result[key] = self.update(value)
+        return {k: v for k, v in result.items() if v is not None}
+
+
+class UpdateRecorder:
+    """
+    Пишет апдейты в gzip-JSONL: {"t": секунды от начала записи, "u": апдейт}.
+    Анонимизация и запись на диск идут в фоновом потоке, /webhook не ждёт диска.
+    """
+
+    def __init__(self, path: str, anonymizer: Anonymizer, flush_interval: float = 1.0):
+        self.path = path
+        self.anonymizer = anonymizer
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.dropped = 0
+        self._started = time.monotonic()
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+
+    def record(self, update: dict):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="update-recorder", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((time.monotonic() - self._started, update))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while time.monotonic() < deadline:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0.001)))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = []
+            for item in batch:
+                if item is None:
+                    continue
+                offset, update = item
+                try:
+                    record = {"t": round(offset, 4), "u": self.anonymizer.update(update)}
+                except Exception as e:
+                    logging.warning(f"⚠️ Апдейт не записан: {e}")
+                    continue
+                lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            if lines:
+                # Каждая пачка — отдельный gzip-member: файл читается целиком даже после падения
+                with gzip.open(self.path, "at", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                self.recorded += len(lines)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+def read_recording(path: str) -> Iterator[tuple]:
+    """(смещение в секундах, апдейт) из файла записи."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["t"], record["u"]
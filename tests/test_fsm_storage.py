@@ -0,0 +1,29 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_overflow_keeps_just_loaded_record(tmp_path):
+    # Кэш полон, все старые записи грязные: новая запись не должна выгружаться сразу
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), max_cached=2)
+        try:
+            await storage.set_state(_key(1), "a")
+            await storage.set_state(_key(2), "b")
+            await storage.set_data(_key(3), {"x": 1})
+            assert await storage.get_data(_key(3)) == {"x": 1}
+            storage.flush()
+            storage._evict_overflow()
+            assert len(storage._cache) <= 2
+            assert await storage.get_data(_key(3)) == {"x": 1}
+            assert await storage.get_state(_key(1)) == "a"
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
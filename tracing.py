@@ -0,0 +1,277 @@
+# tracing.py
+# === Трассировка апдейтов: correlation ID и спаны на contextvars ===
+import abc
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def current_trace_id() -> Optional[str]:
+    """Correlation ID текущего апдейта (для логов и ответов)."""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name",
+                 "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: Optional[str], attributes: dict):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, end_ns: int = None):
+        self.end_ns = end_ns or time.time_ns()
+        self.tracer.exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _UnsampledSpan:
+    """Апдейт не попал в выборку: correlation ID есть, но ничего не пишется."""
+    __slots__ = ("tracer", "trace_id", "span_id")
+
+    recording = False
+
+    def __init__(self, tracer, trace_id: str):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, end_ns: int = None):
+        pass
+
+
+# === Экспорт ===
+class _BatchExporter(abc.ABC):
+    """Спаны копятся в очереди и пишутся пачками в фоновом потоке."""
+
+    def __init__(self, batch_size: int = 256, flush_interval: float = 2.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self.dropped = 0
+
+    def export(self, span: Span):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1  # при перегрузке теряем спаны, а не задерживаем апдейты
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [s for s in batch if s is not None]
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    logging.warning(f"⚠️ Не удалось выгрузить {len(batch)} спанов: {e}")
+            if stop:
+                return
+
+    @abc.abstractmethod
+    def write(self, batch: list):
+        """Выгружает пачку спанов; вызывается из фонового потока."""
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+class JsonlExporter(_BatchExporter):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def write(self, batch: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in batch:
+                f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+
+class OtlpHttpExporter(_BatchExporter):
+    """OTLP/HTTP JSON (POST {endpoint}/v1/traces) — для Jaeger, Tempo, otel-collector."""
+
+    def __init__(self, endpoint: str, service_name: str = "gemini-bot", **kwargs):
+        super().__init__(**kwargs)
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+
+    @staticmethod
+    def _attribute(key, value) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _span(self, span: dict) -> dict:
+        end_ns = span["start_ns"] + int(span["duration_ms"] * 1e6)
+        return {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "parentSpanId": span["parent_id"] or "",
+            "name": span["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(span["start_ns"]),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [self._attribute(k, v) for k, v in span["attributes"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+
+    def write(self, batch: list):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [self._span(s) for s in batch]}],
+            }]
+        }
+        request = urllib.request.Request(
+            self.url, data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        urllib.request.urlopen(request, timeout=10).close()
+
+
+# === Трассировщик ===
+class Tracer:
+    """
+    sample_rate — доля апдейтов, чьи спаны выгружаются (0 — только correlation ID).
+    Решение принимается для корневого спана, дочерние его наследуют.
+    """
+
+    def __init__(self, exporter: _BatchExporter = None, sample_rate: float = 0.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Корневой спан апдейта: новый correlation ID."""
+        trace_id = _new_id(16)
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            span = Span(self, name, trace_id, None, attributes)
+        else:
+            span = _UnsampledSpan(self, trace_id)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            if span.recording:
+                span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Дочерний спан внутри текущего апдейта; вне трассы или вне выборки ничего не делает."""
+    parent = _current_span.get()
+    if parent is None or not parent.recording:
+        yield parent
+        return
+    child = Span(parent.tracer, name, parent.trace_id, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def record_span(name: str, seconds: float, error: BaseException = None, **attributes):
+    """Завершённый спан задним числом — для синхронных замеров вроде запросов SQLite."""
+    parent = _current_span.get()
+    if parent is None or not parent.recording:
+        return
+    end_ns = time.time_ns()
+    child = Span(parent.tracer, name, parent.trace_id, parent.span_id, attributes)
+    child.start_ns = end_ns - int(seconds * 1e9)
+    if error is not None:
+        child.error = f"{type(error).__name__}: {error}"
+    child.end(end_ns)
+
+
+def set_attributes(**attributes):
+    """Дополняет атрибуты текущего спана (тариф пользователя, модель и т.п.)."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def tracer_from_env(default_path: str) -> Tracer:
+    """TRACE_SAMPLE_RATE, TRACE_OTLP_ENDPOINT (иначе JSONL в TRACE_FILE или default_path)."""
+    rate = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+    if rate <= 0:
+        return Tracer()
+    endpoint = os.getenv("TRACE_OTLP_ENDPOINT")
+    exporter = OtlpHttpExporter(endpoint) if endpoint else JsonlExporter(os.getenv("TRACE_FILE", default_path))
+    return Tracer(exporter, sample_rate=rate)